@@ -1,219 +1,299 @@
 import streamlit as st
 import pandas as pd
-from collections import defaultdict
-import graphviz
-import io
+import json
+import os
+from datetime import date, timedelta
+from ubo_engine import sanitize_id, compute_ubo, propagate_control, ownership_sums_per_entity, get_relationship_status, CircularOwnershipError
+from path_trie import ubo_path_trie
+from sensitivity import ubo_flips
+from result_cache import LRUResultCache
+from incremental import IncrementalOwnership
+from graph_store import GraphStore
+from bulk_import import import_registry
+from diagram import make_dot
+from diagram_render import PngRenderer
+from instrumentation import start_run, record_frame
+from graph_db import GraphDatabase
+from frame_buffer import ColumnarTable
+from shared_registry import SharedRegistry, RegistryOverlay
+from entity_search import EntitySearchIndex
+from ownership_history import OwnershipHistory, ubo_changes, day_number, date_text
 
 st.set_page_config(page_title="UBO Calculator", layout="wide")
 st.title("Ultimate Beneficial Owner Calculator")
 
-# Session State dataframes
-if "entities" not in st.session_state: 
-  st.session_state.entities = pd.DataFrame(columns=["EntityID", "Name", "Type", "Layer"])
+# Timings and counters for this rerun. A rerun cut short by st.rerun() (every edit
+# ends with one) never reaches the panel, so it is shown alongside the next one.
+previous_run = st.session_state.get("perf_run")
+if previous_run is not None:
+  previous_run.stop_profile()
+perf = start_run("rerun")
+st.session_state.perf_run = perf
 
-if "relationships" not in st.session_state: 
-  st.session_state.relationships = pd.DataFrame(columns=["OwnerID", "OwnedID", "RelationshipType", "OwnershipPct"])
+# Session State tables; edits go to these and the frames below are views of them
+if "entity_table" not in st.session_state: 
+  st.session_state.entity_table = ColumnarTable(["EntityID", "Name", "Type", "Layer"], key="EntityID")
 
-entities = st.session_state.entities 
-relationships = st.session_state.relationships
+if "relationship_table" not in st.session_state: 
+  st.session_state.relationship_table = ColumnarTable(["OwnerID", "OwnedID", "RelationshipType", "OwnershipPct", "ValidFrom", "ValidTo"], index_on=("OwnerID", "OwnedID"))
 
-# Utilities
-def sanitize_id(name: str) -> str: 
-  return "".join(ch.lower() for ch in name if ch.isalnum())[:15]
-
-def build_adj(df: pd.DataFrame, rel_type: str = "Equity"): 
-  adj = defaultdict(list) 
-  for _, r in df[df["RelationshipType"] == rel_type].iterrows(): 
-    adj[r["OwnerID"]].append((r["OwnedID"], float(r["OwnershipPct"])))
-  return adj
-
-def find_paths(source: str, target: str, adj: dict): 
-  out = [] 
-  stack = [(source, [source], 1.0)] 
-  while stack: 
-    node, path, product = stack.pop() 
-    if node == target and len(path) > 1: 
-      out.append((path, product)) 
-      continue 
-    for child, pct in adj.get(node, []):
-      if child in path: 
-        continue  
-      stack.append((child, path + [child], product * pct)) 
-  return out
-
-def compute_all_ultimate_ownership(entities: pd.DataFrame, relationships: pd.DataFrame, target: str):
-  """Calculate ultimate ownership of target for ALL entities (not just above threshold)"""
-  adj = build_adj(relationships, rel_type="Equity") 
-  all_entity_ids = set(entities['EntityID'])
-  entity_names = entities.set_index("EntityID")["Name"].to_dict()
-  entity_types = entities.set_index("EntityID")["Type"].to_dict()
-  
-  # Calculate for every entity
-  ultimate_ownership = {}
-  
-  for entity_id in all_entity_ids:
-    paths = find_paths(entity_id, target, adj)
-    total_ownership = sum(prod for _, prod in paths)
-    if total_ownership > 0:
-      ultimate_ownership[entity_id] = {
-        'EntityID': entity_id,
-        'Name': entity_names.get(entity_id, entity_id),
-        'Type': entity_types.get(entity_id, 'Unknown'),
-        'UltimateOwnership': total_ownership
-      }
-  
-  return ultimate_ownership
-
-def compute_ubo(entities: pd.DataFrame, relationships: pd.DataFrame, target: str, threshold: float): 
-  adj = build_adj(relationships, rel_type="Equity") 
-  sources = sorted(set(relationships[relationships["RelationshipType"]=="Equity"]["OwnerID"])) 
-  entity_names = entities.set_index("EntityID")["Name"].to_dict() 
-  
-  paths_records = [] 
-  for src in sources: 
-    paths = find_paths(src, target, adj) 
-    for pth, prod in paths: 
-      paths_records.append({ 
-        "OwnerID": src, 
-        "OwnerName": entity_names.get(src, src), 
-        "PathIDs": " -> ".join(pth), 
-        "PathNames": " -> ".join(entity_names.get(i, i) for i in pth), 
-        "PathOwnershipPct": prod, 
-        "FinalTarget": entity_names.get(target, target),
-      }) 
-  paths_df = pd.DataFrame(paths_records) 
-  if paths_df.empty: 
-    agg = pd.DataFrame(columns=["OwnerID","OwnerName","AggregatedOwnershipPct","UBO_Flag"])
-    return agg, paths_df 
-
-  agg = paths_df.groupby(["OwnerID","OwnerName"])['PathOwnershipPct'].sum().reset_index() 
-  agg.rename(columns={"PathOwnershipPct":"AggregatedOwnershipPct"}, inplace=True) 
-  agg['UBO_Flag'] = agg['AggregatedOwnershipPct'] >= threshold  
-  agg.sort_values('AggregatedOwnershipPct', ascending=False, inplace=True) 
-
-  paths_df.sort_values(['OwnerName','PathOwnershipPct'], ascending=[True, False], inplace=True) 
-  return agg, paths_df
-
-def ownership_sums_per_entity(relationships: pd.DataFrame): 
-  df = relationships[relationships['RelationshipType']=="Equity"].copy()
-  if df.empty:
-    return pd.DataFrame(columns=['OwnedID', 'OwnershipPct'])
-  df['OwnershipPct'] = df['OwnershipPct'].astype(float) 
-  sums = df.groupby('OwnedID')['OwnershipPct'].sum().reset_index() 
-  return sums
-
-def get_relationship_status(owner_id: str, owned_id: str, relationships: pd.DataFrame):
-  """Check if an entity is a shareholder, director, or both"""
-  rels = relationships[(relationships['OwnerID'] == owner_id) & (relationships['OwnedID'] == owned_id)]
-  
-  has_equity = any(rels['RelationshipType'] == 'Equity')
-  has_directorship = any(rels['RelationshipType'] == 'Directorship')
-  
-  if has_equity and has_directorship:
-    return "both"
-  elif has_equity:
-    return "shareholder"
-  elif has_directorship:
-    return "director"
-  return None
-
-def make_dot(entities: pd.DataFrame, relationships: pd.DataFrame, target: str): 
-  names = entities.set_index('EntityID')['Name'].to_dict() 
-  types = entities.set_index('EntityID')['Type'].to_dict() 
-  layers = entities.set_index('EntityID')['Layer'].to_dict() 
-  
-  # Calculate ultimate ownership
-  ultimate_ownership = compute_all_ultimate_ownership(entities, relationships, target)
-
-  # Node styling 
-  company_style = 'shape=box, style=filled, color=white, fontcolor=white, fillcolor="#1f5f7a"' 
-  person_style = 'shape=box, style=filled, color=white, fontcolor=white, fillcolor="#f28c28"' 
-
-  dot_lines = ["digraph G {", "rankdir=TB", "splines=true", "fontname=Helvetica", "node [fontname=Helvetica, fontsize=10]", "edge [fontname=Helvetica, color=\"#2c3e50\", fontsize=9]"] 
-
-  # Subgraphs to keep same ranks for each layer 
-  max_layer = int(entities['Layer'].max()) if not entities.empty else 0 
-  for L in range(0, max_layer+1): 
-    dot_lines.append(f"subgraph cluster_layer_{L} {{ rank=same; color=\"#ffffff00\"; label=\"\";") 
-    for eid, row in entities[entities['Layer']==L].set_index('EntityID').iterrows(): 
-      style = company_style if row['Type'] == 'Company' else person_style 
-      label = names.get(eid, eid)
-      
-      # Add type label
-      type_label = "Company" if row['Type'] == 'Company' else "Person"
-      
-      # Add ultimate ownership to label if this entity owns the target
-      if eid in ultimate_ownership and eid != target:
-        ult_pct = ultimate_ownership[eid]['UltimateOwnership'] * 100
-        label = f"{label}\\n[{type_label}]\\n({ult_pct:.2f}% of target)"
-      else:
-        label = f"{label}\\n[{type_label}]"
-      
-      dot_lines.append(f"\"{eid}\" [{style}, label=\"{label}\"];") 
-    dot_lines.append("}") 
-
-  # Process relationships - group by owner-owned pair
-  relationship_pairs = {}
-  for _, r in relationships.iterrows():
-    key = (r['OwnerID'], r['OwnedID'])
-    if key not in relationship_pairs:
-      relationship_pairs[key] = {'equity': None, 'directorship': False}
-    
-    if r['RelationshipType'] == 'Equity':
-      relationship_pairs[key]['equity'] = float(r['OwnershipPct'])
-    else:
-      relationship_pairs[key]['directorship'] = True
-
-  # Edges with combined labels
-  for (owner, owned), rels in relationship_pairs.items():
-    labels = []
-    
-    if rels['equity'] is not None:
-      pct = rels['equity'] * 100
-      labels.append(f"{pct:.1f}% equity")
-    
-    if rels['directorship']:
-      labels.append("director")
-    
-    label_text = " + ".join(labels)
-    
-    # Use solid line if any equity, dashed if only directorship
-    if rels['equity'] is not None:
-      dot_lines.append(f"\"{owner}\" -> \"{owned}\" [label=\"{label_text}\", arrowsize=0.8];")
-    else:
-      dot_lines.append(f"\"{owner}\" -> \"{owned}\" [style=dashed, arrowsize=0.6, color=\"#7f8c8d\", label=\"{label_text}\"];")
-  
-  dot_lines.append("}") 
-  return "\n".join(dot_lines)
+entity_table = st.session_state.entity_table
+relationship_table = st.session_state.relationship_table
+entities = entity_table.frame() 
+relationships = relationship_table.frame()
+record_frame("entities", entities)
+record_frame("relationships", relationships)
 
-def render_diagram_to_png(dot_string: str):
-  """Render DOT string to PNG bytes"""
+# Utilities
+def current_graph_version():
+  """graph_version of the session tables, from their per-change fingerprints"""
+  return entity_table.fingerprint() + relationship_table.fingerprint()
+
+def next_graph_key():
+  """graph_key after an edit to undated rows or entities; such edits leave the as-of epoch as it is"""
+  return current_graph_version() + as_of_suffix
+
+@st.cache_resource
+def get_graph_db():
+  """Process-wide SQLite store when UBO_DB_PATH is set; otherwise the data lives only in the session"""
+  path = os.environ.get("UBO_DB_PATH")
+  return GraphDatabase(path) if path else None
+
+@st.cache_resource
+def get_shared_registry():
+  """Master registry shared by every session, when UBO_REGISTRY_ENTITIES and UBO_REGISTRY_RELATIONSHIPS are set"""
+  entities_path = os.environ.get("UBO_REGISTRY_ENTITIES")
+  relationships_path = os.environ.get("UBO_REGISTRY_RELATIONSHIPS")
+  return SharedRegistry(entities_path, relationships_path) if entities_path and relationships_path else None
+
+# Where the session frames are loaded from and edits written to, if anywhere: this
+# session's overlay on the shared registry, or the SQLite database
+registry = get_shared_registry()
+if registry is not None:
+  if "registry_overlay" not in st.session_state:
+    st.session_state.registry_overlay = RegistryOverlay(registry)
+  graph_db = st.session_state.registry_overlay
+else:
+  graph_db = get_graph_db()
+
+@st.cache_resource
+def get_png_renderer():
+  """One background renderer per server process, shared by all sessions"""
+  return PngRenderer()
+
+def entity_exists(entity_id: str) -> bool:
+  if graph_db is not None:
+    return graph_db.has_entity(entity_id)
+  return entity_id in entity_table
+
+PICKER_PAGE_ROWS = 50
+
+def session_search():
+  """Name / ID search over the entities loaded in this session, rebuilt when they change"""
+  cached = st.session_state.get("entity_search")
+  if cached is None or cached[0] is not entities:
+    cached = (entities, EntitySearchIndex(entities['EntityID'], entities['Name'], entities['Type']))
+    st.session_state.entity_search = cached
+  return cached[1]
+
+def entity_search():
+  """Where pickers over every entity search: the database or registry if there is one"""
+  return graph_db if graph_db is not None else session_search()
+
+def entity_picker(label: str, key: str, source, entity_type: str = None, current: str = None, container=st):
+  """Search box and one page of matches feeding a selectbox of EntityIDs; returns the chosen ID"""
+  query = container.text_input(f"Search: {label}", key=f"{key}_query", placeholder="Name or ID")
+  page_key = f"{key}_page"
+  page = st.session_state.get(page_key, 1)
+  total, rows = source.search_entities(query, entity_type, (page - 1) * PICKER_PAGE_ROWS, PICKER_PAGE_ROWS)
+  pages = max(1, -(-total // PICKER_PAGE_ROWS))
+  if page > pages:
+    # Fewer matches than before: back to the last page (the widget is not drawn yet this run)
+    page = st.session_state[page_key] = pages
+    total, rows = source.search_entities(query, entity_type, (page - 1) * PICKER_PAGE_ROWS, PICKER_PAGE_ROWS)
+  if pages > 1:
+    container.number_input(f"Page (of {pages}, {total} matches)", min_value=1, max_value=pages, key=page_key)
+  names = dict(rows)
+  options = list(names)
+  # The current choice stays selectable while the search shows other entities
+  if current is not None and current not in names:
+    options.insert(0, current)
+  if not options:
+    container.selectbox(label, ["No matches"], disabled=True, key=key)
+    return None
+  return container.selectbox(label, options, index=options.index(current) if current in options else 0,
+                             format_func=lambda e: f"{names[e]} ({e})" if e in names else e, key=key)
+
+def ownership_table(ultimate_ownership: dict, control: dict, target: str) -> pd.DataFrame:
+  """Ultimate ownership of target per entity, plus controllers with no equity, and how each controls it"""
+  ult_df = pd.DataFrame(ultimate_ownership.values(), columns=['EntityID', 'Name', 'Type', 'UltimateOwnership'])
+  missing = [c for c in control if c not in ultimate_ownership]
+  if missing:
+    extra = pd.DataFrame([{'EntityID': c, 'Name': store.name(c), 'Type': store.record(c).type if store.record(c) else 'Unknown', 'UltimateOwnership': 0.0} for c in missing])
+    ult_df = pd.concat([ult_df, extra], ignore_index=True)
+  ult_df = ult_df[ult_df['EntityID'] != target]  # Don't show target owning itself
+  ult_df['Control'] = ult_df['EntityID'].map(control).fillna("")
+  return ult_df
+
+def validity_label(valid_from, valid_to) -> str:
+  """", from 2024-01-01 to 2025-03-31" for a dated relationship, "" for one that always holds"""
+  valid_from, valid_to = date_text(valid_from), date_text(valid_to)
+  if valid_from and valid_to:
+    return f", {valid_from} to {valid_to}"
+  if valid_from:
+    return f", from {valid_from}"
+  if valid_to:
+    return f", until {valid_to}"
+  return ""
+
+def as_date(value):
+  """A stored ValidFrom / ValidTo as a date for st.date_input, or None"""
+  text = date_text(value)
+  return None if text is None else date.fromisoformat(text)
+
+def path_limits_text(options: dict) -> str:
+  """The path listing limits in force, in words, or "" if every path is listed"""
+  limits = []
+  if options["min_product"] > 0:
+    limits.append(f"paths of at least {options['min_product']*100:g}%")
+  if options["max_depth"]:
+    limits.append(f"at most {options['max_depth']} links long")
+  if options["top_k"]:
+    limits.append(f"the top {options['top_k']} per owner")
+  return ", ".join(limits)
+
+def png_download(job, slot):
+  """Download button for a finished background render"""
   try:
-    graph = graphviz.Source(dot_string)
-    png_bytes = graph.pipe(format='png')
-    return png_bytes
+    png_data = job.result()
   except Exception as e:
-    st.error(f"Error rendering diagram: {e}")
-    return None
+    slot.error(f"Error rendering diagram: {e}")
+    return
+  slot.download_button(label="Download Diagram (PNG)", data=png_data, file_name="ownership_diagram.png", mime="image/png")
+
+@st.fragment(run_every=1.0)
+def wait_for_png(job):
+  """Checks on a background render once a second without rerunning the page, then reruns it once done"""
+  if job.done():
+    st.rerun()
+  st.caption("Rendering the diagram PNG...")
+
+def show_run_metrics(metrics, key: str = "current"):
+  """Timings, counters and frame sizes of one rerun, with the profile downloads if captured"""
+  if metrics.finished:
+    st.metric("Rerun time", f"{metrics.elapsed * 1000:,.0f} ms")
+  if metrics.timings:
+    steps = pd.DataFrame([{"Step": name, "Calls": calls, "ms": round(seconds * 1000, 1)} for name, (calls, seconds) in metrics.timings.items()])
+    st.dataframe(steps.sort_values("ms", ascending=False), use_container_width=True, hide_index=True)
+  figures = [{"Counter": name, "Value": value} for name, value in {**metrics.counters, **metrics.maxima}.items()]
+  if figures:
+    st.dataframe(pd.DataFrame(figures), use_container_width=True, hide_index=True)
+  if metrics.frames:
+    frames = pd.DataFrame([{"Frame": name, "Rows": r, "Cols": c, "KiB": round(b / 1024, 1)} for name, (r, c, b) in metrics.frames.items()])
+    st.dataframe(frames, use_container_width=True, hide_index=True)
+  st.download_button("Download figures (JSON)", data=json.dumps(metrics.to_dict(), indent=1), file_name="ubo_metrics.json", mime="application/json", key=f"perf_json_{key}")
+  if metrics.profile_stats is not None:
+    st.download_button("Download cProfile (.prof)", data=metrics.profile_stats, file_name="ubo_rerun.prof", key=f"perf_prof_{key}")
+    st.download_button("Download profile and memory report", data=metrics.profile_text + "\n\n" + metrics.memory_text, file_name="ubo_rerun_profile.txt", mime="text/plain", key=f"perf_txt_{key}")
 
 # Side Bar
 st.sidebar.header("Settings") 
 threshold = st.sidebar.slider("UBO threshold (%)", 5, 50, 25, step=1) / 100.0 
-
-# Reset button
+as_of = st.sidebar.date_input("Ownership as of", value=date.today(), key="as_of",
+                              help="A relationship counts from its Valid from date up to the day before its Valid to date; undated ones always count")
+
+# Path listing limits (the ownership figures themselves are never pruned)
+st.sidebar.subheader("Detailed paths")
+min_path_pct = st.sidebar.number_input("Hide paths below (%)", min_value=0.0, max_value=100.0, value=0.01, step=0.01, format="%.2f")
+max_depth = st.sidebar.number_input("Maximum path length (0 = no limit)", min_value=0, max_value=50, value=0)
+top_k = st.sidebar.number_input("Paths per owner (0 = all)", min_value=0, max_value=1000, value=50)
+path_options = {"min_product": min_path_pct / 100.0, "max_depth": int(max_depth) or None, "top_k": int(top_k) or None}
+PATH_PAGE_ROWS = 100
+FLIP_ROWS = 200
+
+# Diagram pruning for large structures
+st.sidebar.subheader("Diagram")
+diagram_prune = st.sidebar.checkbox("Only entities linked to the target", value=False)
+diagram_others = st.sidebar.number_input("Group owners below (%) into \"Others\"", min_value=0.0, max_value=100.0, value=0.0, step=0.5)
+diagram_depth = st.sidebar.number_input("Levels above target (0 = all)", min_value=0, max_value=50, value=0)
+diagram_options = {"prune": diagram_prune, "others_below": diagram_others / 100.0, "max_depth": int(diagram_depth) or None}
+
+# Reset button. It clears this session's tables (and its own registry edits); the
+# database is shared by every session, so it is only wiped when that is ticked too
+wipe_db = isinstance(graph_db, GraphDatabase) and st.sidebar.checkbox("Also delete everything in the shared database", key="reset_wipe_db")
 if st.sidebar.button("Reset All Data", type="primary"):
-  st.session_state.entities = pd.DataFrame(columns=["EntityID", "Name", "Type", "Layer"])
-  st.session_state.relationships = pd.DataFrame(columns=["OwnerID", "OwnedID", "RelationshipType", "OwnershipPct"])
+  if wipe_db or isinstance(graph_db, RegistryOverlay):
+    graph_db.clear()
+  entity_table.clear()
+  relationship_table.clear()
+  st.session_state.pop("db_loaded_target", None)
+  if "ownership_state" in st.session_state:
+    st.session_state.ownership_state.invalidate()
   if "target_company" in st.session_state:
     del st.session_state.target_company
   st.rerun()
 
+# Performance panel; filled in at the end of the script, once everything has run
+perf_panel = st.sidebar.expander("Performance")
+if perf_panel.checkbox("Profile reruns (cProfile + tracemalloc)", key="perf_profile"):
+  perf.start_profile()
+
 # Target company chooser 
-company_options = list(entities[entities['Type']=='Company']['EntityID']) if not entities.empty else []
+company_count, first_company = entity_search().search_entities("", "Company", 0, 1)
 if "target_company" not in st.session_state: 
-  st.session_state.target_company = company_options[0] if company_options else None 
-if company_options:
-  st.sidebar.selectbox("Target company (our business)", company_options, index=company_options.index(st.session_state.target_company) if st.session_state.target_company in company_options else 0, key="target_company")
+  st.session_state.target_company = first_company[0][0] if first_company else None 
+if company_count:
+  entity_picker("Target company (our business)", "target_company", entity_search(), entity_type="Company", current=st.session_state.target_company, container=st.sidebar)
+
+# With a database or shared registry, the session tables hold only the part of the
+# graph that can reach the target; they are reloaded when the target changes or an
+# edit brings in new owners
+if graph_db is not None and st.session_state.get("db_loaded_target", "") != st.session_state.target_company:
+  loaded_entities, loaded_relationships = graph_db.load_subgraph(st.session_state.target_company)
+  entity_table.replace(loaded_entities)
+  relationship_table.replace(loaded_relationships)
+  st.session_state.db_loaded_target = st.session_state.target_company
+  entities = entity_table.frame()
+  relationships = relationship_table.frame()
+
+# One computed result per graph version, shared by the table, diagram and exports
+if "result_cache" not in st.session_state:
+  st.session_state.result_cache = LRUResultCache(max_entries=32, max_bytes=64 * 1024 * 1024)
+result_cache = st.session_state.result_cache
+# Edits below apply deltas to this state so the next rerun does not start from scratch
+if "ownership_state" not in st.session_state:
+  st.session_state.ownership_state = IncrementalOwnership()
+ownership_state = st.session_state.ownership_state
+graph_key = current_graph_version()
+# Every row, past and future ones included, stays in all_relationships for the editors
+# and the export. The calculations see only the rows in force on the as-of date; that
+# edge set only changes on a ValidFrom / ValidTo date, so results are cached per
+# epoch between two such dates, not per day.
+all_relationships = relationships
+history_key = graph_key
+as_of_suffix = ""
+history = result_cache.get_or_compute(("history", history_key), lambda: OwnershipHistory(all_relationships), pin=True)
+if history.dated:
+  as_of_day = day_number(as_of)
+  epoch = history.epoch(as_of_day)
+  relationships = result_cache.get_or_compute(("as of", history_key, epoch), lambda: history.as_of(as_of_day))
+  as_of_suffix = f"@{epoch}"
+  graph_key = history_key + as_of_suffix
+  record_frame("relationships in force", relationships)
+target = st.session_state.target_company
+store = result_cache.get_or_compute(("store", graph_key), lambda: GraphStore(entities, relationships), pin=True)
+adj = store.equity_out
+ownership_error = None
+if target:
+  try:
+    ultimate_ownership = result_cache.get_or_compute(("ultimate", graph_key, target), lambda: ownership_state.ultimate_ownership(entities, relationships, target, graph_key, store=store))
+  except CircularOwnershipError as err:
+    # No stake is defined; control and the editors still work so the loop can be fixed
+    ownership_error = err
+    ultimate_ownership = {}
+  control = result_cache.get_or_compute(("control", graph_key, target), lambda: propagate_control(relationships, target, store=store))
+  agg = result_cache.get_or_compute(("ubo", graph_key, target, threshold), lambda: compute_ubo(entities, relationships, target, threshold, ultimate_ownership=ultimate_ownership, control=control))
+  record_frame("UBO flags", agg)
 
 # Layout columns: Inputs | Explanation | Diagram 
 col1, col2, col3 = st.columns([1, 1, 1]) 
@@ -227,11 +307,14 @@ with col1:
     submit = st.form_submit_button("Add entity") 
     if submit and name: 
       eid = sanitize_id(name) 
-      if eid in set(entities['EntityID']): 
+      if entity_exists(eid): 
         st.warning("An entity with this derived ID already exists. Try another name.") 
       else: 
-        new_row = pd.DataFrame([{"EntityID":eid, "Name":name, "Type":typ, "Layer":layer}])
-        st.session_state.entities = pd.concat([entities, new_row], ignore_index=True)
+        new_row = {"EntityID":eid, "Name":name, "Type":typ, "Layer":layer}
+        if graph_db is not None:
+          graph_db.add_entities(pd.DataFrame([new_row]))
+        entity_table.append(new_row)
+        ownership_state.mark_current(graph_key, next_graph_key())
         st.success(f"Added: {name}") 
         st.rerun()
 
@@ -239,10 +322,10 @@ with col1:
   if not entities.empty:
     st.divider()
     st.subheader("Edit or delete entities")
-    entity_to_edit = st.selectbox("Select entity", entities['Name'].tolist(), key="entity_edit_select")
+    entity_to_edit = entity_picker("Select entity", "entity_edit_select", session_search())
     
     if entity_to_edit:
-      entity_row = entities[entities['Name'] == entity_to_edit].iloc[0]
+      entity_row = entity_table.get(entity_table.row_of(entity_to_edit))
       
       with st.form("edit_entity"):
         new_name = st.text_input("Name", value=entity_row['Name'])
@@ -256,74 +339,106 @@ with col1:
           delete_btn = st.form_submit_button("Delete", type="secondary")
         
         if update_btn:
-          idx = entities[entities['EntityID'] == entity_row['EntityID']].index[0]
-          st.session_state.entities.at[idx, 'Name'] = new_name
-          st.session_state.entities.at[idx, 'Type'] = new_type
-          st.session_state.entities.at[idx, 'Layer'] = new_layer
+          entity_table.update(entity_table.row_of(entity_row['EntityID']), Name=new_name, Type=new_type, Layer=new_layer)
+          if graph_db is not None:
+            graph_db.update_entity(entity_row['EntityID'], new_name, new_type, new_layer)
+          ownership_state.mark_current(graph_key, next_graph_key())
           st.success(f"Updated: {new_name}")
           st.rerun()
         
         if delete_btn:
+          if graph_db is not None:
+            graph_db.delete_entity(entity_row['EntityID'])
           # Remove entity
-          st.session_state.entities = entities[entities['EntityID'] != entity_row['EntityID']].reset_index(drop=True)
+          entity_table.delete(entity_table.row_of(entity_row['EntityID']))
           # Remove related relationships
-          st.session_state.relationships = relationships[
-            (relationships['OwnerID'] != entity_row['EntityID']) & 
-            (relationships['OwnedID'] != entity_row['EntityID'])
-          ].reset_index(drop=True)
+          relationship_table.delete_where('OwnerID', entity_row['EntityID'])
+          relationship_table.delete_where('OwnedID', entity_row['EntityID'])
+          # Any number of equity rows went with it
+          ownership_state.invalidate()
           st.success(f"Deleted: {entity_row['Name']}")
           st.rerun()
 
   st.divider() 
   st.subheader("Add relationships") 
-  owners = list(entities['EntityID']) if not entities.empty else []
-  owneds = list(entities['EntityID']) if not entities.empty else []
+  # Pickers sit outside the form so that typing a search updates the matches
+  owner = entity_picker("Owner", "add_rel_owner", entity_search())
+  owned = entity_picker("Owned", "add_rel_owned", entity_search())
   with st.form("add_rel", clear_on_submit=True): 
     reltype = st.radio("Relationship type", ["Equity","Directorship"], horizontal=True) 
-    owner = st.selectbox("Owner", owners) if owners else st.selectbox("Owner", ["No entities yet"], disabled=True)
-    owned = st.selectbox("Owned", owneds) if owneds else st.selectbox("Owned", ["No entities yet"], disabled=True)
     pct = st.number_input("Ownership % (if Equity)", min_value=0.0, max_value=100.0, value=25.0, step=1.0) 
+    valid_from = st.date_input("Valid from (blank = always)", value=None, key="add_rel_from")
+    valid_to = st.date_input("Valid to (blank = still in force)", value=None, key="add_rel_to")
     submit2 = st.form_submit_button("Add relationship") 
-    if submit2 and owners and owneds: 
-      new_row = pd.DataFrame([{"OwnerID":owner, "OwnedID":owned, "RelationshipType":reltype, "OwnershipPct":None if reltype!="Equity" else pct/100.0}])
-      st.session_state.relationships = pd.concat([relationships, new_row], ignore_index=True)
+    if submit2 and valid_from and valid_to and valid_from >= valid_to:
+      st.warning("Valid to must be after valid from.")
+    elif submit2 and owner and owned: 
+      new_row = {"OwnerID":owner, "OwnedID":owned, "RelationshipType":reltype, "OwnershipPct":None if reltype!="Equity" else pct/100.0,
+                 "ValidFrom":valid_from.isoformat() if valid_from else None, "ValidTo":valid_to.isoformat() if valid_to else None}
+      if graph_db is not None:
+        graph_db.add_relationships(pd.DataFrame([new_row]))
+        if owner not in entity_table:
+          # The owner's own holdings are not loaded yet
+          st.session_state.db_loaded_target = ""
+      relationship_table.append(new_row)
+      if valid_from or valid_to:
+        # Whether a dated row counts depends on the as-of date, so no delta: the next read recomputes
+        ownership_state.invalidate()
+      elif reltype == "Equity":
+        ownership_state.add_edge(owner, owned, pct/100.0, graph_key, next_graph_key())
+      else:
+        ownership_state.mark_current(graph_key, next_graph_key())
       st.success("Relationship added") 
       st.rerun()
 
   # Edit/Delete Relationships
-  if not relationships.empty:
+  if not all_relationships.empty:
     st.divider()
     st.subheader("Edit or delete relationships")
     
-    # Create readable relationship labels
-    rel_labels = []
-    entity_names = entities.set_index('EntityID')['Name'].to_dict()
-    for idx, row in relationships.iterrows():
-      owner_name = entity_names.get(row['OwnerID'], row['OwnerID'])
-      owned_name = entity_names.get(row['OwnedID'], row['OwnedID'])
-      if row['RelationshipType'] == 'Equity':
-        pct = f"{row['OwnershipPct']*100:.1f}%"
-        rel_labels.append(f"{owner_name} → {owned_name} ({pct} equity)")
+    # Relationships whose owner or owned entity matches the search, a page at a time
+    rel_query = st.text_input("Search: relationships", key="rel_edit_query", placeholder="Owner or owned name or ID")
+    if rel_query.strip():
+      index = session_search()
+      matched = [index.ids[r] for r in index.search(rel_query)]
+      rel_rows = sorted({row for eid in matched for col in ("OwnerID", "OwnedID") for row in relationship_table.rows_where(col, eid)})
+    else:
+      rel_rows = all_relationships.index
+    rel_pages = max(1, -(-len(rel_rows) // PICKER_PAGE_ROWS))
+    if st.session_state.get("rel_edit_page", 1) > rel_pages:
+      st.session_state.rel_edit_page = rel_pages
+    rel_page = st.number_input(f"Page (of {rel_pages}, {len(rel_rows)} matches)", min_value=1, max_value=rel_pages, key="rel_edit_page") if rel_pages > 1 else 1
+    
+    # Labels only for this page; a selection is keyed by the relationship itself, not its position
+    rel_options = {}
+    for row in rel_rows[(rel_page - 1) * PICKER_PAGE_ROWS:rel_page * PICKER_PAGE_ROWS]:
+      rel = relationship_table.get(row)
+      owner_name = store.name(rel['OwnerID'])
+      owned_name = store.name(rel['OwnedID'])
+      if rel['RelationshipType'] == 'Equity':
+        label = f"{owner_name} → {owned_name} ({rel['OwnershipPct']*100:.1f}% equity{validity_label(rel['ValidFrom'], rel['ValidTo'])})"
       else:
-        rel_labels.append(f"{owner_name} → {owned_name} (Director)")
+        label = f"{owner_name} → {owned_name} (Director{validity_label(rel['ValidFrom'], rel['ValidTo'])})"
+      pct_key = None if pd.isna(rel['OwnershipPct']) else float(rel['OwnershipPct'])
+      rel_options.setdefault((rel['OwnerID'], rel['OwnedID'], rel['RelationshipType'], pct_key, date_text(rel['ValidFrom']), date_text(rel['ValidTo'])), (row, label))
     
-    rel_to_edit = st.selectbox("Select relationship", rel_labels, key="rel_edit_select")
+    rel_to_edit = st.selectbox("Select relationship", list(rel_options), format_func=lambda k: rel_options[k][1], key="rel_edit_select") if rel_options else None
     
     if rel_to_edit:
-      rel_idx = rel_labels.index(rel_to_edit)
-      rel_row = relationships.iloc[rel_idx]
+      rel_idx = rel_options[rel_to_edit][0]
+      rel_row = relationship_table.get(rel_idx)
       
+      new_owner = entity_picker("Owner", f"rel_edit_owner_{rel_idx}", session_search(), current=rel_row['OwnerID'])
+      new_owned = entity_picker("Owned", f"rel_edit_owned_{rel_idx}", session_search(), current=rel_row['OwnedID'])
       with st.form("edit_relationship"):
         new_reltype = st.radio("Type", ["Equity","Directorship"], 
                                index=0 if rel_row['RelationshipType']=='Equity' else 1, 
                                horizontal=True)
-        new_owner = st.selectbox("Owner", list(entities['EntityID']), 
-                                index=list(entities['EntityID']).index(rel_row['OwnerID']))
-        new_owned = st.selectbox("Owned", list(entities['EntityID']), 
-                                index=list(entities['EntityID']).index(rel_row['OwnedID']))
         new_pct = st.number_input("Ownership %", min_value=0.0, max_value=100.0, 
                                   value=float(rel_row['OwnershipPct']*100) if rel_row['OwnershipPct'] is not None else 25.0, 
                                   step=1.0)
+        new_from = st.date_input("Valid from (blank = always)", value=as_date(rel_row['ValidFrom']))
+        new_to = st.date_input("Valid to (blank = still in force)", value=as_date(rel_row['ValidTo']))
         
         col_update, col_delete = st.columns(2)
         with col_update:
@@ -331,59 +446,121 @@ with col1:
         with col_delete:
           delete_rel_btn = st.form_submit_button("Delete", type="secondary")
         
-        if update_rel_btn:
-          st.session_state.relationships.at[rel_idx, 'OwnerID'] = new_owner
-          st.session_state.relationships.at[rel_idx, 'OwnedID'] = new_owned
-          st.session_state.relationships.at[rel_idx, 'RelationshipType'] = new_reltype
-          st.session_state.relationships.at[rel_idx, 'OwnershipPct'] = None if new_reltype!="Equity" else new_pct/100.0
+        old_rel = (rel_row['OwnerID'], rel_row['OwnedID'], rel_row['RelationshipType'], rel_row['OwnershipPct'], date_text(rel_row['ValidFrom']), date_text(rel_row['ValidTo']))
+        if update_rel_btn and new_from and new_to and new_from >= new_to:
+          st.warning("Valid to must be after valid from.")
+        elif update_rel_btn:
+          updated_rel = (new_owner, new_owned, new_reltype, None if new_reltype!="Equity" else new_pct/100.0,
+                         new_from.isoformat() if new_from else None, new_to.isoformat() if new_to else None)
+          relationship_table.update(rel_idx, **dict(zip(relationship_table.columns, updated_rel)))
+          if graph_db is not None:
+            graph_db.update_relationship(old_rel, updated_rel)
+          if old_rel[4] or old_rel[5] or updated_rel[4] or updated_rel[5]:
+            ownership_state.invalidate()
+          else:
+            ownership_state.update_edge(old_rel, updated_rel, graph_key, next_graph_key())
           st.success("Relationship updated")
           st.rerun()
         
         if delete_rel_btn:
-          st.session_state.relationships = relationships.drop(rel_idx).reset_index(drop=True)
+          if graph_db is not None:
+            graph_db.delete_relationship(old_rel)
+          relationship_table.delete(rel_idx)
+          if old_rel[4] or old_rel[5]:
+            ownership_state.invalidate()
+          elif rel_row['RelationshipType'] == "Equity":
+            ownership_state.remove_edge(rel_row['OwnerID'], rel_row['OwnedID'], rel_row['OwnershipPct'], graph_key, next_graph_key())
+          else:
+            ownership_state.mark_current(graph_key, next_graph_key())
           st.success("Relationship deleted")
           st.rerun()
   
   st.divider() 
   st.subheader("Quick helper: equal-share directors") 
-  company_list = list(entities[entities['Type']=='Company']['EntityID']) if not entities.empty else []
+  company = entity_picker("Company to own", "eq_company", entity_search(), entity_type="Company")
   with st.form("helper_equal", clear_on_submit=True): 
-    company = st.selectbox("Company to own", company_list, key="eq_company") if company_list else st.selectbox("Company to own", ["No companies yet"], disabled=True, key="eq_company")
     prefix = st.text_input("Director name prefix", value="Director") 
     n = st.number_input("Number of directors", min_value=1, max_value=10, value=3) 
     add_dirs = st.form_submit_button("Create directors + equal equity")
-    if add_dirs and company_list: 
+    if add_dirs and company: 
       share = 1.0 / n 
       created = [] 
+      new_entities = []
+      new_ids = set()
+      new_rels = []
       for i in range(1, int(n)+1): 
         name_i = f"{prefix} {i}" 
         eid = sanitize_id(name_i)
-        if eid not in set(entities['EntityID']): 
-          new_entity = pd.DataFrame([{"EntityID":eid, "Name":name_i, "Type":"Person", "Layer":0}])
-          st.session_state.entities = pd.concat([st.session_state.entities, new_entity], ignore_index=True)
-        new_rel = pd.DataFrame([{"OwnerID":eid, "OwnedID":company, "RelationshipType":"Equity", "OwnershipPct":share}])
-        st.session_state.relationships = pd.concat([st.session_state.relationships, new_rel], ignore_index=True)
+        if not entity_exists(eid) and eid not in new_ids: 
+          new_ids.add(eid)
+          new_entities.append({"EntityID":eid, "Name":name_i, "Type":"Person", "Layer":0})
+        new_rels.append({"OwnerID":eid, "OwnedID":company, "RelationshipType":"Equity", "OwnershipPct":share})
+        ownership_state.add_edge(eid, company, share, graph_key, graph_key)
         created.append(name_i) 
+      # Every director and link goes in as one change
+      entity_table.extend(new_entities)
+      relationship_table.extend(new_rels)
+      if graph_db is not None:
+        with graph_db.transaction():
+          graph_db.add_entities(pd.DataFrame(new_entities, columns=["EntityID", "Name", "Type", "Layer"]))
+          graph_db.add_relationships(pd.DataFrame(new_rels))
+        # Directors may already exist elsewhere in the database with holdings of their own
+        st.session_state.db_loaded_target = ""
+      ownership_state.mark_current(graph_key, next_graph_key())
       st.success(f"Added: {', '.join(created)} with {round(share*100,2)}% each into {company}") 
       st.rerun()
 
+  st.divider() 
+  st.subheader("Bulk import (CSV / Parquet)") 
+  with st.form("bulk_import", clear_on_submit=True): 
+    ent_file = st.file_uploader("Entities file", type=["csv","parquet"], help="Columns: Name, Type, Layer (EntityID optional)") 
+    rel_file = st.file_uploader("Relationships file", type=["csv","parquet"], help="Columns: OwnerID or OwnerName, OwnedID or OwnedName, RelationshipType, OwnershipPct (ValidFrom, ValidTo optional)") 
+    percent_scale = st.checkbox("Ownership given as 0-100 rather than 0-1") 
+    chunk_rows = st.number_input("Rows per chunk", min_value=1000, max_value=500000, value=50000, step=1000) 
+    run_import = st.form_submit_button("Import") 
+    if run_import and (ent_file or rel_file): 
+      bar = st.progress(0.0, text="Reading files...")
+      def report_progress(fraction, message):
+        bar.progress(fraction if fraction is not None else 0.0, text=message)
+      # Checked against the whole database, not only the part loaded for this target; the
+      # store is asked about the IDs each chunk names rather than loaded whole
+      new_ents, new_rels, import_issues = import_registry(ent_file, rel_file, entities, all_relationships, chunksize=int(chunk_rows), percent_scale=percent_scale, progress=report_progress, store=graph_db)
+      # One batched commit per table, however many chunks were read
+      if graph_db is not None:
+        with graph_db.transaction():
+          graph_db.add_entities(new_ents)
+          graph_db.add_relationships(new_rels)
+        st.session_state.db_loaded_target = ""
+      entity_table.extend(new_ents)
+      relationship_table.extend(new_rels)
+      ownership_state.invalidate()
+      st.session_state.import_result = (len(new_ents), len(new_rels), import_issues)
+      st.rerun()
+  if "import_result" in st.session_state:
+    n_ents, n_rels, import_issues = st.session_state.import_result
+    st.success(f"Imported {n_ents:,} entities and {n_rels:,} relationships")
+    if len(import_issues):
+      st.warning(f"{(import_issues['Severity']=='error').sum():,} rows skipped, {(import_issues['Severity']=='warning').sum():,} warnings")
+      st.dataframe(import_issues, use_container_width=True, height=180)
+      st.download_button("Download import issues (CSV)", data=import_issues.to_csv(index=False), file_name="import_issues.csv", mime="text/csv")
+
 with col2: 
   if st.session_state.target_company:
     st.subheader(f"Ultimate ownership of: {entities[entities['EntityID']==st.session_state.target_company]['Name'].values[0] if not entities.empty else 'Target'}")
+    if ownership_error is not None:
+      st.error(f"Ultimate ownership cannot be worked out: {ownership_error}")
+    if history.dated:
+      st.caption(f"As of {as_of.isoformat()}: {len(relationships):,} of {len(all_relationships):,} relationships in force")
     
-    # Calculate ultimate ownership for all entities
-    ultimate_ownership = compute_all_ultimate_ownership(entities, relationships, st.session_state.target_company)
-    
-    if ultimate_ownership:
-      ult_df = pd.DataFrame(ultimate_ownership.values())
-      ult_df = ult_df[ult_df['EntityID'] != st.session_state.target_company]  # Don't show target owning itself
+    if ultimate_ownership or control:
+      ult_df = ownership_table(ultimate_ownership, control, st.session_state.target_company)
       ult_df['Ownership %'] = (ult_df['UltimateOwnership'] * 100).round(2)
       ult_df = ult_df.sort_values('UltimateOwnership', ascending=False)
       
       # Add relationship status
       status_list = []
-      for _, row in ult_df.iterrows():
-        status = get_relationship_status(row['EntityID'], st.session_state.target_company, relationships)
+      for entity_id in ult_df['EntityID']:
+        status = get_relationship_status(entity_id, st.session_state.target_company, store)
         if status == "both":
           status_list.append("Shareholder & Director")
         elif status == "shareholder":
@@ -394,9 +571,10 @@ with col2:
           status_list.append("Indirect Owner")
       
       ult_df['Status'] = status_list
+      record_frame("ultimate ownership", ult_df)
       
       st.dataframe(
-        ult_df[['Name', 'Type', 'Ownership %', 'Status']].rename(columns={'Name':'Entity', 'Ownership %':'Ultimate Ownership %'}),
+        ult_df[['Name', 'Type', 'Ownership %', 'Control', 'Status']].rename(columns={'Name':'Entity', 'Ownership %':'Ultimate Ownership %'}),
         use_container_width=True,
         height=400
       )
@@ -405,20 +583,73 @@ with col2:
     
     st.divider()
     st.subheader("Detailed paths (for verification)")
-    agg, paths = compute_ubo(entities, relationships, st.session_state.target_company, threshold) 
-    if not paths.empty: 
-      df_show = paths.copy() 
+    # Paths are kept as a trie; only the rows on the current page are turned into text
+    paths_key = ("paths", graph_key, st.session_state.target_company, tuple(sorted(path_options.items())))
+    ubo_paths = result_cache.get_or_compute(paths_key, lambda: ubo_path_trie(entities, relationships, st.session_state.target_company, adj=adj, **path_options))
+    if len(ubo_paths): 
+      pages = (len(ubo_paths) - 1) // PATH_PAGE_ROWS + 1
+      page = st.number_input("Page", min_value=1, max_value=pages, value=1, key="paths_page") if pages > 1 else 1
+      first = (page - 1) * PATH_PAGE_ROWS
+      df_show = ubo_paths.page(first, first + PATH_PAGE_ROWS)
+      df_show.index = range(first + 1, first + len(df_show) + 1)
+      record_frame("paths table", df_show)
       df_show['Path %'] = (df_show['PathOwnershipPct']*100).round(2) 
       st.dataframe(df_show[['OwnerName','PathNames','Path %']].rename(columns={'OwnerName':'Owner','PathNames':'Path'}), use_container_width=True, height=250) 
+      limits = path_limits_text(path_options)
+      st.caption(f"Paths {first + 1}-{first + len(df_show)} of {len(ubo_paths)}{f' (only {limits})' if limits else ''}")
     
     st.divider() 
-    st.subheader(f"UBO flag (≥{threshold*100:.0f}% threshold)") 
+    st.subheader(f"UBO flag (≥{threshold*100:.0f}% threshold, or control)") 
     if not agg.empty: 
       show = agg.copy() 
       show['Aggregated %'] = (show['AggregatedOwnershipPct']*100).round(2) 
-      st.dataframe(show[['OwnerName','Aggregated %','UBO_Flag']].rename(columns={'OwnerName':'Owner','UBO_Flag':'Is UBO'}), use_container_width=True, height=180) 
+      st.dataframe(show[['OwnerName','Aggregated %','Control','UBO_Flag']].rename(columns={'OwnerName':'Owner','UBO_Flag':'Is UBO'}), use_container_width=True, height=180) 
     else:
       st.info("No owners found.")
+    
+    # Margins for every stake come from one pass, so nothing is recomputed per edge
+    with st.expander("Sensitivity: which stakes would change the UBO flag"):
+      if ownership_error is not None:
+        st.info("Not available until the cross-holdings above are fixed.")
+      elif st.checkbox("Work out the margin on every stake", key="sensitivity_on"):
+        flips = result_cache.get_or_compute(("flips", graph_key, target, threshold), lambda: ubo_flips(entities, relationships, target, threshold, store=store, control=control))
+        if flips.empty:
+          st.info("No single stake change between 0% and 100% moves an owner across the threshold.")
+        else:
+          show_flips = flips.head(FLIP_ROWS).copy()
+          show_flips['Stake'] = [f"{store.name(a)} → {store.name(b)}" for a, b in zip(show_flips['EdgeOwnerID'], show_flips['EdgeOwnedID'])]
+          show_flips['Now %'] = (show_flips['CurrentPct']*100).round(2)
+          show_flips['Needed %'] = (show_flips['RequiredPct']*100).round(2)
+          show_flips['Change (points)'] = (show_flips['Margin']*100).round(2)
+          st.dataframe(show_flips[['OwnerName','Stake','Now %','Needed %','Change (points)','Effect']].rename(columns={'OwnerName':'Owner'}), use_container_width=True, height=250)
+          st.caption(f"{len(flips):,} stake changes, smallest first{f' (first {FLIP_ROWS} shown)' if len(flips) > FLIP_ROWS else ''}. Owners who control the target are UBOs whatever their equity, so they are not listed.")
+          st.download_button("Download sensitivity (CSV)", data=flips.to_csv(index=False), file_name="ubo_sensitivity.csv", mime="text/csv")
+    
+    # Steps through the change days in between, applying only the rows that start or end on each
+    with st.expander("UBO changes between two dates"):
+      if not history.dated:
+        st.info("Give relationships Valid from / Valid to dates to see how the UBOs changed over time.")
+      else:
+        changes_from = st.date_input("From", value=as_of - timedelta(days=365), key="changes_from")
+        changes_to = st.date_input("To", value=as_of, key="changes_to")
+        if changes_from >= changes_to:
+          st.warning("The second date must be after the first.")
+        else:
+          from_day, to_day = day_number(changes_from), day_number(changes_to)
+          changes_key = ("changes", history_key, target, threshold, history.epoch(from_day), history.epoch(to_day))
+          try:
+            changes = result_cache.get_or_compute(changes_key, lambda: ubo_changes(entities, history, target, threshold, from_day, to_day))
+          except CircularOwnershipError as err:
+            st.error(f"On some day in this range {err}")
+          else:
+            if changes.empty:
+              st.info(f"No owner became or ceased to be a UBO between {changes_from.isoformat()} and {changes_to.isoformat()}.")
+            else:
+              show_changes = changes.copy()
+              show_changes['Before %'] = (show_changes['PctBefore']*100).round(2)
+              show_changes['After %'] = (show_changes['PctAfter']*100).round(2)
+              st.dataframe(show_changes[['Date','OwnerName','Event','Before %','After %','ControlBefore','ControlAfter']].rename(columns={'OwnerName':'Owner','ControlBefore':'Control before','ControlAfter':'Control after'}), use_container_width=True, height=250)
+              st.download_button("Download UBO changes (CSV)", data=changes.to_csv(index=False), file_name="ubo_changes.csv", mime="text/csv")
   else:
     st.info("Add a company entity to begin.")
 
@@ -441,18 +672,21 @@ with col2:
 with col3: 
   st.subheader("Ownership diagram") 
   if not entities.empty and st.session_state.target_company:
-    dot = make_dot(entities, relationships, st.session_state.target_company) 
+    dot_key = ("dot", graph_key, st.session_state.target_company, tuple(sorted(diagram_options.items())))
+    dot = result_cache.get_or_compute(dot_key, lambda: make_dot(entities, relationships, st.session_state.target_company, ultimate_ownership=ultimate_ownership, control=control, store=store, **diagram_options)) 
     st.graphviz_chart(dot, use_container_width=True)
     
-    # Download diagram as PNG
-    png_data = render_diagram_to_png(dot)
-    if png_data:
-      st.download_button(
-        label="Download Diagram (PNG)",
-        data=png_data,
-        file_name="ownership_diagram.png",
-        mime="image/png"
-      )
+    # Download diagram as PNG; rendered in the background only once asked for, and
+    # never waited on: until it is done only a small fragment reruns to check
+    png_slot = st.empty()
+    png_job = get_png_renderer().get(dot)
+    if png_job is None and png_slot.button("Prepare diagram PNG"):
+      png_job = get_png_renderer().submit(dot)
+    if png_job is not None and png_job.done():
+      png_download(png_job, png_slot)
+    elif png_job is not None:
+      with png_slot.container():
+        wait_for_png(png_job)
   elif not entities.empty:
     st.info("Select a target company to show ultimate ownership.")
   else:
@@ -465,17 +699,31 @@ with colA:
   if not entities.empty:
     st.download_button("Download Entities (CSV)", data=entities.to_csv(index=False), file_name="entities.csv", mime="text/csv") 
 with colB: 
-  if not relationships.empty:
-    st.download_button("Download Relationships (CSV)", data=relationships.to_csv(index=False), file_name="relationships.csv", mime="text/csv") 
+  if not all_relationships.empty:
+    st.download_button("Download Relationships (CSV)", data=all_relationships.to_csv(index=False), file_name="relationships.csv", mime="text/csv") 
 with colC: 
   if st.session_state.target_company:
-    ultimate_ownership = compute_all_ultimate_ownership(entities, relationships, st.session_state.target_company)
-    if ultimate_ownership:
-      ult_df = pd.DataFrame(ultimate_ownership.values())
-      ult_df = ult_df[ult_df['EntityID'] != st.session_state.target_company]
+    if ultimate_ownership or control:
+      ult_df = ownership_table(ultimate_ownership, control, st.session_state.target_company)
       st.download_button("Download Ultimate Ownership (CSV)", data=ult_df.to_csv(index=False), file_name="ultimate_ownership.csv", mime="text/csv")
 with colD: 
-  if st.session_state.target_company and 'paths' in locals() and not paths.empty:
-    st.download_button("Download All Paths (CSV)", data=paths.to_csv(index=False), file_name="ownership_paths.csv", mime="text/csv") 
+  if st.session_state.target_company:
+    # The CSV is only written out from the trie when the button is clicked, a chunk of
+    # rows at a time, off the script thread. It holds the paths the table lists, so the
+    # sidebar limits apply and the labels say so
+    if len(ubo_paths):
+      limits = path_limits_text(path_options)
+      if limits:
+        st.caption(f"Only {limits}; set the Detailed paths limits to 0 for every path.")
+      st.download_button("Download Filtered Paths (CSV)" if limits else "Download All Paths (CSV)", data=ubo_paths.csv_file, file_name="ownership_paths.csv", mime="text/csv")
 
 st.caption("Tip: For directors with equal shares, use the helper to generate people and equity links in one step.")
+
+# Performance panel, now that this rerun's figures are complete
+perf.stop_profile()
+perf.finish()
+with perf_panel:
+  show_run_metrics(perf)
+  if previous_run is not None and not previous_run.finished:
+    st.caption("Previous rerun (ended early by an edit)")
+    show_run_metrics(previous_run, key="previous")
@@ -0,0 +1,97 @@
+import random
+import pandas as pd
+
+# Synthetic ownership structures, realistic and adversarial, as (entities, relationships, target)
+# in the same frame layout as the app's session state.
+
+def _frames(entities: list, relationships: list):
+  ents = pd.DataFrame(entities, columns=["EntityID", "Name", "Type", "Layer"])
+  rels = pd.DataFrame(relationships, columns=["OwnerID", "OwnedID", "RelationshipType", "OwnershipPct"])
+  return ents, rels
+
+def deep_chain(n: int):
+  """Target owned through a single chain of n holding companies, person at the top"""
+  entities = [("c0", "Company 0", "Company", 0)]
+  relationships = []
+  for i in range(1, n + 1):
+    entities.append((f"c{i}", f"Company {i}", "Company", min(i, 10)))
+    relationships.append((f"c{i}", f"c{i-1}", "Equity", 0.9))
+  entities.append(("top", "Top Person", "Person", 10))
+  relationships.append(("top", f"c{n}", "Equity", 1.0))
+  ents, rels = _frames(entities, relationships)
+  return ents, rels, "c0"
+
+def wide_fan_in(n: int):
+  """n equal-share directors of one company, as the quick helper creates them"""
+  entities = [("target", "Target", "Company", 1)]
+  relationships = []
+  for i in range(1, n + 1):
+    eid = f"director{i}"
+    entities.append((eid, f"Director {i}", "Person", 0))
+    relationships.append((eid, "target", "Equity", 1.0 / n))
+    relationships.append((eid, "target", "Directorship", None))
+  ents, rels = _frames(entities, relationships)
+  return ents, rels, "target"
+
+def stacked_diamonds(k: int):
+  """k diamonds stacked on top of each other: 2**k distinct paths from the top owner"""
+  entities = [("d0", "Diamond 0", "Company", 0)]
+  relationships = []
+  for i in range(1, k + 1):
+    left, right, bottom, top = f"l{i}", f"r{i}", f"d{i-1}", f"d{i}"
+    entities += [(left, f"Left {i}", "Company", min(2 * i - 1, 10)), (right, f"Right {i}", "Company", min(2 * i - 1, 10)), (top, f"Diamond {i}", "Company", min(2 * i, 10))]
+    relationships += [(left, bottom, "Equity", 0.5), (right, bottom, "Equity", 0.5), (top, left, "Equity", 1.0), (top, right, "Equity", 1.0)]
+  entities.append(("owner", "Owner", "Person", 10))
+  relationships.append(("owner", f"d{k}", "Equity", 1.0))
+  ents, rels = _frames(entities, relationships)
+  return ents, rels, "d0"
+
+def cross_holdings(n: int, seed: int = 7):
+  """Ring of n companies holding 20% of the next, each also held by its own person"""
+  rnd = random.Random(seed)
+  entities = []
+  relationships = []
+  for i in range(n):
+    entities.append((f"k{i}", f"Ring Co {i}", "Company", 1))
+    entities.append((f"p{i}", f"Ring Person {i}", "Person", 0))
+    relationships.append((f"k{i}", f"k{(i + 1) % n}", "Equity", 0.2))
+    relationships.append((f"p{i}", f"k{i}", "Equity", 0.8))
+  # A few chords so the strongly connected component is not just a cycle
+  for _ in range(n // 4):
+    a, b = rnd.sample(range(n), 2)
+    relationships.append((f"k{a}", f"k{b}", "Equity", 0.05))
+  ents, rels = _frames(entities, relationships)
+  return ents, rels, "k0"
+
+def random_dag(n: int, avg_owners: float = 2.0, seed: int = 11):
+  """Registry-like DAG: every company owned by a few entities from just above it, topped by one person"""
+  rnd = random.Random(seed)
+  entities = []
+  relationships = []
+  for i in range(n):
+    is_person = i >= n * 0.6
+    entities.append((f"e{i}", f"Entity {i}", "Person" if is_person else "Company", min(10, i * 10 // n)))
+  for i in range(int(n * 0.6)):
+    k = max(1, min(n - i - 1, int(rnd.expovariate(1.0 / avg_owners)) + 1))
+    above = range(i + 1, min(n, i + 1 + max(10, n // 10)))
+    owners = rnd.sample(above, min(k, len(above)))
+    shares = [rnd.random() for _ in owners]
+    total = sum(shares) or 1.0
+    for o, s in zip(owners, shares):
+      relationships.append((f"e{o}", f"e{i}", "Equity", s / total))
+      if rnd.random() < 0.1:
+        relationships.append((f"e{o}", f"e{i}", "Directorship", None))
+  # Last entity, as in the other structures, is an owner at the top of the group
+  entities.append(("top", "Top Person", "Person", 10))
+  for c in rnd.sample(range(int(n * 0.5), int(n * 0.6)), max(1, n // 50)):
+    relationships.append(("top", f"e{c}", "Equity", 0.3))
+  ents, rels = _frames(entities, relationships)
+  return ents, rels, "e0"
+
+STRUCTURES = {
+  "deep_chain": deep_chain,
+  "wide_fan_in": wide_fan_in,
+  "stacked_diamonds": stacked_diamonds,
+  "cross_holdings": cross_holdings,
+  "random_dag": random_dag,
+}
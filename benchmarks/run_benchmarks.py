@@ -0,0 +1,185 @@
+"""Scaling benchmarks for the UBO engine, with a regression gate.
+
+  python benchmarks/run_benchmarks.py                    # compare against baseline.json
+  python benchmarks/run_benchmarks.py --quick            # smallest sizes only
+  python benchmarks/run_benchmarks.py --update-baseline  # record this machine's numbers
+
+Each function is timed (best of --repeat runs) on every synthetic structure and
+size, then run once more under tracemalloc for its peak memory. The run fails
+(exit 1) when a time or peak exceeds the stored baseline by more than --margin,
+or when the number of rows a function returns (paths, owners, flips, DOT lines)
+differs from the baseline, which is a change in results rather than in speed.
+Row counts and peaks do not depend on PYTHONHASHSEED: nothing timed iterates a
+set of IDs. Timings are machine-specific: refresh the baseline when moving the
+gate to a different machine.
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generators import STRUCTURES
+from ubo_engine import build_adj, find_paths, compute_all_ultimate_ownership, compute_ubo, ownership_sums_per_entity, propagate_ultimate_ownership, propagate_control
+from diagram import make_dot
+from path_trie import ubo_path_trie
+from sensitivity import ubo_flips
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# Sizes per structure: chain length, number of directors, number of stacked
+# diamonds, ring size and entity count respectively. The first size is the --quick run.
+SIZES = {
+  "deep_chain": [10, 100, 500],
+  "wide_fan_in": [10, 100, 1000],
+  "stacked_diamonds": [4, 8, 12],
+  "cross_holdings": [6, 10, 14],
+  "random_dag": [100, 1000, 5000],
+}
+
+# Path-enumerating functions are exponential on some structures; skip sizes above these
+PATH_LIMITS = {"stacked_diamonds": 12, "cross_holdings": 14, "random_dag": 100}
+
+def _find_paths(ents, rels, target):
+  # From the last entity generated, which is always the top of the structure
+  source = ents["EntityID"].iloc[-1]
+  return len(find_paths(source, target, build_adj(rels, rel_type="Equity")))
+
+def _compute_all(ents, rels, target):
+  return len(compute_all_ultimate_ownership(ents, rels, target))
+
+def _propagate(ents, rels, target):
+  return len(propagate_ultimate_ownership(ents, rels, target))
+
+def _propagate_control(ents, rels, target):
+  return len(propagate_control(rels, target))
+
+def _compute_ubo(ents, rels, target):
+  return len(compute_ubo(ents, rels, target, 0.25))
+
+def _ubo_flips(ents, rels, target):
+  return len(ubo_flips(ents, rels, target, 0.25))
+
+def _path_trie(ents, rels, target):
+  return len(ubo_path_trie(ents, rels, target))
+
+def _make_dot(ents, rels, target):
+  return len(make_dot(ents, rels, target).splitlines())
+
+def _ownership_sums(ents, rels, target):
+  return len(ownership_sums_per_entity(rels))
+
+# name -> (callable returning the number of rows in its result, bounded by PATH_LIMITS)
+FUNCTIONS = {
+  "find_paths": (_find_paths, True),
+  "compute_all_ultimate_ownership": (_compute_all, True),
+  "propagate_ultimate_ownership": (_propagate, False),
+  "propagate_control": (_propagate_control, False),
+  "compute_ubo": (_compute_ubo, False),
+  "ubo_path_trie": (_path_trie, True),
+  "ubo_flips": (_ubo_flips, False),
+  "make_dot": (_make_dot, False),
+  "ownership_sums_per_entity": (_ownership_sums, False),
+}
+
+def measure(fn, args: tuple, repeat: int):
+  """(best seconds, peak KiB under tracemalloc, fn's result)"""
+  best = float("inf")
+  # As timeit does, keep cyclic GC pauses out of the timings
+  gc.disable()
+  try:
+    for _ in range(repeat):
+      t0 = time.perf_counter()
+      result = fn(*args)
+      best = min(best, time.perf_counter() - t0)
+  finally:
+    gc.enable()
+  # Start from a clean heap so the peak does not depend on what the timed runs left behind
+  gc.collect()
+  tracemalloc.start()
+  try:
+    fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  return best, peak / 1024.0, result
+
+def run(quick: bool, repeat: int, only: list = None):
+  results = {}
+  for structure, sizes in SIZES.items():
+    for size in sizes[:1] if quick else sizes:
+      ents, rels, target = STRUCTURES[structure](size)
+      for name, (fn, exponential) in FUNCTIONS.items():
+        if only and name not in only:
+          continue
+        if exponential and size > PATH_LIMITS.get(structure, size):
+          continue
+        seconds, peak_kb, rows = measure(fn, (ents, rels, target), repeat)
+        key = f"{structure}/{size}/{name}"
+        results[key] = {"seconds": round(seconds, 6), "peak_kb": round(peak_kb, 1), "rows": rows}
+        print(f"{key:<60} {seconds * 1000:10.2f} ms {peak_kb:10.1f} KiB {rows:>8} rows", flush=True)
+  return results
+
+def compare(results: dict, baseline: dict, margin: float, min_seconds: float, min_kb: float):
+  """Human-readable regressions of results against baseline"""
+  failures = []
+  for key, new in results.items():
+    old = baseline.get(key)
+    if old is None:
+      continue
+    if new["seconds"] > old["seconds"] * (1 + margin) and new["seconds"] - old["seconds"] > min_seconds:
+      failures.append(f"{key}: {old['seconds'] * 1000:.2f} ms -> {new['seconds'] * 1000:.2f} ms")
+    if new["peak_kb"] > old["peak_kb"] * (1 + margin) and new["peak_kb"] - old["peak_kb"] > min_kb:
+      failures.append(f"{key}: peak {old['peak_kb']:.0f} KiB -> {new['peak_kb']:.0f} KiB")
+    if new["rows"] != old["rows"]:
+      failures.append(f"{key}: {old['rows']} rows -> {new['rows']} rows")
+  return failures
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Time the UBO engine on synthetic ownership structures")
+  parser.add_argument("--quick", action="store_true", help="smallest size of each structure only")
+  parser.add_argument("--repeat", type=int, default=5, help="timed runs per case; the best is kept (default 5)")
+  parser.add_argument("--only", nargs="+", choices=list(FUNCTIONS), help="benchmark only these functions")
+  parser.add_argument("--margin", type=float, default=0.25, help="allowed slowdown / memory growth over baseline (default 0.25 = 25%%)")
+  parser.add_argument("--min-ms", type=float, default=10.0, help="ignore time regressions smaller than this (default 10 ms)")
+  parser.add_argument("--min-kb", type=float, default=256.0, help="ignore memory regressions smaller than this (default 256 KiB)")
+  parser.add_argument("--baseline", default=BASELINE, help="baseline JSON file")
+  parser.add_argument("--update-baseline", action="store_true", help="write the results as the new baseline")
+  args = parser.parse_args(argv)
+
+  results = run(args.quick, args.repeat, args.only)
+
+  if args.update_baseline:
+    baseline = {}
+    if os.path.exists(args.baseline):
+      with open(args.baseline) as f:
+        baseline = json.load(f)
+    baseline.update(results)
+    with open(args.baseline, "w") as f:
+      json.dump(baseline, f, indent=1, sort_keys=True)
+    print(f"baseline updated: {len(results)} cases written to {args.baseline}")
+    return 0
+
+  if not os.path.exists(args.baseline):
+    print(f"no baseline at {args.baseline}; run with --update-baseline first", file=sys.stderr)
+    return 1
+  with open(args.baseline) as f:
+    baseline = json.load(f)
+  failures = compare(results, baseline, args.margin, args.min_ms / 1000.0, args.min_kb)
+  missing = [k for k in results if k not in baseline]
+  if missing:
+    print(f"{len(missing)} cases have no baseline yet (e.g. {missing[0]})", file=sys.stderr)
+  if failures:
+    print(f"{len(failures)} regressions over {args.margin:.0%}:", file=sys.stderr)
+    for line in failures:
+      print(f"  {line}", file=sys.stderr)
+    return 1
+  print(f"{len(results)} cases within {args.margin:.0%} of baseline")
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main())
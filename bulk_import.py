@@ -0,0 +1,200 @@
+import numpy as np
+import pandas as pd
+from datetime import date
+from instrumentation import instrument, count
+from ownership_history import day_number, in_force
+
+# Chunked import of registry extracts. Files are read a chunk at a time and each
+# chunk is normalised and validated with vectorised pandas operations; only the
+# accepted rows are kept, and they are handed back as one frame per table so the
+# caller can commit them to the session graph in a single step.
+
+ENTITY_COLUMNS = ["EntityID", "Name", "Type", "Layer"]
+RELATIONSHIP_COLUMNS = ["OwnerID", "OwnedID", "RelationshipType", "OwnershipPct", "ValidFrom", "ValidTo"]
+ISSUE_COLUMNS = ["File", "Row", "Severity", "Issue", "Detail"]
+ENTITY_TYPES = ["Company", "Person"]
+RELATIONSHIP_TYPES = ["Equity", "Directorship"]
+
+def sanitize_ids(names: pd.Series) -> pd.Series:
+  """Vectorised sanitize_id: lower-case alphanumerics only, at most 15 characters"""
+  # Object dtype keeps Python's Unicode-aware \W, as str.isalnum is
+  return names.fillna("").astype(str).astype(object).str.lower().str.replace(r"[\W_]+", "", regex=True).str[:15]
+
+def _source_size(source):
+  """Total bytes of a path or file-like object, if it can be found cheaply"""
+  if hasattr(source, "size"):
+    return source.size
+  if hasattr(source, "seek") and hasattr(source, "tell"):
+    pos = source.tell()
+    source.seek(0, 2)
+    size = source.tell()
+    source.seek(pos)
+    return size
+  return None
+
+def _is_parquet(source) -> bool:
+  name = source if isinstance(source, str) else getattr(source, "name", "")
+  return str(name).lower().endswith((".parquet", ".pq"))
+
+def iter_chunks(source, chunksize: int = 50000):
+  """(chunk, fraction done or None) pairs from a CSV or Parquet path or file-like object"""
+  if _is_parquet(source):
+    import pyarrow.parquet as pq
+    pf = pq.ParquetFile(source)
+    total = pf.metadata.num_rows or 1
+    done = 0
+    for batch in pf.iter_batches(batch_size=chunksize):
+      done += batch.num_rows
+      yield batch.to_pandas(), done / total
+    return
+  size = _source_size(source)
+  for chunk in pd.read_csv(source, chunksize=chunksize, dtype=str, keep_default_na=False, na_values=[""]):
+    fraction = None
+    if size and hasattr(source, "tell"):
+      fraction = min(source.tell() / size, 1.0)
+    yield chunk, fraction
+
+def _issues(file: str, rows: pd.Index, severity: str, issue: str, detail) -> pd.DataFrame:
+  return pd.DataFrame({"File": file, "Row": rows, "Severity": severity, "Issue": issue, "Detail": detail})
+
+def _normalise_entities(chunk: pd.DataFrame) -> pd.DataFrame:
+  out = pd.DataFrame(index=chunk.index)
+  # Blank cells are read as NaN; they become "" so the empty check catches them
+  out["Name"] = chunk["Name"].fillna("").astype(str).str.strip()
+  ids = chunk["EntityID"].fillna("").astype(str).str.strip() if "EntityID" in chunk else pd.Series("", index=chunk.index)
+  out["EntityID"] = ids.where(ids != "", sanitize_ids(out["Name"]))
+  out["Type"] = chunk["Type"].fillna("").astype(str).str.strip().str.title() if "Type" in chunk else "Company"
+  layer = pd.to_numeric(chunk["Layer"], errors="coerce") if "Layer" in chunk else pd.Series(0, index=chunk.index)
+  out["Layer"] = layer.fillna(0).clip(0, 10).astype(int)
+  return out[ENTITY_COLUMNS]
+
+def _normalise_relationships(chunk: pd.DataFrame, percent_scale: bool) -> pd.DataFrame:
+  out = pd.DataFrame(index=chunk.index)
+  for side in ("Owner", "Owned"):
+    # Registry extracts name the parties; our own exports carry the IDs
+    if f"{side}ID" in chunk:
+      out[f"{side}ID"] = chunk[f"{side}ID"].fillna("").astype(str).str.strip()
+    else:
+      out[f"{side}ID"] = sanitize_ids(chunk[f"{side}Name"])
+  out["RelationshipType"] = chunk["RelationshipType"].fillna("").astype(str).str.strip().str.title() if "RelationshipType" in chunk else "Equity"
+  pct = pd.to_numeric(chunk["OwnershipPct"], errors="coerce") if "OwnershipPct" in chunk else pd.Series(np.nan, index=chunk.index)
+  if percent_scale:
+    pct = pct / 100.0
+  out["OwnershipPct"] = pct.where(out["RelationshipType"] == "Equity")
+  for column in ("ValidFrom", "ValidTo"):
+    # Stored as ISO dates; blanks mean "always" / "still in force", anything unreadable stays NaN for the check
+    raw = chunk[column] if column in chunk else pd.Series(np.nan, index=chunk.index)
+    parsed = pd.to_datetime(raw, errors="coerce")
+    out[column] = parsed.dt.strftime("%Y-%m-%d").where(parsed.notna(), None)
+    out[f"{column}Raw"] = raw
+  return out
+
+@instrument()
+def import_registry(entities_source, relationships_source, existing_entities: pd.DataFrame, existing_relationships: pd.DataFrame, chunksize: int = 50000, percent_scale: bool = False, progress=None, store=None):
+  """Read, validate and collect an entities and/or relationships extract.
+
+  Returns (new_entities, new_relationships, issues). Rows with errors are left out;
+  warnings (e.g. equity over 100%) are reported but the rows are kept.
+  progress, if given, is called as progress(fraction or None, message).
+  With a store (GraphDatabase or RegistryOverlay), entity IDs and equity totals are
+  also looked up there, a chunk's IDs at a time, so the whole store is never loaded;
+  the existing frames then need only hold what the session has loaded.
+  """
+  issues = []
+  known_ids = set(existing_entities["EntityID"])
+  accepted_entities = []
+  accepted_relationships = []
+
+  if entities_source is not None:
+    rows_seen = 0
+    for chunk, fraction in iter_chunks(entities_source, chunksize):
+      chunk.index = pd.RangeIndex(rows_seen + 2, rows_seen + 2 + len(chunk))  # 1-based, after the header
+      rows_seen += len(chunk)
+      count("import chunks")
+      if "Name" not in chunk:
+        issues.append(_issues("entities", chunk.index[:1], "error", "Missing column", "Name"))
+        break
+      ents = _normalise_entities(chunk)
+      bad_type = ~ents["Type"].isin(ENTITY_TYPES)
+      empty = ents["EntityID"].eq("") | ents["Name"].eq("")
+      dup_in_chunk = ents["EntityID"].duplicated(keep="first")
+      if store is not None:
+        known_ids.update(store.existing_ids(ents["EntityID"][~ents["EntityID"].isin(known_ids)].unique().tolist()))
+      dup_known = ents["EntityID"].isin(known_ids)
+      issues.append(_issues("entities", ents.index[bad_type], "error", "Unknown entity type", ents["Type"][bad_type]))
+      issues.append(_issues("entities", ents.index[empty], "error", "Empty name or ID", ents["Name"][empty]))
+      issues.append(_issues("entities", ents.index[(dup_in_chunk | dup_known) & ~empty], "error", "Duplicate EntityID", ents["EntityID"][(dup_in_chunk | dup_known) & ~empty]))
+      keep = ents[~(bad_type | empty | dup_in_chunk | dup_known)]
+      known_ids.update(keep["EntityID"])
+      accepted_entities.append(keep)
+      if progress:
+        progress(fraction, f"Entities: {rows_seen:,} rows read")
+
+  if relationships_source is not None:
+    rows_seen = 0
+    # With dated history, only the stakes in force today count towards 100%
+    today = day_number(date.today())
+    if store is None:
+      existing_equity = existing_relationships[(existing_relationships["RelationshipType"] == "Equity") & in_force(existing_relationships, today)]
+      equity_sums = existing_equity.groupby("OwnedID")["OwnershipPct"].sum().astype(float)
+    else:
+      # Filled in from the store as each chunk names new owned entities
+      equity_sums = pd.Series(dtype=float)
+      totals_read = set()
+    for chunk, fraction in iter_chunks(relationships_source, chunksize):
+      chunk.index = pd.RangeIndex(rows_seen + 2, rows_seen + 2 + len(chunk))
+      rows_seen += len(chunk)
+      count("import chunks")
+      missing = [c for c in ("Owner", "Owned") if f"{c}ID" not in chunk and f"{c}Name" not in chunk]
+      if missing:
+        issues.append(_issues("relationships", chunk.index[:1], "error", "Missing column", " / ".join(f"{c}ID or {c}Name" for c in missing)))
+        break
+      rels = _normalise_relationships(chunk, percent_scale)
+      bad_date = pd.Series(False, index=rels.index)
+      for column in ("ValidFrom", "ValidTo"):
+        unreadable = rels[column].isna() & rels[f"{column}Raw"].notna()
+        issues.append(_issues("relationships", rels.index[unreadable], "error", f"Unreadable {column} date", rels[f"{column}Raw"][unreadable]))
+        bad_date |= unreadable
+      backwards = rels["ValidFrom"].notna() & rels["ValidTo"].notna() & (rels["ValidFrom"] >= rels["ValidTo"])
+      issues.append(_issues("relationships", rels.index[backwards], "error", "ValidTo not after ValidFrom", rels["ValidFrom"][backwards] + " / " + rels["ValidTo"][backwards]))
+      rels = rels[RELATIONSHIP_COLUMNS]
+      if store is not None:
+        named = pd.unique(pd.concat([rels["OwnerID"], rels["OwnedID"]], ignore_index=True))
+        known_ids.update(store.existing_ids([eid for eid in named if eid not in known_ids]))
+      bad_type = ~rels["RelationshipType"].isin(RELATIONSHIP_TYPES)
+      empty = rels["OwnerID"].eq("") | rels["OwnedID"].eq("")
+      unknown_owner = ~rels["OwnerID"].isin(known_ids) & ~empty
+      unknown_owned = ~rels["OwnedID"].isin(known_ids) & ~empty
+      is_equity = rels["RelationshipType"] == "Equity"
+      bad_pct = is_equity & ~rels["OwnershipPct"].between(0.0, 1.0)
+      self_owned = (rels["OwnerID"] == rels["OwnedID"]) & ~empty
+      issues.append(_issues("relationships", rels.index[bad_type], "error", "Unknown relationship type", rels["RelationshipType"][bad_type]))
+      issues.append(_issues("relationships", rels.index[empty], "error", "Empty name or ID", rels["OwnerID"][empty] + " -> " + rels["OwnedID"][empty]))
+      issues.append(_issues("relationships", rels.index[unknown_owner], "error", "Owner not found", rels["OwnerID"][unknown_owner]))
+      issues.append(_issues("relationships", rels.index[unknown_owned], "error", "Owned entity not found", rels["OwnedID"][unknown_owned]))
+      issues.append(_issues("relationships", rels.index[bad_pct], "error", "Equity share outside 0-100%", rels["OwnershipPct"][bad_pct]))
+      issues.append(_issues("relationships", rels.index[self_owned], "error", "Entity owns itself", rels["OwnerID"][self_owned]))
+      keep = rels[~(bad_type | empty | unknown_owner | unknown_owned | bad_pct | self_owned | bad_date | backwards)]
+      current = keep[(keep["RelationshipType"] == "Equity") & in_force(keep, today)]
+      chunk_sums = current.groupby("OwnedID")["OwnershipPct"].sum()
+      if store is not None:
+        unread = [eid for eid in chunk_sums.index if eid not in totals_read]
+        totals_read.update(unread)
+        equity_sums = equity_sums.add(pd.Series(store.equity_totals(unread, date.today().isoformat()), dtype=float), fill_value=0.0)
+      equity_sums = equity_sums.add(chunk_sums, fill_value=0.0)
+      accepted_relationships.append(keep)
+      if progress:
+        progress(fraction, f"Relationships: {rows_seen:,} rows read")
+
+    # Same check as the direct equity sums panel, over existing plus imported equity
+    over = equity_sums[equity_sums > 1.0 + 1e-9]
+    if len(over):
+      issues.append(pd.DataFrame({"File": "relationships", "Row": None, "Severity": "warning", "Issue": "Total equity over 100%", "Detail": [f"{eid}: {pct*100:.2f}%" for eid, pct in over.items()]}))
+
+  new_entities = pd.concat(accepted_entities, ignore_index=True) if accepted_entities else pd.DataFrame(columns=ENTITY_COLUMNS)
+  new_relationships = pd.concat(accepted_relationships, ignore_index=True) if accepted_relationships else pd.DataFrame(columns=RELATIONSHIP_COLUMNS)
+  issues = [i for i in issues if len(i)]
+  issues_df = pd.concat(issues, ignore_index=True) if issues else pd.DataFrame(columns=ISSUE_COLUMNS)
+  if progress:
+    progress(1.0, f"Read {len(new_entities):,} entities and {len(new_relationships):,} relationships")
+  return new_entities, new_relationships, issues_df
@@ -0,0 +1,118 @@
+import pandas as pd
+from collections import defaultdict
+from graph_store import GraphStore, DIRECTORSHIP
+from ubo_engine import propagate_ultimate_ownership, propagate_control
+from instrumentation import instrument
+
+# DOT generation for the ownership diagram. Rendering to images is left to
+# Streamlit's graphviz_chart and diagram_render, so this module needs neither.
+
+OTHERS_NODE = "__others__"
+
+def diagram_nodes(store: GraphStore, target: str, max_depth: int = None):
+  """Entities with a relationship path up to the target, at most max_depth links away"""
+  seen = {target}
+  frontier = [target]
+  depth = 0
+  while frontier and (max_depth is None or depth < max_depth):
+    nxt = []
+    for node in frontier:
+      for owner, _, _ in store.in_edges(node):
+        if owner not in seen:
+          seen.add(owner)
+          nxt.append(owner)
+    frontier = nxt
+    depth += 1
+  return seen
+
+@instrument()
+def make_dot(entities: pd.DataFrame, relationships: pd.DataFrame, target: str, ultimate_ownership: dict = None, control: dict = None, store: GraphStore = None, prune: bool = False, others_below: float = 0.0, max_depth: int = None): 
+  if store is None:
+    store = GraphStore(entities, relationships)
+  
+  # Calculate ultimate ownership
+  if ultimate_ownership is None:
+    ultimate_ownership = propagate_ultimate_ownership(entities, relationships, target, store=store)
+
+  # Pruning: only draw entities linked up to the target, and fold small owners into one node
+  shown = diagram_nodes(store, target, max_depth) if prune or max_depth else None
+  collapsed = set()
+  if others_below > 0:
+    if control is None:
+      control = propagate_control(relationships, target, store=store)
+    # Only minor shareholders fold: never a controller, a director of the target, or
+    # anything without a stake (subsidiaries, director-only people)
+    collapsed = {
+      eid for eid, rec in ultimate_ownership.items()
+      if eid != target and (shown is None or eid in shown) and rec['UltimateOwnership'] < others_below
+      and eid not in control and not store.edge_mask_of(eid, target) & DIRECTORSHIP
+    }
+
+  # Node styling 
+  company_style = 'shape=box, style=filled, color=white, fontcolor=white, fillcolor="#1f5f7a"' 
+  person_style = 'shape=box, style=filled, color=white, fontcolor=white, fillcolor="#f28c28"' 
+  others_style = 'shape=box, style="filled,dashed", color="#7f8c8d", fontcolor="#2c3e50", fillcolor="#ecf0f1"'
+
+  dot_lines = ["digraph G {", "rankdir=TB", "splines=true", "fontname=Helvetica", "node [fontname=Helvetica, fontsize=10]", "edge [fontname=Helvetica, color=\"#2c3e50\", fontsize=9]"] 
+
+  # Subgraphs to keep same ranks for each layer 
+  by_layer = defaultdict(list)
+  for rec in store.records[:store.entity_count]:
+    if (shown is None or rec.entity_id in shown) and rec.entity_id not in collapsed:
+      by_layer[int(rec.layer)].append(rec)
+  max_layer = max(by_layer) if by_layer else 0 
+  for L in range(0, max_layer+1): 
+    dot_lines.append(f"subgraph cluster_layer_{L} {{ rank=same; color=\"#ffffff00\"; label=\"\";") 
+    for rec in by_layer.get(L, ()): 
+      eid = rec.entity_id
+      style = company_style if rec.type == 'Company' else person_style 
+      label = rec.name
+      
+      # Add type label
+      type_label = "Company" if rec.type == 'Company' else "Person"
+      
+      # Add ultimate ownership to label if this entity owns the target
+      if eid in ultimate_ownership and eid != target:
+        ult_pct = ultimate_ownership[eid]['UltimateOwnership'] * 100
+        label = f"{label}\\n[{type_label}]\\n({ult_pct:.2f}% of target)"
+      else:
+        label = f"{label}\\n[{type_label}]"
+      
+      dot_lines.append(f"\"{eid}\" [{style}, label=\"{label}\"];") 
+    dot_lines.append("}") 
+
+  if collapsed:
+    dot_lines.append(f"\"{OTHERS_NODE}\" [{others_style}, label=\"Others\\n({len(collapsed)} {'owner' if len(collapsed) == 1 else 'owners'} below {others_below*100:.2f}%)\"];")
+
+  # Edges with combined labels, one per owner-owned pair
+  others_links = defaultdict(int)
+  for owner, owned, equity, mask in store.edges():
+    if shown is not None and (owner not in shown or owned not in shown):
+      continue
+    if owner in collapsed or owned in collapsed:
+      if not (owner in collapsed and owned in collapsed):
+        others_links[(OTHERS_NODE if owner in collapsed else owner, OTHERS_NODE if owned in collapsed else owned)] += 1
+      continue
+
+    labels = []
+    
+    if equity is not None:
+      pct = equity * 100
+      labels.append(f"{pct:.1f}% equity")
+    
+    if mask & DIRECTORSHIP:
+      labels.append("director")
+    
+    label_text = " + ".join(labels)
+    
+    # Use solid line if any equity, dashed if only directorship
+    if equity is not None:
+      dot_lines.append(f"\"{owner}\" -> \"{owned}\" [label=\"{label_text}\", arrowsize=0.8];")
+    else:
+      dot_lines.append(f"\"{owner}\" -> \"{owned}\" [style=dashed, arrowsize=0.6, color=\"#7f8c8d\", label=\"{label_text}\"];")
+
+  for (owner, owned), count in others_links.items():
+    dot_lines.append(f"\"{owner}\" -> \"{owned}\" [style=dotted, arrowsize=0.6, color=\"#7f8c8d\", label=\"{count} link{'s' if count != 1 else ''}\"];")
+  
+  dot_lines.append("}") 
+  return "\n".join(dot_lines)
@@ -0,0 +1,44 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import graphviz
+
+# PNG rendering off the script thread. Jobs are keyed by a hash of the DOT text, so
+# the same diagram is only ever sent to the graphviz subprocess once.
+
+def dot_hash(dot: str) -> str:
+  return hashlib.blake2b(dot.encode("utf-8"), digest_size=16).hexdigest()
+
+def _render_png(dot: str) -> bytes:
+  return graphviz.Source(dot).pipe(format="png")
+
+class PngRenderer:
+  """Background graphviz renderer with an LRU of finished (or running) jobs"""
+
+  def __init__(self, max_entries: int = 16, workers: int = 1):
+    self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="png-render")
+    self.jobs = OrderedDict()
+    self.max_entries = max_entries
+    self.lock = threading.Lock()
+
+  def get(self, dot: str):
+    """Future for this DOT text if it has been submitted, else None"""
+    with self.lock:
+      job = self.jobs.get(dot_hash(dot))
+      if job is not None:
+        self.jobs.move_to_end(dot_hash(dot))
+      return job
+
+  def submit(self, dot: str):
+    key = dot_hash(dot)
+    with self.lock:
+      job = self.jobs.get(key)
+      if job is None:
+        job = self.executor.submit(_render_png, dot)
+        self.jobs[key] = job
+        # Running jobs are never evicted, so a result is not lost mid-render
+        for old_key in [k for k, f in self.jobs.items() if f.done()][:max(0, len(self.jobs) - self.max_entries)]:
+          del self.jobs[old_key]
+      self.jobs.move_to_end(key)
+      return job
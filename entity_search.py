@@ -0,0 +1,74 @@
+from array import array
+from bisect import bisect_right
+
+# Search over entity names and IDs for the pickers.
+#
+# Every entity becomes one "name<TAB>id" line of a single case-folded text, so a
+# substring query is str.find over that text, skipping to the next line after
+# each hit. A hit at the start of the name or of the ID is a prefix match; those
+# are listed first. Results are resolved by EntityID, never by list position.
+
+def normalise(text) -> str:
+  return str(text).casefold()
+
+def match_rank(query: str, entity_id, name):
+  """0 for a prefix match on name or ID, 1 for a substring match, None for none (query normalised)"""
+  name, entity_id = normalise(name), normalise(entity_id)
+  if name.startswith(query) or entity_id.startswith(query):
+    return 0
+  if query in name or query in entity_id:
+    return 1
+  return None
+
+class EntitySearchIndex:
+  """Prefix and substring search over entity names and IDs, with the same call as GraphDatabase.search_entities"""
+
+  def __init__(self, ids, names, types=None):
+    self.ids = list(ids)
+    self.names = list(names)
+    self.types = None if types is None else list(types)
+    lines = [normalise(n) + "\t" + normalise(e) for e, n in zip(self.ids, self.names)]
+    self.text = "\n".join(lines)
+    # Offset of each line in text, with one past the end as a sentinel
+    self.starts = array("q", [0])
+    for line in lines:
+      self.starts.append(self.starts[-1] + len(line) + 1)
+    self.last = (None, None)
+
+  def __len__(self) -> int:
+    return len(self.ids)
+
+  def search(self, query: str, entity_type: str = None) -> list:
+    """Entity numbers matching query: prefix matches first, then substrings, each in entity order"""
+    key = (query, entity_type)
+    if self.last[0] == key:
+      return self.last[1]
+    q = normalise(query.strip())
+    if not q:
+      rows = range(len(self.ids))
+    elif "\n" in q or "\t" in q:
+      rows = []
+    else:
+      text, starts = self.text, self.starts
+      prefix, inner = [], []
+      pos = text.find(q)
+      while pos != -1:
+        row = bisect_right(starts, pos) - 1
+        start = starts[row]
+        # Line is "name\tid": a prefix hit is at the line start or just after the tab
+        if pos == start or text[pos - 1] == "\t":
+          prefix.append(row)
+        else:
+          tab = text.find("\t", start)
+          (prefix if text.startswith(q, tab + 1) else inner).append(row)
+        pos = text.find(q, starts[row + 1])
+      rows = prefix + inner
+    if entity_type is not None and self.types is not None:
+      rows = [r for r in rows if self.types[r] == entity_type]
+    self.last = (key, rows)
+    return rows
+
+  def search_entities(self, query: str = "", entity_type: str = None, offset: int = 0, limit: int = 50):
+    """(number of matches, [(EntityID, Name)] for matches offset..offset+limit)"""
+    rows = self.search(query, entity_type)
+    return len(rows), [(self.ids[r], self.names[r]) for r in rows[offset:offset + limit]]
@@ -0,0 +1,158 @@
+from collections import defaultdict
+import pandas as pd
+from instrumentation import timed, count
+from result_cache import frame_fingerprint
+
+# Growable columnar storage for the session's entities and relationships.
+#
+# Inserts append to per-column lists, updates write in place and deletes leave a
+# tombstone, so an edit costs O(1) however large the graph is. Key and column
+# indexes make duplicate checks and cascades lookups rather than scans. A
+# DataFrame is only built when a view asks for one, and then reused until the
+# next change; so is its content hash, which keys the cached results.
+
+class ColumnarTable:
+  """Columns as lists, with tombstoned deletes and key -> row / value -> rows indexes"""
+
+  def __init__(self, columns: list, key: str = None, index_on: tuple = ()):
+    self.columns = list(columns)
+    self.key = key
+    self.index_on = tuple(index_on)
+    self.clear()
+
+  def clear(self):
+    self.data = {c: [] for c in self.columns}
+    self.alive = []
+    self.live = 0
+    self.rows_by_key = {}
+    self.rows_by = {c: defaultdict(set) for c in self.index_on}
+    self.version = 0
+    self.cached = (None, None)
+    self.cached_fingerprint = (None, None)
+
+  def __len__(self) -> int:
+    return self.live
+
+  def __contains__(self, key) -> bool:
+    return key in self.rows_by_key
+
+  def row_of(self, key):
+    return self.rows_by_key.get(key)
+
+  def get(self, row: int) -> dict:
+    return {c: self.data[c][row] for c in self.columns}
+
+  def rows_where(self, column: str, value) -> list:
+    """Live rows whose column equals value, in insertion order (column must be in index_on)"""
+    return sorted(self.rows_by[column].get(value, ()))
+
+  def _add(self, values: tuple) -> int:
+    row = len(self.alive)
+    if self.key is not None:
+      k = values[self.columns.index(self.key)]
+      if k in self.rows_by_key:
+        raise ValueError(f"duplicate {self.key}: {k}")
+      self.rows_by_key[k] = row
+    for c, v in zip(self.columns, values):
+      self.data[c].append(v)
+    self.alive.append(True)
+    self.live += 1
+    for c in self.index_on:
+      self.rows_by[c][self.data[c][row]].add(row)
+    return row
+
+  def append(self, row: dict) -> int:
+    self.version += 1
+    return self._add(tuple(row.get(c) for c in self.columns))
+
+  def extend(self, rows) -> list:
+    """Append a DataFrame (or list of dicts) of rows as one change; nothing is added if any key is taken"""
+    if isinstance(rows, pd.DataFrame):
+      records = list(zip(*(rows[c].tolist() if c in rows else [None] * len(rows) for c in self.columns)))
+    else:
+      records = [tuple(r.get(c) for c in self.columns) for r in rows]
+    if self.key is not None:
+      # Checked up front so a duplicate part way through cannot leave the columns half-appended
+      at = self.columns.index(self.key)
+      seen = set()
+      for values in records:
+        k = values[at]
+        if k in self.rows_by_key or k in seen:
+          raise ValueError(f"duplicate {self.key}: {k}")
+        seen.add(k)
+    self.version += 1
+    return [self._add(values) for values in records]
+
+  def update(self, row: int, **values):
+    if self.key in values and values[self.key] != self.data[self.key][row] and values[self.key] in self.rows_by_key:
+      raise ValueError(f"duplicate {self.key}: {values[self.key]}")
+    self.version += 1
+    for c, v in values.items():
+      old = self.data[c][row]
+      if c == self.key and v != old:
+        del self.rows_by_key[old]
+        self.rows_by_key[v] = row
+      if c in self.rows_by:
+        self.rows_by[c][old].discard(row)
+        self.rows_by[c][v].add(row)
+      self.data[c][row] = v
+
+  def delete(self, row: int):
+    if not self.alive[row]:
+      return
+    self.version += 1
+    self.alive[row] = False
+    self.live -= 1
+    if self.key is not None:
+      self.rows_by_key.pop(self.data[self.key][row], None)
+    for c in self.index_on:
+      self.rows_by[c][self.data[c][row]].discard(row)
+
+  def delete_where(self, column: str, value) -> int:
+    rows = self.rows_where(column, value)
+    for row in rows:
+      self.delete(row)
+    return len(rows)
+
+  def replace(self, frame: pd.DataFrame):
+    """Drop everything and load the rows of frame"""
+    self.clear()
+    self.extend(frame)
+
+  def _compact(self):
+    # Row numbers change here, so only frame() calls this, once the edit is done
+    keep = [i for i, a in enumerate(self.alive) if a]
+    data = {c: [self.data[c][i] for i in keep] for c in self.columns}
+    version = self.version
+    self.clear()
+    self.data = data
+    self.alive = [True] * len(keep)
+    self.live = len(keep)
+    if self.key is not None:
+      self.rows_by_key = {k: i for i, k in enumerate(data[self.key])}
+    for c in self.index_on:
+      for i, v in enumerate(data[c]):
+        self.rows_by[c][v].add(i)
+    self.version = version
+
+  def frame(self) -> pd.DataFrame:
+    """Live rows as a DataFrame indexed by row number; built once per change"""
+    if self.cached[0] == self.version:
+      return self.cached[1]
+    with timed("ColumnarTable.frame"):
+      if len(self.alive) > 2 * self.live + 64:
+        self._compact()
+      if self.live == len(self.alive):
+        df = pd.DataFrame(self.data, columns=self.columns)
+      else:
+        keep = [i for i, a in enumerate(self.alive) if a]
+        df = pd.DataFrame({c: [self.data[c][i] for i in keep] for c in self.columns}, index=keep, columns=self.columns)
+    count("frames materialised")
+    self.cached = (self.version, df)
+    return df
+
+  def fingerprint(self) -> str:
+    """frame_fingerprint of frame(), hashed once per change"""
+    if self.cached_fingerprint[0] != self.version:
+      self.cached_fingerprint = (self.version, frame_fingerprint(self.frame()))
+    return self.cached_fingerprint[1]
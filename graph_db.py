@@ -0,0 +1,255 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+import pandas as pd
+from instrumentation import instrument, count
+from ownership_history import date_text
+
+# Persistent entities and relationships in an embedded SQLite file.
+#
+# The app keeps working on DataFrames in session state; this store is where they
+# are loaded from and written through to. Reads pull only the part of the graph
+# that can reach the selected target, via an indexed recursive query, and each
+# form's writes go into one transaction.
+
+ENTITY_COLUMNS = ["EntityID", "Name", "Type", "Layer"]
+RELATIONSHIP_COLUMNS = ["OwnerID", "OwnedID", "RelationshipType", "OwnershipPct", "ValidFrom", "ValidTo"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entities (
+  EntityID TEXT PRIMARY KEY,
+  Name TEXT NOT NULL,
+  Type TEXT NOT NULL,
+  Layer INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS relationships (
+  RelID INTEGER PRIMARY KEY AUTOINCREMENT,
+  OwnerID TEXT NOT NULL,
+  OwnedID TEXT NOT NULL,
+  RelationshipType TEXT NOT NULL,
+  OwnershipPct REAL,
+  ValidFrom TEXT,
+  ValidTo TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_rel_owner ON relationships (OwnerID);
+CREATE INDEX IF NOT EXISTS idx_rel_owned ON relationships (OwnedID);
+CREATE INDEX IF NOT EXISTS idx_rel_type ON relationships (RelationshipType);
+CREATE INDEX IF NOT EXISTS idx_entity_type ON entities (Type);
+"""
+
+# Files written before relationships had effective dates get the columns added
+VALIDITY_MIGRATION = ["ALTER TABLE relationships ADD COLUMN ValidFrom TEXT", "ALTER TABLE relationships ADD COLUMN ValidTo TEXT"]
+
+# Trigram full-text index over entity names and IDs for the search pickers, kept in
+# step with the entities table by triggers. Needs SQLite's FTS5 trigram tokenizer
+# (3.34+); without it search falls back to a LIKE scan.
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE entity_search USING fts5(EntityID, Name, content='entities', tokenize='trigram');
+CREATE TRIGGER entity_search_ai AFTER INSERT ON entities BEGIN
+  INSERT INTO entity_search (rowid, EntityID, Name) VALUES (new.rowid, new.EntityID, new.Name);
+END;
+CREATE TRIGGER entity_search_ad AFTER DELETE ON entities BEGIN
+  INSERT INTO entity_search (entity_search, rowid, EntityID, Name) VALUES ('delete', old.rowid, old.EntityID, old.Name);
+END;
+CREATE TRIGGER entity_search_au AFTER UPDATE ON entities BEGIN
+  INSERT INTO entity_search (entity_search, rowid, EntityID, Name) VALUES ('delete', old.rowid, old.EntityID, old.Name);
+  INSERT INTO entity_search (rowid, EntityID, Name) VALUES (new.rowid, new.EntityID, new.Name);
+END;
+INSERT INTO entity_search (entity_search) VALUES ('rebuild');
+"""
+
+# Everything with a route of relationships into the target, the target included.
+# UNION (not UNION ALL) drops repeats, so circular holdings terminate.
+UPSTREAM = """
+WITH RECURSIVE upstream(id) AS (
+  SELECT ?
+  UNION
+  SELECT r.OwnerID FROM relationships r JOIN upstream u ON r.OwnedID = u.id
+)
+"""
+
+# IDs per IN (...) lookup, well under SQLite's limit on bound parameters
+LOOKUP_BATCH = 500
+
+def _like(text: str) -> str:
+  return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def _pct(value):
+  return None if value is None or pd.isna(value) else float(value)
+
+class GraphDatabase:
+  """SQLite store behind the entity and relationship forms; safe to share between sessions"""
+
+  def __init__(self, path: str):
+    self.path = path
+    self.local = threading.local()
+    # executescript commits on its own, so it runs outside transaction()
+    conn = self._conn()
+    conn.executescript(SCHEMA)
+    if "ValidFrom" not in {r[1] for r in conn.execute("PRAGMA table_info(relationships)")}:
+      for statement in VALIDITY_MIGRATION:
+        conn.execute(statement)
+    self.fts = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'entity_search'").fetchone() is not None
+    if not self.fts:
+      try:
+        conn.executescript("BEGIN;" + SEARCH_SCHEMA + "COMMIT;")
+        self.fts = True
+      except sqlite3.OperationalError:
+        # No FTS5 / trigram tokenizer in this SQLite build
+        if conn.in_transaction:
+          conn.execute("ROLLBACK")
+
+  def _conn(self):
+    # One connection per thread: WAL lets readers in other sessions carry on during a write
+    conn = getattr(self.local, "conn", None)
+    if conn is None:
+      conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+      conn.execute("PRAGMA journal_mode=WAL")
+      conn.execute("PRAGMA synchronous=NORMAL")
+      self.local.conn = conn
+      self.local.depth = 0
+    return conn
+
+  @contextmanager
+  def transaction(self):
+    """Group writes into one commit; nested blocks join the outer transaction"""
+    conn = self._conn()
+    if self.local.depth == 0:
+      conn.execute("BEGIN IMMEDIATE")
+    self.local.depth += 1
+    try:
+      yield conn
+    except BaseException:
+      self.local.depth -= 1
+      if self.local.depth == 0:
+        conn.execute("ROLLBACK")
+      raise
+    self.local.depth -= 1
+    if self.local.depth == 0:
+      conn.execute("COMMIT")
+
+  # Reads
+
+  def has_entity(self, entity_id: str) -> bool:
+    return self._conn().execute("SELECT 1 FROM entities WHERE EntityID = ?", (entity_id,)).fetchone() is not None
+
+  def existing_ids(self, ids: list) -> set:
+    """Those of ids that are stored entities, looked up in batches rather than loading the table"""
+    conn = self._conn()
+    found = set()
+    for i in range(0, len(ids), LOOKUP_BATCH):
+      batch = list(ids[i:i + LOOKUP_BATCH])
+      found.update(r[0] for r in conn.execute(f"SELECT EntityID FROM entities WHERE EntityID IN ({','.join('?' * len(batch))})", batch))
+    return found
+
+  def equity_totals(self, owned_ids: list, on: str) -> dict:
+    """Total equity in force on the ISO date on into each of owned_ids that has any"""
+    conn = self._conn()
+    totals = {}
+    for i in range(0, len(owned_ids), LOOKUP_BATCH):
+      batch = list(owned_ids[i:i + LOOKUP_BATCH])
+      totals.update(conn.execute(
+        "SELECT OwnedID, SUM(OwnershipPct) FROM relationships WHERE RelationshipType = 'Equity'"
+        " AND (ValidFrom IS NULL OR ValidFrom <= ?) AND (ValidTo IS NULL OR ValidTo > ?)"
+        f" AND OwnedID IN ({','.join('?' * len(batch))}) GROUP BY OwnedID",
+        [on, on] + batch))
+    return totals
+
+  @instrument("GraphDatabase.search_entities")
+  def search_entities(self, query: str = "", entity_type: str = None, offset: int = 0, limit: int = 50):
+    """(number of matches, [(EntityID, Name)] for one page): prefix matches on name or ID first"""
+    q = query.strip()
+    where, params = [], []
+    if entity_type is not None:
+      where.append("Type = ?")
+      params.append(entity_type)
+    if len(q) >= 3 and self.fts:
+      # Trigram index: a quoted phrase matches as a substring of either column
+      where.append("rowid IN (SELECT rowid FROM entity_search WHERE entity_search MATCH ?)")
+      params.append('"' + q.replace('"', '""') + '"')
+    elif q:
+      where.append("(Name LIKE ? ESCAPE '\\' OR EntityID LIKE ? ESCAPE '\\')")
+      params += ["%" + _like(q) + "%"] * 2
+    clause = (" WHERE " + " AND ".join(where)) if where else ""
+    conn = self._conn()
+    total = conn.execute("SELECT COUNT(*) FROM entities" + clause, params).fetchone()[0]
+    prefix = _like(q) + "%"
+    rows = conn.execute(
+      "SELECT EntityID, Name FROM entities" + clause +
+      " ORDER BY NOT (Name LIKE ? ESCAPE '\\' OR EntityID LIKE ? ESCAPE '\\'), rowid LIMIT ? OFFSET ?",
+      params + [prefix, prefix, limit, offset]).fetchall()
+    return total, rows
+
+  @instrument("GraphDatabase.load_subgraph")
+  def load_subgraph(self, target: str):
+    """(entities, relationships) frames of everything that can reach target, in insertion order"""
+    conn = self._conn()
+    if target is None:
+      return pd.DataFrame(columns=ENTITY_COLUMNS), pd.DataFrame(columns=RELATIONSHIP_COLUMNS)
+    entities = pd.read_sql_query(
+      UPSTREAM + "SELECT EntityID, Name, Type, Layer FROM entities WHERE EntityID IN (SELECT id FROM upstream) ORDER BY rowid",
+      conn, params=(target,))
+    relationships = pd.read_sql_query(
+      UPSTREAM + "SELECT OwnerID, OwnedID, RelationshipType, OwnershipPct, ValidFrom, ValidTo FROM relationships WHERE OwnedID IN (SELECT id FROM upstream) ORDER BY RelID",
+      conn, params=(target,))
+    entities["Layer"] = entities["Layer"].astype(int)
+    relationships["OwnershipPct"] = relationships["OwnershipPct"].astype(float)
+    count("entities loaded", len(entities))
+    count("relationships loaded", len(relationships))
+    return entities, relationships
+
+  # Writes
+
+  @instrument("GraphDatabase.add_entities")
+  def add_entities(self, rows: pd.DataFrame):
+    with self.transaction() as conn:
+      conn.executemany(
+        "INSERT INTO entities (EntityID, Name, Type, Layer) VALUES (?, ?, ?, ?)",
+        zip(rows["EntityID"], rows["Name"], rows["Type"], rows["Layer"].astype(int).tolist()))
+
+  @instrument("GraphDatabase.add_relationships")
+  def add_relationships(self, rows: pd.DataFrame):
+    with self.transaction() as conn:
+      undated = [None] * len(rows)
+      conn.executemany(
+        "INSERT INTO relationships (OwnerID, OwnedID, RelationshipType, OwnershipPct, ValidFrom, ValidTo) VALUES (?, ?, ?, ?, ?, ?)",
+        zip(rows["OwnerID"], rows["OwnedID"], rows["RelationshipType"], map(_pct, rows["OwnershipPct"]),
+            map(date_text, rows["ValidFrom"] if "ValidFrom" in rows else undated), map(date_text, rows["ValidTo"] if "ValidTo" in rows else undated)))
+
+  def update_entity(self, entity_id: str, name: str, entity_type: str, layer: int):
+    with self.transaction() as conn:
+      conn.execute("UPDATE entities SET Name = ?, Type = ?, Layer = ? WHERE EntityID = ?", (name, entity_type, int(layer), entity_id))
+
+  def delete_entity(self, entity_id: str):
+    """Delete an entity and every relationship it is on either side of"""
+    with self.transaction() as conn:
+      conn.execute("DELETE FROM relationships WHERE OwnerID = ?", (entity_id,))
+      conn.execute("DELETE FROM relationships WHERE OwnedID = ?", (entity_id,))
+      conn.execute("DELETE FROM entities WHERE EntityID = ?", (entity_id,))
+
+  def _rel_id(self, conn, rel: tuple):
+    # Identical rows are interchangeable, so any one of them stands for the row edited
+    owner, owned, rel_type, pct, valid_from, valid_to = rel
+    row = conn.execute(
+      "SELECT RelID FROM relationships WHERE OwnerID = ? AND OwnedID = ? AND RelationshipType = ? AND OwnershipPct IS ? AND ValidFrom IS ? AND ValidTo IS ? ORDER BY RelID LIMIT 1",
+      (owner, owned, rel_type, _pct(pct), date_text(valid_from), date_text(valid_to))).fetchone()
+    return None if row is None else row[0]
+
+  def update_relationship(self, old: tuple, new: tuple):
+    """old/new are (owner, owned, relationship type, pct, valid from, valid to)"""
+    with self.transaction() as conn:
+      rel_id = self._rel_id(conn, old)
+      if rel_id is not None:
+        conn.execute("UPDATE relationships SET OwnerID = ?, OwnedID = ?, RelationshipType = ?, OwnershipPct = ?, ValidFrom = ?, ValidTo = ? WHERE RelID = ?",
+                     (new[0], new[1], new[2], _pct(new[3]), date_text(new[4]), date_text(new[5]), rel_id))
+
+  def delete_relationship(self, rel: tuple):
+    with self.transaction() as conn:
+      rel_id = self._rel_id(conn, rel)
+      if rel_id is not None:
+        conn.execute("DELETE FROM relationships WHERE RelID = ?", (rel_id,))
+
+  def clear(self):
+    with self.transaction() as conn:
+      conn.execute("DELETE FROM relationships")
+      conn.execute("DELETE FROM entities")
@@ -0,0 +1,147 @@
+import numpy as np
+import pandas as pd
+from instrumentation import instrument
+
+# Integer-indexed view of the entities and relationships frames.
+#
+# EntityIDs are interned to 0..n-1. Each distinct (owner, owned) pair is one edge
+# carrying its summed equity share and a bitmask of relationship types. Edges are
+# held sorted by owner, with a CSR offset array over the same edges sorted by owned
+# entity, so an entity's incoming edges are a slice rather than a frame scan.
+# The equity adjacency views keep one entry per equity row instead, as build_adj
+# does, so two holdings of the same pair stay two paths.
+
+EQUITY = 1
+DIRECTORSHIP = 2
+STATUS_BY_MASK = {EQUITY: "shareholder", DIRECTORSHIP: "director", EQUITY | DIRECTORSHIP: "both"}
+
+class EntityRecord:
+  __slots__ = ("idx", "entity_id", "name", "type", "layer")
+
+  def __init__(self, idx: int, entity_id: str, name: str, type: str, layer: int):
+    self.idx = idx
+    self.entity_id = entity_id
+    self.name = name
+    self.type = type
+    self.layer = layer
+
+class AdjacencyView:
+  """Read-only build_adj-style mapping: EntityID -> ((neighbour EntityID, pct), ...)"""
+  __slots__ = ("store", "offsets", "neighbours", "pct", "cache")
+
+  def __init__(self, store, offsets: np.ndarray, neighbours: np.ndarray, pct: np.ndarray):
+    self.store = store
+    self.offsets = offsets
+    self.neighbours = neighbours
+    self.pct = pct
+    # Tuples are built on first lookup and shared after that; callers only iterate them.
+    # At most one per entity, so the view never holds more than its edges a second time
+    self.cache = {}
+
+  def get(self, entity_id: str, default=()):
+    i = self.store.index.get(entity_id)
+    if i is None:
+      return default
+    found = self.cache.get(i)
+    if found is None:
+      lo, hi = self.offsets[i], self.offsets[i + 1]
+      ids = self.store.ids
+      found = self.cache[i] = tuple((ids[n], p) for n, p in zip(self.neighbours[lo:hi].tolist(), self.pct[lo:hi].tolist()))
+    return found or default
+
+  def __getitem__(self, entity_id: str):
+    return self.get(entity_id, ())
+
+  def __contains__(self, entity_id: str) -> bool:
+    return bool(self.get(entity_id))
+
+  def items(self):
+    for i in np.flatnonzero(np.diff(self.offsets)).tolist():
+      eid = self.store.ids[i]
+      yield eid, self.get(eid)
+
+def _csr(keys: np.ndarray, n: int):
+  """Stable order of edges grouped by key, and the offsets of each key's slice"""
+  order = np.argsort(keys, kind="stable")
+  offsets = np.zeros(n + 1, dtype=np.int64)
+  np.cumsum(np.bincount(keys, minlength=n), out=offsets[1:])
+  return order, offsets
+
+class GraphStore:
+  """Interned, CSR-backed graph for O(1) edge and relationship-status lookups"""
+
+  @instrument("GraphStore")
+  def __init__(self, entities: pd.DataFrame, relationships: pd.DataFrame):
+    ids = list(dict.fromkeys(list(entities["EntityID"]) + list(relationships["OwnerID"]) + list(relationships["OwnedID"])))
+    self.ids = ids
+    # Entities from the frame come first; the rest are only named by relationships
+    self.entity_count = entities["EntityID"].nunique()
+    self.index = {eid: i for i, eid in enumerate(ids)}
+    names = dict(zip(entities["EntityID"], entities["Name"]))
+    types = dict(zip(entities["EntityID"], entities["Type"]))
+    layers = dict(zip(entities["EntityID"], entities["Layer"]))
+    self.records = [EntityRecord(i, eid, names.get(eid, eid), types.get(eid, "Unknown"), layers.get(eid, 0)) for i, eid in enumerate(ids)]
+    n = len(ids)
+
+    # Collapse relationship rows into one edge per (owner, owned) pair
+    rels = pd.DataFrame({
+      "o": pd.Index(ids).get_indexer(relationships["OwnerID"]),
+      "d": pd.Index(ids).get_indexer(relationships["OwnedID"]),
+    })
+    is_equity = relationships["RelationshipType"].to_numpy() == "Equity"
+    rels["eq"] = np.where(is_equity, pd.to_numeric(relationships["OwnershipPct"], errors="coerce").fillna(0.0).to_numpy(), 0.0)
+    rels["has_eq"] = is_equity
+    rels["has_dir"] = relationships["RelationshipType"].to_numpy() == "Directorship"
+    pairs = rels.groupby(["o", "d"], sort=True).agg(eq=("eq", "sum"), has_eq=("has_eq", "any"), has_dir=("has_dir", "any")).reset_index()
+
+    self.edge_owner = pairs["o"].to_numpy(dtype=np.int64)
+    self.edge_owned = pairs["d"].to_numpy(dtype=np.int64)
+    self.edge_pct = pairs["eq"].to_numpy(dtype=np.float64)
+    self.edge_mask = (pairs["has_eq"].to_numpy() * EQUITY | pairs["has_dir"].to_numpy() * DIRECTORSHIP).astype(np.uint8)
+    self.pair_index = dict(zip(zip(self.edge_owner.tolist(), self.edge_owned.tolist()), range(len(pairs))))
+
+    # Edges are already sorted by owner; a permutation gives the by-owned order
+    self.in_order, self.in_offsets = _csr(self.edge_owned, n)
+
+    # Equity rows, in file order within each owner (or owned entity), duplicates kept
+    row_owner = rels["o"].to_numpy(dtype=np.int64)[is_equity]
+    row_owned = rels["d"].to_numpy(dtype=np.int64)[is_equity]
+    row_pct = rels["eq"].to_numpy(dtype=np.float64)[is_equity]
+    eq_out, eq_out_offsets = _csr(row_owner, n)
+    self.equity_out = AdjacencyView(self, eq_out_offsets, row_owned[eq_out], row_pct[eq_out])
+    eq_in, eq_in_offsets = _csr(row_owned, n)
+    self.equity_in = AdjacencyView(self, eq_in_offsets, row_owner[eq_in], row_pct[eq_in])
+    directorship = (self.edge_mask & DIRECTORSHIP) > 0
+    dir_in = self.in_order[directorship[self.in_order]]
+    _, dir_in_offsets = _csr(self.edge_owned[dir_in], n)
+    self.directorship_in = AdjacencyView(self, dir_in_offsets, self.edge_owner[dir_in], self.edge_pct[dir_in])
+
+  def record(self, entity_id: str):
+    i = self.index.get(entity_id)
+    return None if i is None else self.records[i]
+
+  def name(self, entity_id: str) -> str:
+    i = self.index.get(entity_id)
+    return entity_id if i is None else self.records[i].name
+
+  def in_edges(self, entity_id: str):
+    """(owner EntityID, equity pct, type mask) for every edge into entity_id"""
+    i = self.index.get(entity_id)
+    if i is None:
+      return []
+    edges = self.in_order[self.in_offsets[i]:self.in_offsets[i + 1]]
+    return [(self.ids[o], p, m) for o, p, m in zip(self.edge_owner[edges].tolist(), self.edge_pct[edges].tolist(), self.edge_mask[edges].tolist())]
+
+  def edge_mask_of(self, owner_id: str, owned_id: str) -> int:
+    e = self.pair_index.get((self.index.get(owner_id), self.index.get(owned_id)))
+    return 0 if e is None else int(self.edge_mask[e])
+
+  def status(self, owner_id: str, owned_id: str):
+    """Relationship status of (owner, owned) in get_relationship_status terms"""
+    return STATUS_BY_MASK.get(self.edge_mask_of(owner_id, owned_id))
+
+  def edges(self):
+    """Every (owner, owned, equity pct or None, type mask), grouped by owner"""
+    ids = self.ids
+    for o, d, p, m in zip(self.edge_owner.tolist(), self.edge_owned.tolist(), self.edge_pct.tolist(), self.edge_mask.tolist()):
+      yield ids[o], ids[d], (p if m & EQUITY else None), m
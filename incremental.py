@@ -0,0 +1,171 @@
+import pandas as pd
+from collections import defaultdict
+from ubo_engine import build_reverse_adj, stakes_in_target, ownership_records
+from instrumentation import instrument, count
+
+# Delta updates of every entity's stake in one target after a single equity edit.
+#
+# On an acyclic structure, changing the stake of A in B by dp changes each owner X's
+# stake in the target by up(X -> A) * dp * down(B -> target): every affected path
+# goes through the edited edge exactly once. Only the owners upstream of A are
+# touched. Anything that makes the structure circular falls back to a full pass.
+#
+# Every edit names the graph version it was made to (before) and the one it leads
+# to (after). A delta is only applied if the state is for the before version;
+# otherwise some edit went by unseen and the next read recomputes from scratch.
+
+class IncrementalOwnership:
+  """Per-entity stakes in one target, kept current across relationship edits"""
+
+  def __init__(self):
+    self.target = None
+    self.version = None
+    self.values = {}
+    self.self_stake = 0.0
+    self.acyclic = False
+    self.fwd = defaultdict(dict)
+    self.rev = defaultdict(dict)
+    self.rows = defaultdict(int)
+    self.full_recomputes = 0
+    self.delta_updates = 0
+
+  @instrument("IncrementalOwnership.rebuild")
+  def rebuild(self, relationships: pd.DataFrame, target: str, version: str, store=None):
+    # Nothing is current until the pass below has finished
+    self.version = None
+    radj = store.equity_in if store is not None else build_reverse_adj(relationships, rel_type="Equity")
+    self.fwd = defaultdict(dict)
+    self.rev = defaultdict(dict)
+    self.rows = defaultdict(int)
+    for owned, owners in radj.items():
+      for owner, pct in owners:
+        self._link(owner, owned, pct)
+    self.values, self.self_stake = stakes_in_target(radj, target)
+    self.acyclic = self._is_acyclic()
+    self.target = target
+    self.version = version
+    self.full_recomputes += 1
+    count("full ownership recomputes")
+
+  def ultimate_ownership(self, entities: pd.DataFrame, relationships: pd.DataFrame, target: str, version: str, store=None):
+    """Same dict as propagate_ultimate_ownership, recomputed only when the deltas could not follow"""
+    if target != self.target or version != self.version:
+      self.rebuild(relationships, target, version, store=store)
+    return ownership_records(entities, self.values, self.self_stake, target)
+
+  def mark_current(self, before: str, after: str):
+    """The graph went from before to after without touching equity (names, layers, directorships)"""
+    self.version = after if self.version is not None and self.version == before else None
+
+  def invalidate(self):
+    """Deltas cannot follow this edit (e.g. a dated relationship); the next read recomputes"""
+    self.version = None
+
+  def add_edge(self, owner: str, owned: str, pct: float, before: str, after: str):
+    self._apply(owner, owned, float(pct), 1, before, after)
+
+  def remove_edge(self, owner: str, owned: str, pct: float, before: str, after: str):
+    self._apply(owner, owned, float(pct), -1, before, after)
+
+  def update_edge(self, old: tuple, new: tuple, before: str, after: str):
+    """old/new are (owner, owned, relationship type, pct, ...) of one relationship row"""
+    if old[2] == "Equity":
+      self._apply(old[0], old[1], float(old[3]), -1, before, before)
+    if new[2] == "Equity":
+      self._apply(new[0], new[1], float(new[3]), 1, before, before)
+    self.mark_current(before, after)
+
+  def _link(self, owner: str, owned: str, pct: float):
+    self.fwd[owner][owned] = self.fwd[owner].get(owned, 0.0) + pct
+    self.rev[owned][owner] = self.fwd[owner][owned]
+    self.rows[(owner, owned)] += 1
+
+  def _unlink(self, owner: str, owned: str, pct: float):
+    self.rows[(owner, owned)] -= 1
+    if self.rows[(owner, owned)] <= 0:
+      del self.rows[(owner, owned)]
+      self.fwd[owner].pop(owned, None)
+      self.rev[owned].pop(owner, None)
+    else:
+      self.fwd[owner][owned] -= pct
+      self.rev[owned][owner] = self.fwd[owner][owned]
+
+  def _apply(self, owner: str, owned: str, pct: float, sign: int, before: str, after: str):
+    if self.version is None or self.version != before:
+      # The state is not for the graph this edit was made to; the next read recomputes
+      self.version = None
+      return
+    if sign > 0:
+      self._link(owner, owned, pct)
+    else:
+      self._unlink(owner, owned, pct)
+    self.version = after
+
+    if not self.acyclic or (sign > 0 and self._reaches(owned, owner)):
+      # Cross-holdings need the component solve; the next read recomputes from scratch
+      self.version = None
+      return
+
+    dp = sign * pct
+    down = 1.0 if owned == self.target else self.values.get(owned, 0.0)
+    if down == 0.0 or dp == 0.0:
+      return
+    for node, up in self._upstream(owner).items():
+      value = self.values.get(node, 0.0) + up * dp * down
+      # Removing an owner's last route should leave exactly zero, not round-off
+      self.values[node] = value if abs(value) > 1e-12 else 0.0
+    self.delta_updates += 1
+    count("delta ownership updates")
+
+  def _reaches(self, start: str, goal: str) -> bool:
+    seen = {start}
+    frontier = [start]
+    while frontier:
+      node = frontier.pop()
+      if node == goal:
+        return True
+      for child in self.fwd.get(node, ()):
+        if child not in seen:
+          seen.add(child)
+          frontier.append(child)
+    return False
+
+  def _upstream(self, node: str):
+    """Stake of node itself (1.0) and of every ancestor in node, children before parents"""
+    ancestors = {node}
+    frontier = [node]
+    while frontier:
+      current = frontier.pop()
+      for parent in self.rev.get(current, ()):
+        if parent not in ancestors:
+          ancestors.add(parent)
+          frontier.append(parent)
+
+    pending = {n: sum(1 for c in self.fwd.get(n, ()) if c in ancestors) for n in ancestors}
+    up = {}
+    ready = [n for n, count in pending.items() if count == 0]
+    while ready:
+      current = ready.pop()
+      if current == node:
+        up[current] = 1.0
+      else:
+        up[current] = sum(pct * up[c] for c, pct in self.fwd[current].items() if c in ancestors)
+      for parent in self.rev.get(current, ()):
+        pending[parent] -= 1
+        if pending[parent] == 0:
+          ready.append(parent)
+    return up
+
+  def _is_acyclic(self) -> bool:
+    nodes = set(self.fwd) | set(self.rev)
+    indegree = {n: len(self.rev.get(n, ())) for n in nodes}
+    ready = [n for n, d in indegree.items() if d == 0]
+    seen = 0
+    while ready:
+      current = ready.pop()
+      seen += 1
+      for child in self.fwd.get(current, ()):
+        indegree[child] -= 1
+        if indegree[child] == 0:
+          ready.append(child)
+    return seen == len(nodes)
@@ -0,0 +1,184 @@
+import cProfile
+import io
+import marshal
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+# Per-run performance figures shared by the app and the headless code.
+#
+# Instrumented functions report into the RunMetrics that is active in the current
+# context (see start_run() and collect()). With none active every hook returns after
+# one context-variable lookup, so the engine can stay instrumented in batch runs.
+
+_current = ContextVar("ubo_run_metrics", default=None)
+
+# tracemalloc is process-wide, while profiled reruns of different sessions overlap.
+# Each profile holds a reference; tracing stops when the last one is released, and
+# only if it was started here rather than by whoever ran the process.
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+_tracing_owned = False
+
+def _acquire_tracing():
+  global _tracing_users, _tracing_owned
+  with _tracing_lock:
+    if _tracing_users == 0:
+      _tracing_owned = not tracemalloc.is_tracing()
+      if _tracing_owned:
+        tracemalloc.start()
+    _tracing_users += 1
+
+def _release_tracing() -> int:
+  """Drop one reference; returns how many other profiles were tracing as well"""
+  global _tracing_users
+  with _tracing_lock:
+    _tracing_users -= 1
+    if _tracing_users == 0 and _tracing_owned:
+      tracemalloc.stop()
+    return _tracing_users
+
+class RunMetrics:
+  """Wall time per step, counters, maxima and DataFrame sizes for one run"""
+
+  def __init__(self, label: str = ""):
+    self.label = label
+    self.started = time.perf_counter()
+    self.elapsed = None
+    self.timings = {}  # name -> [calls, seconds], inclusive of nested steps
+    self.counters = {}
+    self.maxima = {}
+    self.frames = {}  # name -> (rows, columns, bytes)
+    self.profiler = None
+    self.profile_stats = None
+    self.profile_text = None
+    self.memory_text = None
+
+  @property
+  def finished(self) -> bool:
+    return self.elapsed is not None
+
+  def add_time(self, name: str, seconds: float):
+    entry = self.timings.setdefault(name, [0, 0.0])
+    entry[0] += 1
+    entry[1] += seconds
+
+  def count(self, name: str, n: int = 1):
+    self.counters[name] = self.counters.get(name, 0) + n
+
+  def record_max(self, name: str, value):
+    if name not in self.maxima or value > self.maxima[name]:
+      self.maxima[name] = value
+
+  def record_frame(self, name: str, df):
+    # Shallow memory_usage: deep=True would walk every string in object columns
+    self.frames[name] = (len(df), len(df.columns), int(df.memory_usage(index=True, deep=False).sum()))
+
+  def start_profile(self):
+    self.profiler = cProfile.Profile()
+    _acquire_tracing()
+    self.profiler.enable()
+
+  def stop_profile(self, top: int = 40):
+    """Attach the profile (as text and .prof bytes) and the top allocation sites; no-op if not profiling"""
+    if self.profiler is None:
+      return
+    profiler, self.profiler = self.profiler, None
+    profiler.disable()
+    snapshot = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    others = _release_tracing()
+    profiler.create_stats()
+    # Same format as Profile.dump_stats, so snakeviz / pstats can open the download
+    self.profile_stats = marshal.dumps(profiler.stats)
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(top)
+    self.profile_text = out.getvalue()
+    lines = [f"Peak traced memory: {peak / 1024:.1f} KiB", f"Top {top} allocation sites:"]
+    if others:
+      lines.insert(1, f"({others} other profiled run{'s' if others != 1 else ''} in this process; their allocations are included)")
+    lines += [str(stat) for stat in snapshot.statistics("lineno")[:top]]
+    self.memory_text = "\n".join(lines)
+
+  def finish(self):
+    if self.elapsed is None:
+      self.elapsed = time.perf_counter() - self.started
+    return self
+
+  def to_dict(self) -> dict:
+    return {
+      "label": self.label,
+      "elapsed_s": self.elapsed if self.finished else time.perf_counter() - self.started,
+      "timings": {name: {"calls": calls, "seconds": seconds} for name, (calls, seconds) in self.timings.items()},
+      "counters": dict(self.counters),
+      "maxima": dict(self.maxima),
+      "frames": {name: {"rows": r, "columns": c, "bytes": b} for name, (r, c, b) in self.frames.items()},
+    }
+
+def current():
+  return _current.get()
+
+def start_run(label: str = "") -> RunMetrics:
+  """Make a fresh RunMetrics current for the rest of this context (one Streamlit rerun)"""
+  metrics = RunMetrics(label)
+  _current.set(metrics)
+  return metrics
+
+@contextmanager
+def collect(label: str = ""):
+  """Record everything the block does into a new RunMetrics"""
+  metrics = RunMetrics(label)
+  token = _current.set(metrics)
+  try:
+    yield metrics
+  finally:
+    metrics.finish()
+    _current.reset(token)
+
+@contextmanager
+def timed(name: str):
+  metrics = _current.get()
+  if metrics is None:
+    yield
+    return
+  t0 = time.perf_counter()
+  try:
+    yield
+  finally:
+    metrics.add_time(name, time.perf_counter() - t0)
+
+def instrument(name: str = None):
+  """Decorator: add the call's wall time to the current run under name (default: function name)"""
+  def decorate(fn):
+    label = name or fn.__name__
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+      metrics = _current.get()
+      if metrics is None:
+        return fn(*args, **kwargs)
+      t0 = time.perf_counter()
+      try:
+        return fn(*args, **kwargs)
+      finally:
+        metrics.add_time(label, time.perf_counter() - t0)
+    return wrapper
+  return decorate
+
+def count(name: str, n: int = 1):
+  metrics = _current.get()
+  if metrics is not None:
+    metrics.count(name, n)
+
+def record_max(name: str, value):
+  metrics = _current.get()
+  if metrics is not None:
+    metrics.record_max(name, value)
+
+def record_frame(name: str, df):
+  metrics = _current.get()
+  if metrics is not None and df is not None:
+    metrics.record_frame(name, df)
@@ -0,0 +1,267 @@
+from collections import defaultdict
+from datetime import date
+import numpy as np
+import pandas as pd
+from incremental import IncrementalOwnership
+from ubo_engine import propagate_control, meets_threshold
+from instrumentation import instrument, count
+
+# Relationships with effective dates, and ownership as it stood on a given day.
+#
+# A relationship holds from ValidFrom up to, but not including, ValidTo; either
+# may be blank for "always" / "still in force". Dates become day numbers and the
+# intervals go into a centred interval tree, so the rows in force on a day are
+# found in O(log n + rows) rather than by scanning the whole history. The
+# distinct start and end days cut time into epochs with identical edge sets;
+# results are cached per epoch, and stepping from one epoch to the next only
+# applies the rows that start or end on the day in between.
+
+VALIDITY_COLUMNS = ["ValidFrom", "ValidTo"]
+OPEN_START = np.iinfo(np.int64).min
+OPEN_END = np.iinfo(np.int64).max
+CHANGE_COLUMNS = ["Date", "OwnerID", "OwnerName", "PctBefore", "PctAfter", "ControlBefore", "ControlAfter", "Event"]
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+def day_number(value) -> int:
+  """Days since 1970-01-01 of a date, datetime or ISO date string"""
+  return pd.Timestamp(value).toordinal() - _EPOCH_ORDINAL
+
+def day_text(day: int) -> str:
+  return date.fromordinal(int(day) + _EPOCH_ORDINAL).isoformat()
+
+def date_text(value):
+  """ISO date string of a stored ValidFrom / ValidTo, or None if blank"""
+  if value is None or (not isinstance(value, str) and pd.isna(value)) or value == "":
+    return None
+  return pd.Timestamp(value).date().isoformat()
+
+def to_days(values, missing: int) -> np.ndarray:
+  """Day numbers of a column of dates; blanks (and anything unreadable) become missing"""
+  parsed = pd.to_datetime(pd.Series(values, dtype=object), errors="coerce")
+  # Straight to whole days: far-off "open" dates such as 9999-12-31 do not fit in nanoseconds
+  days = parsed.to_numpy().astype("datetime64[D]").astype(np.int64)
+  return np.where(parsed.isna().to_numpy(), missing, days)
+
+def in_force(relationships: pd.DataFrame, day: int) -> np.ndarray:
+  """Boolean mask of the rows in force on day (rows without dates always are)"""
+  n = len(relationships)
+  starts = to_days(relationships["ValidFrom"], OPEN_START) if "ValidFrom" in relationships else np.full(n, OPEN_START)
+  ends = to_days(relationships["ValidTo"], OPEN_END) if "ValidTo" in relationships else np.full(n, OPEN_END)
+  return (starts <= day) & (day < ends)
+
+class ValidityIndex:
+  """Centred interval tree over half-open [start, end) intervals, answering "which rows hold on day d"."""
+
+  def __init__(self, starts: np.ndarray, ends: np.ndarray, rows: np.ndarray):
+    # Per node: its centre, children, and the intervals spanning the centre sorted
+    # both by start and by end, each as (sorted days, row numbers)
+    self.center = []
+    self.left = []
+    self.right = []
+    self.by_start = []
+    self.by_end = []
+    self.root = self._build(starts, ends, rows)
+
+  def _build(self, starts, ends, rows) -> int:
+    if len(rows) == 0:
+      return -1
+    # The median start is inside its own interval, so every node keeps at least
+    # one interval and neither side gets more than half
+    center = np.partition(starts, len(starts) // 2)[len(starts) // 2]
+    here = (starts <= center) & (center < ends)
+    node = len(self.center)
+    self.center.append(center)
+    self.left.append(-1)
+    self.right.append(-1)
+    order = np.argsort(starts[here], kind="stable")
+    self.by_start.append((starts[here][order], rows[here][order]))
+    order = np.argsort(ends[here], kind="stable")
+    self.by_end.append((ends[here][order], rows[here][order]))
+    below = ends <= center
+    above = starts > center
+    self.left[node] = self._build(starts[below], ends[below], rows[below])
+    self.right[node] = self._build(starts[above], ends[above], rows[above])
+    return node
+
+  def stab(self, day: int) -> np.ndarray:
+    """Rows whose interval contains day, in row order"""
+    hits = []
+    node = self.root
+    while node != -1:
+      if day < self.center[node]:
+        # Every interval here ends after the centre, so those started by day hold
+        days, rows = self.by_start[node]
+        hits.append(rows[:np.searchsorted(days, day, side="right")])
+        node = self.left[node]
+      else:
+        # Every interval here started by the centre, so those not yet ended hold
+        days, rows = self.by_end[node]
+        hits.append(rows[np.searchsorted(days, day, side="right"):])
+        node = self.right[node]
+    return np.sort(np.concatenate(hits)) if hits else np.zeros(0, dtype=np.int64)
+
+class OwnershipHistory:
+  """Dated relationship rows: the edge set in force on any day, and what changed between two days"""
+
+  def __init__(self, relationships: pd.DataFrame):
+    self.relationships = relationships
+    n = len(relationships)
+    starts = to_days(relationships["ValidFrom"], OPEN_START) if "ValidFrom" in relationships else np.full(n, OPEN_START)
+    ends = to_days(relationships["ValidTo"], OPEN_END) if "ValidTo" in relationships else np.full(n, OPEN_END)
+    # Without any dates every day has the same edge set: the frame itself
+    self.dated = bool(((starts != OPEN_START) | (ends != OPEN_END)).any())
+    rows = np.flatnonzero(starts < ends)
+    self.index = ValidityIndex(starts[rows], ends[rows], rows)
+    order = rows[np.argsort(starts[rows], kind="stable")]
+    self.by_start = (starts[order], order)
+    order = rows[np.argsort(ends[rows], kind="stable")]
+    self.by_end = (ends[order], order)
+    days = np.concatenate([starts[rows], ends[rows]])
+    self.change_days = np.unique(days[(days != OPEN_START) & (days != OPEN_END)])
+    self.rows_into = None
+    self.last = (None, None)
+    count("relationship intervals indexed", len(rows))
+
+  def __len__(self) -> int:
+    return len(self.relationships)
+
+  def epoch(self, day: int) -> int:
+    """Number of change days up to and including day; days with the same epoch see the same edges"""
+    return int(np.searchsorted(self.change_days, day, side="right"))
+
+  def rows_in_force(self, day: int) -> np.ndarray:
+    return self.index.stab(day)
+
+  def as_of(self, day: int) -> pd.DataFrame:
+    """The relationship rows in force on day"""
+    if not self.dated:
+      return self.relationships
+    epoch = self.epoch(day)
+    if self.last[0] != epoch:
+      rows = self.rows_in_force(day)
+      count("relationships in force", len(rows))
+      self.last = (epoch, self.relationships.iloc[rows])
+    return self.last[1]
+
+  def _on(self, sorted_rows: tuple, day: int) -> np.ndarray:
+    days, rows = sorted_rows
+    return rows[np.searchsorted(days, day, side="left"):np.searchsorted(days, day, side="right")]
+
+  def events(self, start: int, end: int):
+    """(day, rows starting, rows ending) for each change day after start, up to and including end"""
+    lo = np.searchsorted(self.change_days, start, side="right")
+    hi = np.searchsorted(self.change_days, end, side="right")
+    for day in self.change_days[lo:hi].tolist():
+      yield day, self._on(self.by_start, day), self._on(self.by_end, day)
+
+  def for_target(self, target: str) -> "OwnershipHistory":
+    """History of just the rows into anything that has a route to target on some day"""
+    rels = self.relationships
+    if self.rows_into is None:
+      self.rows_into = defaultdict(list)
+      for i, owned in enumerate(rels["OwnedID"].tolist()):
+        self.rows_into[owned].append(i)
+    owners = rels["OwnerID"].tolist()
+    seen = {target}
+    frontier = [target]
+    rows = []
+    while frontier:
+      for i in self.rows_into.get(frontier.pop(), ()):
+        rows.append(i)
+        if owners[i] not in seen:
+          seen.add(owners[i])
+          frontier.append(owners[i])
+    return OwnershipHistory(rels.iloc[sorted(rows)])
+
+class InForceEdges:
+  """Equity and board edges in force, in GraphStore's equity_in / directorship_in shape, moved day by day"""
+
+  def __init__(self):
+    self.equity_in = defaultdict(list)
+    self.directorship_in = defaultdict(list)
+
+  def apply(self, owner: str, owned: str, rel_type: str, pct: float, sign: int):
+    edges = self.equity_in if rel_type == "Equity" else self.directorship_in
+    if sign > 0:
+      edges[owned].append((owner, pct))
+    else:
+      edges[owned].remove((owner, pct))
+
+  def upstream(self, target: str) -> set:
+    """target and everything with a route of shares or seats into it"""
+    seen = {target}
+    frontier = [target]
+    while frontier:
+      node = frontier.pop()
+      for owner, _ in self.equity_in.get(node, []) + self.directorship_in.get(node, []):
+        if owner not in seen:
+          seen.add(owner)
+          frontier.append(owner)
+    return seen
+
+def _ubo_flags(values: dict, control: dict, threshold: float, target: str) -> dict:
+  flags = {owner: meets_threshold(pct, threshold) for owner, pct in values.items() if owner != target}
+  flags.update((owner, True) for owner in control)
+  return flags
+
+@instrument()
+def ubo_changes(entities: pd.DataFrame, history: OwnershipHistory, target: str, threshold: float, start: int, end: int, majority: float = 0.5) -> pd.DataFrame:
+  """Every owner whose UBO flag for target changed on a day after start up to end, with stake and control either side"""
+  history = history.for_target(target)
+  rels = history.relationships
+  owner_ids = rels["OwnerID"].tolist()
+  owned_ids = rels["OwnedID"].tolist()
+  rel_types = rels["RelationshipType"].tolist()
+  pcts = pd.to_numeric(rels["OwnershipPct"], errors="coerce").fillna(0.0).tolist()
+  entity_names = entities.set_index("EntityID")["Name"].to_dict()
+
+  edges = InForceEdges()
+  for i in history.rows_in_force(start).tolist():
+    edges.apply(owner_ids[i], owned_ids[i], rel_types[i], pcts[i], 1)
+  state = IncrementalOwnership()
+  state.rebuild(None, target, start, store=edges)
+  control = propagate_control(None, target, store=edges, majority=majority)
+  values = dict(state.values)
+  flags = _ubo_flags(values, control, threshold, target)
+  reach = edges.upstream(target)
+
+  rows = []
+  for day, started, ended in history.events(start, end):
+    count("history change days")
+    # Ends first, so a stake replaced on the same day is never counted twice
+    touched = False
+    for i, sign in [(i, -1) for i in ended.tolist()] + [(i, 1) for i in started.tolist()]:
+      owner, owned = owner_ids[i], owned_ids[i]
+      touched = touched or owned in reach
+      edges.apply(owner, owned, rel_types[i], pcts[i], sign)
+      if rel_types[i] == "Equity":
+        (state.add_edge if sign > 0 else state.remove_edge)(owner, owned, pcts[i], state.version, day)
+    # A row into something with no route to the target changes nothing about it, nor the route set
+    if not touched:
+      continue
+    count("history snapshots recomputed")
+    if state.version is None:
+      # The change made or broke a cross-holding: deltas cannot follow it
+      state.rebuild(None, target, day, store=edges)
+    new_control = propagate_control(None, target, store=edges, majority=majority)
+    new_values = dict(state.values)
+    new_flags = _ubo_flags(new_values, new_control, threshold, target)
+    reach = edges.upstream(target)
+    for owner in sorted(set(flags) | set(new_flags), key=lambda o: (str(entity_names.get(o, o)), o)):
+      before, after = flags.get(owner, False), new_flags.get(owner, False)
+      if before == after:
+        continue
+      rows.append({
+        "Date": day_text(day),
+        "OwnerID": owner,
+        "OwnerName": entity_names.get(owner, owner),
+        "PctBefore": values.get(owner, 0.0),
+        "PctAfter": new_values.get(owner, 0.0),
+        "ControlBefore": control.get(owner, ""),
+        "ControlAfter": new_control.get(owner, ""),
+        "Event": "became UBO" if after else "ceased to be UBO",
+      })
+    values, control, flags = new_values, new_control, new_flags
+  count("UBO changes found", len(rows))
+  return pd.DataFrame(rows, columns=CHANGE_COLUMNS)
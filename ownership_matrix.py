@@ -0,0 +1,122 @@
+import pandas as pd
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+from ubo_engine import meets_threshold
+
+# Ultimate ownership for every (owner, target) pair from the sparse equity matrix.
+#
+# A[i, j] is the direct stake of i in j. N = (I - A)^-1 counts every ownership walk,
+# including walks that pass through j and come back round a cross-holding. The
+# stake of i in j is the first-passage share F[i, j] = N[i, j] / N[j, j], which
+# matches find_paths on acyclic structures (paths stop at the target) and the
+# propagation engine on circular ones. With S = N - I this is F = S * diag(1 / (1 + diag(S))).
+# ubo_batch.py --matrix uses it to work out every target's owners in one solve.
+
+def equity_matrix(entities: pd.DataFrame, relationships: pd.DataFrame):
+  """Sparse direct-equity matrix and the EntityID order of its rows/columns"""
+  eq = relationships[relationships["RelationshipType"] == "Equity"]
+  ids = list(dict.fromkeys(list(entities["EntityID"]) + list(eq["OwnerID"]) + list(eq["OwnedID"])))
+  index = {eid: i for i, eid in enumerate(ids)}
+  rows = eq["OwnerID"].map(index).to_numpy(dtype=np.int64)
+  cols = eq["OwnedID"].map(index).to_numpy(dtype=np.int64)
+  vals = eq["OwnershipPct"].astype(float).to_numpy()
+  # Duplicate rows for the same pair are summed, as find_paths counts each as a path
+  a = sp.coo_matrix((vals, (rows, cols)), shape=(len(ids), len(ids))).tocsr()
+  a.sum_duplicates()
+  return a, ids
+
+def neumann_walks(a: sp.csr_matrix, tol: float = 1e-10, max_iter: int = 200):
+  """Truncated A + A^2 + ... until the largest new term drops below tol"""
+  total = a.copy()
+  term = a.copy()
+  for iteration in range(1, max_iter + 1):
+    if term.nnz == 0 or np.abs(term.data).max() < tol:
+      return total, iteration, True
+    term = term @ a
+    # Prune negligible contributions so fill-in stays bounded on dense structures
+    term.data[np.abs(term.data) < tol * 1e-3] = 0.0
+    term.eliminate_zeros()
+    total = total + term
+  return total, max_iter, False
+
+def exact_walks(a: sp.csr_matrix, block: int = 256):
+  """(I - A)^-1 - I = (I - A)^-1 A through one sparse LU factorisation, a block of columns at a time"""
+  n = a.shape[0]
+  lu = spla.splu((sp.identity(n, format="csc") - a).tocsc())
+  a = a.tocsc()
+  blocks = []
+  for start in range(0, n, block):
+    # Only n x block is ever dense, never n x n
+    cols = lu.solve(a[:, start:start + block].toarray())
+    # Round-off from the factorisation is not a stake
+    cols[np.abs(cols) < 1e-12] = 0.0
+    blocks.append(sp.csc_matrix(cols))
+  return sp.hstack(blocks, format="csc") if blocks else sp.csc_matrix((n, n))
+
+class OwnershipMatrix:
+  """Indirect ownership for all targets at once; each target's column is read without recomputation"""
+
+  def __init__(self, entities: pd.DataFrame, relationships: pd.DataFrame, method: str = "neumann", tol: float = 1e-10, max_iter: int = 200):
+    self.direct, self.ids = equity_matrix(entities, relationships)
+    self.index = {eid: i for i, eid in enumerate(self.ids)}
+    self.names = entities.set_index("EntityID")["Name"].to_dict()
+    self.method = method
+    self.iterations = 0
+    self.converged = True
+
+    walks = None
+    if method == "exact":
+      try:
+        walks = exact_walks(self.direct)
+      except RuntimeError:
+        # (I - A) is singular, e.g. companies owning 100% of each other; report via the series
+        walks = None
+      # With A >= 0 every walk count is >= 0 exactly when the series converges; a loop
+      # passing on 100% or more gives negative or unbounded "stakes" instead
+      if walks is not None and walks.nnz and not (np.isfinite(walks.data).all() and walks.data.min() > -1e-9):
+        walks = None
+      if walks is None:
+        self.method = "neumann"
+    elif method != "neumann":
+      raise ValueError(f"Unknown method: {method}")
+    if walks is None:
+      walks, self.iterations, self.converged = neumann_walks(self.direct, tol=tol, max_iter=max_iter)
+
+    returns = walks.diagonal()
+    with np.errstate(divide="ignore"):
+      scale = np.where(1.0 + returns > 0, 1.0 / (1.0 + returns), 0.0)
+    self.ultimate = (walks @ sp.diags(scale)).tocsc()
+    self.ultimate.eliminate_zeros()
+
+  def stake(self, owner: str, target: str) -> float:
+    i, j = self.index.get(owner), self.index.get(target)
+    if i is None or j is None:
+      return 0.0
+    return float(self.ultimate[i, j])
+
+  def stakes_in(self, target: str) -> dict:
+    """{EntityID: stake} of everything with a stake in target, the target's own stake in itself included"""
+    j = self.index.get(target)
+    if j is None:
+      return {}
+    col = self.ultimate.getcol(j).tocoo()
+    return {self.ids[i]: float(value) for i, value in zip(col.row, col.data) if value > 0}
+
+  def ubo_flags(self, threshold: float, targets: list = None) -> pd.DataFrame:
+    """Long table of every owner with a stake in each target, flagged against the threshold"""
+    coo = self.ultimate.tocoo()
+    df = pd.DataFrame({
+      "OwnerID": np.asarray(self.ids, dtype=object)[coo.row],
+      "TargetID": np.asarray(self.ids, dtype=object)[coo.col],
+      "UltimateOwnership": coo.data,
+    })
+    # Cross-holdings give each company a stake in itself; that is not an owner
+    keep = (df["OwnerID"] != df["TargetID"]) & (df["UltimateOwnership"] > 0)
+    if targets is not None:
+      keep &= df["TargetID"].isin(targets)
+    df = df[keep].assign(
+      OwnerName=lambda d: d["OwnerID"].map(lambda x: self.names.get(x, x)),
+      UBO_Flag=lambda d: meets_threshold(d["UltimateOwnership"], threshold),
+    )
+    return df.sort_values(["TargetID", "UltimateOwnership"], ascending=[True, False]).reset_index(drop=True)
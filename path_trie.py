@@ -0,0 +1,177 @@
+import csv
+import heapq
+import io
+from array import array
+from operator import itemgetter
+import pandas as pd
+from instrumentation import instrument, timed, count
+from ubo_engine import PATH_COLUMNS, build_adj, iter_paths
+
+# Ownership paths to one target, stored as a parent-pointer trie.
+#
+# Each trie node is an (entity number, parent node) pair held in flat integer
+# arrays, and a path is just the node where it ends plus its product. Paths found
+# one after another by the depth-first search share everything up to where they
+# part, so a long common chain is stored once rather than once per path. The
+# "A -> B -> C" strings are only built for the rows a caller asks for.
+
+class ChunkStream(io.RawIOBase):
+  """Read-only binary file over a generator of text chunks, encoded as they are read"""
+
+  def __init__(self, chunks):
+    self.chunks = chunks
+    self.pending = b""
+    self.position = 0
+
+  def readable(self) -> bool:
+    return True
+
+  def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+    # Readers rewind before reading; anything else would mean starting the chunks over
+    if whence != io.SEEK_SET or offset != self.position:
+      raise io.UnsupportedOperation("ChunkStream can only be read straight through")
+    return self.position
+
+  def readinto(self, b) -> int:
+    while not self.pending:
+      chunk = next(self.chunks, None)
+      if chunk is None:
+        return 0
+      self.pending = chunk.encode()
+    n = min(len(b), len(self.pending))
+    b[:n] = self.pending[:n]
+    self.pending = self.pending[n:]
+    self.position += n
+    return n
+
+class PathTrie:
+  """Paths in compute_ubo order (owner name, then largest path) with shared prefixes"""
+
+  def __init__(self, names: dict, target: str):
+    self.names = names
+    self.target = target
+    self.ids = []
+    self.index = {}
+    self.parent = array("i")
+    self.label = array("i")
+    self.leaf = array("i")
+    self.product = array("d")
+    self.order = array("i")  # display position -> path number
+    self.last_labels = []
+    self.last_nodes = []
+
+  def __len__(self) -> int:
+    return len(self.order)
+
+  def _number(self, entity_id) -> int:
+    n = self.index.get(entity_id)
+    if n is None:
+      n = self.index[entity_id] = len(self.ids)
+      self.ids.append(entity_id)
+    return n
+
+  def _insert(self, path: list, product: float) -> int:
+    # Share the prefix with the previous path; only the nodes after it are new
+    labels = [self._number(e) for e in path]
+    prev = self.last_labels
+    k = 0
+    while k < len(labels) and k < len(prev) and labels[k] == prev[k]:
+      k += 1
+    nodes = self.last_nodes[:k]
+    node = nodes[-1] if nodes else -1
+    for lab in labels[k:]:
+      self.parent.append(node)
+      self.label.append(lab)
+      node = len(self.label) - 1
+      nodes.append(node)
+    self.last_labels, self.last_nodes = labels, nodes
+    self.leaf.append(node)
+    self.product.append(product)
+    return len(self.leaf) - 1
+
+  def add_owner(self, paths):
+    """Add one owner's (path, product) pairs, best kept in search order for sharing"""
+    first = len(self.leaf)
+    for path, product in paths:
+      self._insert(path, product)
+    # sorted() is stable, so equal products keep search order
+    self.order.extend(sorted(range(first, len(self.leaf)), key=lambda i: -self.product[i]))
+
+  def path_ids(self, pos: int) -> list:
+    """Entity IDs along the path at display position pos, owner first"""
+    node = self.leaf[self.order[pos]]
+    out = []
+    while node != -1:
+      out.append(self.ids[self.label[node]])
+      node = self.parent[node]
+    out.reverse()
+    return out
+
+  def records(self, start: int = 0, stop: int = None):
+    """Path records (PATH_COLUMNS dicts) for display positions start..stop"""
+    names = self.names
+    target_name = names.get(self.target, self.target)
+    stop = len(self) if stop is None else min(stop, len(self))
+    for pos in range(start, stop):
+      pth = self.path_ids(pos)
+      yield {
+        "OwnerID": pth[0],
+        "OwnerName": names.get(pth[0], pth[0]),
+        "PathIDs": " -> ".join(pth),
+        "PathNames": " -> ".join(names.get(i, i) for i in pth),
+        "PathOwnershipPct": self.product[self.order[pos]],
+        "FinalTarget": target_name,
+      }
+
+  def page(self, start: int, stop: int) -> pd.DataFrame:
+    """The rows shown on one page of the paths table"""
+    with timed("PathTrie.page"):
+      rows = list(self.records(start, stop))
+    count("path rows materialised", len(rows))
+    return pd.DataFrame(rows, columns=PATH_COLUMNS)
+
+  def iter_csv(self, chunk_rows: int = 10000):
+    """CSV text of every path, the header first and then chunk_rows rows at a time"""
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=PATH_COLUMNS)
+    writer.writeheader()
+    yield buf.getvalue()
+    for start in range(0, len(self), chunk_rows):
+      buf.seek(0)
+      buf.truncate()
+      writer.writerows(self.records(start, start + chunk_rows))
+      yield buf.getvalue()
+
+  def write_csv(self, out, chunk_rows: int = 10000):
+    """Stream every path to a text file object"""
+    for chunk in self.iter_csv(chunk_rows):
+      out.write(chunk)
+
+  def csv_file(self, chunk_rows: int = 10000) -> ChunkStream:
+    """Every path as a binary CSV file object, written out only as it is read"""
+    return ChunkStream(self.iter_csv(chunk_rows))
+
+  def finish(self):
+    # The last path is only needed while paths are being added
+    self.last_labels = []
+    self.last_nodes = []
+    return self
+
+@instrument()
+def ubo_path_trie(entities: pd.DataFrame, relationships: pd.DataFrame, target: str, min_product: float = 0.0, max_depth: int = None, top_k: int = None, adj: dict = None) -> PathTrie:
+  """Every path from an equity owner to target within the limits, by owner name then largest path, held in a PathTrie"""
+  if adj is None:
+    adj = build_adj(relationships, rel_type="Equity")
+  entity_names = entities.set_index("EntityID")["Name"].to_dict()
+  sources = set(relationships[relationships["RelationshipType"]=="Equity"]["OwnerID"])
+  trie = PathTrie(entity_names, target)
+  for src in sorted(sources, key=lambda x: (str(entity_names.get(x, x)), x)):
+    paths = iter_paths(src, target, adj, min_product=min_product, max_depth=max_depth)
+    if top_k:
+      # Keep the best top_k, then put them back in search order so prefixes are shared
+      kept = heapq.nlargest(top_k, enumerate(paths), key=lambda p: p[1][1])
+      paths = map(itemgetter(1), sorted(kept, key=itemgetter(0)))
+    trie.add_owner(paths)
+  count("paths stored", len(trie))
+  count("path trie nodes", len(trie.label))
+  return trie.finish()
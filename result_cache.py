@@ -0,0 +1,90 @@
+import hashlib
+import sys
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from instrumentation import count
+
+# Results are keyed by a content hash of the graph, so any rerun that leaves the
+# entities and relationships unchanged reuses what was computed before
+
+def frame_fingerprint(df: pd.DataFrame) -> str:
+  """Content hash of a frame (columns and values, not the index)"""
+  h = hashlib.blake2b(digest_size=16)
+  h.update("|".join(map(str, df.columns)).encode())
+  if not df.empty:
+    h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+  return h.hexdigest()
+
+def graph_version(entities: pd.DataFrame, relationships: pd.DataFrame) -> str:
+  return frame_fingerprint(entities) + frame_fingerprint(relationships)
+
+def estimate_size(obj) -> int:
+  """Rough byte size of a cached result, used for the memory bound"""
+  if isinstance(obj, pd.DataFrame):
+    return int(obj.memory_usage(deep=True).sum())
+  if isinstance(obj, np.ndarray):
+    return int(obj.nbytes)
+  if isinstance(obj, dict):
+    return sys.getsizeof(obj) + sum(estimate_size(k) + estimate_size(v) for k, v in obj.items())
+  if isinstance(obj, (list, tuple, set)):
+    return sys.getsizeof(obj) + sum(estimate_size(v) for v in obj)
+  if hasattr(obj, "__dict__"):
+    return sys.getsizeof(obj) + estimate_size(vars(obj))
+  return sys.getsizeof(obj)
+
+class LRUResultCache:
+  """Least-recently-used cache bounded by entry count and estimated bytes.
+
+  A result's size is estimated once, when it is stored; anything it caches lazily
+  afterwards is not counted. A result larger than max_bytes is not stored at all.
+  Pinned results (the graph structures every other result is computed from) are
+  kept outside both bounds, the latest one per key[0], whatever their size.
+  """
+
+  def __init__(self, max_entries: int = 32, max_bytes: int = 64 * 1024 * 1024):
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self.entries = OrderedDict()
+    self.pinned = {}
+    self.total_bytes = 0
+    self.hits = 0
+    self.misses = 0
+
+  def get_or_compute(self, key, compute, pin: bool = False):
+    if pin:
+      held = self.pinned.get(key[0])
+      if held is not None and held[0] == key:
+        self.hits += 1
+        count("cache hits")
+        return held[1]
+      self.misses += 1
+      count("cache misses")
+      # Drop the old one first so the two are never held at once
+      self.pinned.pop(key[0], None)
+      value = compute()
+      self.pinned[key[0]] = (key, value)
+      return value
+    if key in self.entries:
+      self.entries.move_to_end(key)
+      self.hits += 1
+      count("cache hits")
+      return self.entries[key][0]
+    self.misses += 1
+    count("cache misses")
+    value = compute()
+    size = estimate_size(value)
+    # Too big to keep: hand it back without evicting everything else
+    if size > self.max_bytes:
+      return value
+    self.entries[key] = (value, size)
+    self.total_bytes += size
+    while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+      _, (_, evicted) = self.entries.popitem(last=False)
+      self.total_bytes -= evicted
+    return value
+
+  def clear(self):
+    self.entries.clear()
+    self.pinned.clear()
+    self.total_bytes = 0
@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+from collections import defaultdict
+from ubo_engine import build_reverse_adj, strongly_connected_components, check_cross_holdings
+from instrumentation import instrument, count
+
+# How far each equity stake would have to move before an owner crosses the UBO
+# threshold, for every owner and stake at once.
+#
+# One sweep up from the target gives each entity's stake in it, U, and alongside
+# it each entity's stake in every entity below it, M (the adjoint: M[x][a] is
+# dU(x)/dU(a)). The sensitivity of owner x to the stake a -> b is M[x][a] * U(b),
+# and by the Sherman-Morrison identity changing that stake by d moves U(x) by
+# exactly M[x][a] * U(b) * d / (1 - d * M[b][a]); M[b][a] is only non-zero when
+# the stake is part of a cross-holding. The stake needed to reach the threshold
+# follows from that without recomputing anything.
+
+FLIP_COLUMNS = ["OwnerID", "OwnerName", "EdgeOwnerID", "EdgeOwnedID", "CurrentPct", "RequiredPct", "Margin", "Sensitivity", "Effect"]
+
+def _solve_block(comp: list, edges: dict, stakes: dict, below: dict):
+  """Stakes in the target and in everything below for one cross-holding component"""
+  pos = {n: i for i, n in enumerate(comp)}
+  # Columns: the target stake, then every entity whose stake some member can hold
+  cols = {}
+  for n in comp:
+    cols.setdefault(n, len(cols))
+    for child, _ in edges.get(n, ()):
+      if child not in pos:
+        for a in below[child]:
+          cols.setdefault(a, len(cols))
+  size = len(comp)
+  a_mat = np.zeros((size, size))
+  rhs = np.zeros((size, len(cols) + 1))
+  for n in comp:
+    i = pos[n]
+    rhs[i, 1 + cols[n]] = 1.0
+    for child, pct in edges.get(n, ()):
+      if child in pos:
+        a_mat[i, pos[child]] += pct
+      else:
+        rhs[i, 0] += pct * stakes[child]
+        for a, m in below[child].items():
+          rhs[i, 1 + cols[a]] += pct * m
+  check_cross_holdings(comp, a_mat)
+  sol = np.linalg.solve(np.eye(size) - a_mat, rhs)
+  names = list(cols)
+  for n in comp:
+    row = sol[pos[n]]
+    stakes[n] = float(row[0])
+    below[n] = {a: float(row[1 + j]) for j, a in enumerate(names) if row[1 + j] != 0.0}
+
+@instrument()
+def upstream_stakes(radj: dict, target: str):
+  """(U, M, edges): stakes in target, each entity's stakes in those below it, and the forward equity edges"""
+  reachable = {target}
+  frontier = [target]
+  while frontier:
+    node = frontier.pop()
+    for owner, _ in radj.get(node, ()):
+      if owner not in reachable:
+        reachable.add(owner)
+        frontier.append(owner)
+  # As in stakes_in_target: sorted for a stable summation order, target as a sink
+  ordered = sorted(reachable)
+  edges = defaultdict(list)
+  for owned in ordered:
+    for owner, pct in radj.get(owned, ()):
+      if owner != target:
+        edges[owner].append((owned, pct))
+  succ = {n: [c for c, _ in edges.get(n, ())] for n in reachable}
+
+  stakes = {target: 1.0}
+  below = {target: {target: 1.0}}
+  for comp in strongly_connected_components(ordered, succ):
+    if comp == [target]:
+      continue
+    node = comp[0]
+    if len(comp) == 1 and node not in succ[node]:
+      stakes[node] = sum(pct * stakes[child] for child, pct in edges.get(node, ()))
+      held = {node: 1.0}
+      for child, pct in edges.get(node, ()):
+        for a, m in below[child].items():
+          held[a] = held.get(a, 0.0) + pct * m
+      below[node] = held
+    else:
+      _solve_block(comp, edges, stakes, below)
+  count("stake pairs held", sum(len(m) for m in below.values()))
+  return stakes, below, edges
+
+@instrument()
+def ubo_flips(entities: pd.DataFrame, relationships: pd.DataFrame, target: str, threshold: float, store=None, control: dict = None) -> pd.DataFrame:
+  """Every (owner, equity stake) where moving that one stake, within 0-100%, takes the owner across threshold"""
+  radj = store.equity_in if store is not None else build_reverse_adj(relationships, rel_type="Equity")
+  stakes, below, edges = upstream_stakes(radj, target)
+  entity_names = entities.set_index("EntityID")["Name"].to_dict()
+  control = control or {}
+  rows = []
+  for owner in sorted(stakes, key=str):
+    # Owners flagged through control keep the flag whatever their equity
+    if owner == target or owner not in entity_names or control.get(owner) or stakes[owner] <= 0:
+      continue
+    need = threshold - stakes[owner]
+    for a, m_xa in below[owner].items():
+      for b, pct in edges.get(a, ()):
+        slope = m_xa * stakes[b]
+        if slope <= 0:
+          continue
+        # Solve slope * d / (1 - d * M[b][a]) = need for the change d
+        denom = slope + need * below[b].get(a, 0.0)
+        if denom <= 0:
+          continue
+        required = pct + need / denom
+        if not 0.0 <= required <= 1.0:
+          continue
+        rows.append({
+          "OwnerID": owner,
+          "OwnerName": entity_names.get(owner, owner),
+          "EdgeOwnerID": a,
+          "EdgeOwnedID": b,
+          "CurrentPct": pct,
+          "RequiredPct": required,
+          "Margin": required - pct,
+          "Sensitivity": slope,
+          "Effect": "becomes UBO" if need > 0 else "stops being UBO",
+        })
+  count("UBO flips found", len(rows))
+  flips = pd.DataFrame(rows, columns=FLIP_COLUMNS)
+  return flips.reindex(flips["Margin"].abs().sort_values(kind="stable").index).reset_index(drop=True)
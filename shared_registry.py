@@ -0,0 +1,255 @@
+import threading
+from collections import Counter
+from contextlib import nullcontext
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from instrumentation import instrument, count
+from frame_buffer import ColumnarTable
+from entity_search import EntitySearchIndex, match_rank, normalise
+from ownership_history import VALIDITY_COLUMNS, date_text
+
+# A master registry shared by every session in the process, plus per-session edits.
+#
+# The registry files are memory-mapped once (Arrow IPC / Feather without copying,
+# Parquet decoded once) and indexed by owned entity. Each session gets a
+# RegistryOverlay holding only its own additions, updates and deletions; it hands
+# the app frames of the target's subgraph with the edits applied, exactly as
+# GraphDatabase does, so nothing else in the app needs to know which one it has.
+
+ENTITY_COLUMNS = ["EntityID", "Name", "Type", "Layer"]
+RELATIONSHIP_COLUMNS = ["OwnerID", "OwnedID", "RelationshipType", "OwnershipPct", "ValidFrom", "ValidTo"]
+
+def read_table(path: str) -> pa.Table:
+  """Memory-mapped Arrow table from an .arrow / .feather (zero-copy) or .parquet file"""
+  if path.lower().endswith((".parquet", ".pq")):
+    return pq.read_table(path, memory_map=True)
+  return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+def _rel_key(owner: str, owned: str, rel_type: str, pct, valid_from=None, valid_to=None) -> tuple:
+  return (owner, owned, rel_type, None if pct is None or pd.isna(pct) else float(pct), date_text(valid_from), date_text(valid_to))
+
+class SharedRegistry:
+  """Read-only base graph, loaded once per process and shared by all sessions"""
+
+  @instrument("SharedRegistry.load")
+  def __init__(self, entities_path: str, relationships_path: str):
+    self.entities = read_table(entities_path).select(ENTITY_COLUMNS)
+    relationships = read_table(relationships_path)
+    # Registries without effective dates hold every relationship for all time
+    for column in VALIDITY_COLUMNS:
+      if column not in relationships.column_names:
+        relationships = relationships.append_column(column, pa.nulls(len(relationships), pa.string()))
+    self.relationships = relationships.select(RELATIONSHIP_COLUMNS)
+
+    entity_ids = self.entities.column("EntityID").to_pandas()
+    owner_ids = self.relationships.column("OwnerID").to_pandas()
+    owned_ids = self.relationships.column("OwnedID").to_pandas()
+    # Registry entities first, then IDs only named by relationships (as GraphStore does)
+    ids = pd.Index(pd.unique(pd.concat([entity_ids, owner_ids, owned_ids], ignore_index=True)))
+    self.ids = ids.tolist()
+    self.index = dict(zip(self.ids, range(len(self.ids))))
+    self.entity_rows = dict(zip(entity_ids, range(len(entity_ids))))
+    self.all_entity_ids = entity_ids.tolist()
+    self.entity_types = self.entities.column("Type").to_pylist()
+
+    # Relationship rows grouped by owned entity, for walking up from a target
+    self.rel_owner = ids.get_indexer(owner_ids).astype(np.int64)
+    rel_owned = ids.get_indexer(owned_ids).astype(np.int64)
+    self.in_order = np.argsort(rel_owned, kind="stable")
+    self.in_offsets = np.zeros(len(self.ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rel_owned, minlength=len(self.ids)), out=self.in_offsets[1:])
+    self.rel_type = self.relationships.column("RelationshipType").to_pandas().to_numpy(dtype=object)
+    self.rel_pct = self.relationships.column("OwnershipPct").to_pandas().to_numpy(dtype=float)
+    self.rel_from = self.relationships.column("ValidFrom").to_pandas().to_numpy(dtype=object)
+    self.rel_to = self.relationships.column("ValidTo").to_pandas().to_numpy(dtype=object)
+    self.search = None
+    self.search_lock = threading.Lock()
+
+  def search_index(self) -> EntitySearchIndex:
+    """Name / ID search over the registry, built on first use and shared by every session"""
+    with self.search_lock:
+      if self.search is None:
+        self.search = EntitySearchIndex(self.all_entity_ids, self.entities.column("Name").to_pylist(), self.entity_types)
+      return self.search
+
+  def rows_into(self, entity_id: str):
+    """Row numbers of the registry relationships whose owned entity is entity_id"""
+    i = self.index.get(entity_id)
+    if i is None:
+      return ()
+    return self.in_order[self.in_offsets[i]:self.in_offsets[i + 1]].tolist()
+
+class RegistryOverlay:
+  """One session's copy-on-write edits over a SharedRegistry, with GraphDatabase's interface"""
+
+  def __init__(self, registry: SharedRegistry):
+    self.registry = registry
+    self.clear()
+
+  def clear(self):
+    """Drop this session's edits; the registry itself is read-only"""
+    self.added_entities = ColumnarTable(ENTITY_COLUMNS, key="EntityID")
+    self.added_relationships = ColumnarTable(RELATIONSHIP_COLUMNS, index_on=("OwnerID", "OwnedID"))
+    self.entity_updates = {}
+    # Registry entities this session deleted. Their registry row and relationships stay
+    # hidden even if the ID is added again: the new entity starts with no relationships
+    self.deleted_entities = set()
+    self.deleted_relationships = Counter()
+
+  def transaction(self):
+    # Edits only touch this session's overlay, so there is nothing to group
+    return nullcontext(self)
+
+  # Reads
+
+  def has_entity(self, entity_id: str) -> bool:
+    if entity_id in self.added_entities:
+      return True
+    return entity_id in self.registry.entity_rows and entity_id not in self.deleted_entities
+
+  @instrument("RegistryOverlay.search_entities")
+  def search_entities(self, query: str = "", entity_type: str = None, offset: int = 0, limit: int = 50):
+    """(number of matches, [(EntityID, Name)] for one page); this session's added and edited entities come first"""
+    index = self.registry.search_index()
+    # Rows of the shared search are the registry's own; drop the ones this session changed
+    hidden = self.deleted_entities.union(self.entity_updates)
+    base = index.search(query, entity_type)
+    if hidden:
+      base = [r for r in base if index.ids[r] not in hidden]
+    q = normalise(query.strip())
+    edited = [(eid, name) for eid, (name, t, _) in self.entity_updates.items() if entity_type is None or t == entity_type]
+    added = self.added_entities.frame()
+    if entity_type is not None:
+      added = added[added["Type"] == entity_type]
+    edited += list(zip(added["EntityID"], added["Name"]))
+    extra = [(eid, name) for eid, name in edited if not q or match_rank(q, eid, name) is not None]
+    page = extra[offset:offset + limit]
+    if len(page) < limit:
+      start = max(0, offset - len(extra))
+      page += [(index.ids[r], index.names[r]) for r in base[start:start + limit - len(page)]]
+    return len(extra) + len(base), page
+
+  @instrument("RegistryOverlay.load_subgraph")
+  def load_subgraph(self, target: str):
+    """(entities, relationships) frames of everything that can reach target, edits applied"""
+    if target is None or (target in self.deleted_entities and target not in self.added_entities):
+      return pd.DataFrame(columns=ENTITY_COLUMNS), pd.DataFrame(columns=RELATIONSHIP_COLUMNS)
+    registry = self.registry
+    removed = Counter(self.deleted_relationships)
+    added_rels = self.added_relationships
+
+    seen = {target}
+    frontier = [target]
+    base_rows = []
+    added_rows = []
+    while frontier:
+      owned = frontier.pop()
+      owners = []
+      for row in self._base_rows_into(owned, removed):
+        base_rows.append(row)
+        owners.append(registry.ids[registry.rel_owner[row]])
+      for row in added_rels.rows_where("OwnedID", owned):
+        added_rows.append(row)
+        owners.append(added_rels.data["OwnerID"][row])
+      for owner in owners:
+        if owner not in seen:
+          seen.add(owner)
+          frontier.append(owner)
+
+    # Only the subgraph's rows are copied out of the shared tables
+    relationships = registry.relationships.take(pa.array(sorted(base_rows), type=pa.int64())).to_pandas()
+    if added_rows:
+      extra = pd.DataFrame([added_rels.get(row) for row in sorted(added_rows)], columns=RELATIONSHIP_COLUMNS)
+      relationships = pd.concat([relationships, extra], ignore_index=True)
+    entity_rows = sorted(registry.entity_rows[eid] for eid in seen if eid in registry.entity_rows and eid not in self.deleted_entities)
+    entities = registry.entities.take(pa.array(entity_rows, type=pa.int64())).to_pandas()
+    for eid, (name, entity_type, layer) in self.entity_updates.items():
+      hit = entities["EntityID"] == eid
+      if hit.any():
+        entities.loc[hit, ["Name", "Type", "Layer"]] = [name, entity_type, layer]
+    added_rows = sorted(self.added_entities.row_of(eid) for eid in seen if eid in self.added_entities)
+    if added_rows:
+      extra = pd.DataFrame([self.added_entities.get(row) for row in added_rows], columns=ENTITY_COLUMNS)
+      entities = pd.concat([entities, extra], ignore_index=True)
+    entities["Layer"] = entities["Layer"].astype(int)
+    relationships["OwnershipPct"] = relationships["OwnershipPct"].astype(float)
+    count("entities loaded", len(entities))
+    count("relationships loaded", len(relationships))
+    return entities, relationships
+
+  def _base_rows_into(self, owned: str, removed: Counter):
+    """Registry rows into owned that this session has not deleted; removed is used up as rows match it"""
+    registry = self.registry
+    if owned in self.deleted_entities:
+      return
+    for row in registry.rows_into(owned):
+      owner = registry.ids[registry.rel_owner[row]]
+      if owner in self.deleted_entities:
+        continue
+      if removed:
+        key = _rel_key(owner, owned, registry.rel_type[row], registry.rel_pct[row], registry.rel_from[row], registry.rel_to[row])
+        if removed[key] > 0:
+          removed[key] -= 1
+          continue
+      yield row
+
+  def existing_ids(self, ids: list) -> set:
+    """Those of ids that are entities, edits applied"""
+    return {eid for eid in ids if self.has_entity(eid)}
+
+  def equity_totals(self, owned_ids: list, on: str) -> dict:
+    """Total equity in force on the ISO date on into each of owned_ids that has any, edits applied"""
+    registry = self.registry
+    removed = Counter(self.deleted_relationships)
+    added = self.added_relationships
+    totals = {}
+    for owned in owned_ids:
+      rows = [(registry.rel_type[r], registry.rel_pct[r], registry.rel_from[r], registry.rel_to[r]) for r in self._base_rows_into(owned, removed)]
+      rows += [tuple(added.data[c][r] for c in RELATIONSHIP_COLUMNS[2:]) for r in added.rows_where("OwnedID", owned)]
+      total = 0.0
+      for rel_type, pct, valid_from, valid_to in rows:
+        valid_from, valid_to = date_text(valid_from), date_text(valid_to)
+        if rel_type == "Equity" and (valid_from is None or valid_from <= on) and (valid_to is None or on < valid_to):
+          total += float(pct)
+      if rows:
+        totals[owned] = total
+    return totals
+
+  # Writes, all into this session's overlay
+
+  def add_entities(self, rows: pd.DataFrame):
+    self.added_entities.extend(rows)
+
+  def add_relationships(self, rows: pd.DataFrame):
+    self.added_relationships.extend(rows)
+
+  def update_entity(self, entity_id: str, name: str, entity_type: str, layer: int):
+    if entity_id in self.added_entities:
+      self.added_entities.update(self.added_entities.row_of(entity_id), Name=name, Type=entity_type, Layer=int(layer))
+    else:
+      self.entity_updates[entity_id] = (name, entity_type, int(layer))
+
+  def delete_entity(self, entity_id: str):
+    """Hide an entity and every relationship it is on either side of"""
+    if entity_id in self.added_entities:
+      self.added_entities.delete(self.added_entities.row_of(entity_id))
+    self.added_relationships.delete_where("OwnerID", entity_id)
+    self.added_relationships.delete_where("OwnedID", entity_id)
+    self.entity_updates.pop(entity_id, None)
+    if entity_id in self.registry.index:
+      self.deleted_entities.add(entity_id)
+
+  def delete_relationship(self, rel: tuple):
+    key = _rel_key(*rel)
+    rels = self.added_relationships
+    for row in rels.rows_where("OwnerID", key[0]):
+      if _rel_key(*rels.get(row).values()) == key:
+        rels.delete(row)
+        return
+    self.deleted_relationships[key] += 1
+
+  def update_relationship(self, old: tuple, new: tuple):
+    self.delete_relationship(old)
+    self.add_relationships(pd.DataFrame([dict(zip(RELATIONSHIP_COLUMNS, new))]))
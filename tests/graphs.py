@@ -0,0 +1,40 @@
+import random
+import pandas as pd
+from ownership_history import day_text
+
+# Small random ownership structures for checking the engines against brute force
+
+FIRST_DAY = 19000
+
+def random_graph(n_entities: int, n_relationships: int, seed: int, cyclic: bool = False, dated: bool = False, duplicates: bool = False):
+  """(entities, relationships) with at most one row per (owner, owned, type) unless duplicates is set"""
+  rnd = random.Random(seed)
+  ids = [f"e{i}" for i in range(n_entities)]
+  entities = pd.DataFrame({
+    "EntityID": ids,
+    "Name": [f"Entity {i}" for i in range(n_entities)],
+    "Type": ["Company" if i < n_entities // 2 else "Person" for i in range(n_entities)],
+    "Layer": 0,
+  })
+  rows = {}
+  for k in range(n_relationships):
+    a, b = rnd.sample(range(n_entities), 2)
+    if not cyclic and a < b:
+      # Higher numbers own lower ones, so nothing loops
+      a, b = b, a
+    rel_type = "Equity" if rnd.random() < 0.75 else "Directorship"
+    rows[(a, b, rel_type, k if duplicates else 0)] = {
+      "OwnerID": ids[a],
+      "OwnedID": ids[b],
+      "RelationshipType": rel_type,
+      "OwnershipPct": round(rnd.uniform(0.05, 0.6), 3) if rel_type == "Equity" else None,
+      "ValidFrom": day_text(FIRST_DAY + rnd.randrange(60)) if dated and rnd.random() < 0.6 else None,
+      "ValidTo": day_text(FIRST_DAY + rnd.randrange(60)) if dated and rnd.random() < 0.6 else None,
+    }
+  relationships = pd.DataFrame(list(rows.values()), columns=["OwnerID", "OwnedID", "RelationshipType", "OwnershipPct", "ValidFrom", "ValidTo"])
+  if cyclic:
+    # Keep every loop leaking stake, so each holding is below 100% of itself
+    outgoing = relationships[relationships["RelationshipType"] == "Equity"].groupby("OwnerID")["OwnershipPct"].transform("sum")
+    scale = (0.9 / outgoing).clip(upper=1.0)
+    relationships.loc[scale.index, "OwnershipPct"] = (relationships.loc[scale.index, "OwnershipPct"] * scale).round(3)
+  return entities, relationships
@@ -0,0 +1,47 @@
+import io
+import pandas as pd
+from bulk_import import import_registry, ENTITY_COLUMNS, RELATIONSHIP_COLUMNS
+
+EXISTING_ENTITIES = pd.DataFrame([("acme", "Acme", "Company", 0)], columns=ENTITY_COLUMNS)
+NO_RELATIONSHIPS = pd.DataFrame(columns=RELATIONSHIP_COLUMNS)
+
+def csv_file(text: str) -> io.StringIO:
+  return io.StringIO(text.strip() + "\n")
+
+def issues_of(issues: pd.DataFrame, file: str) -> list:
+  found = issues[issues["File"] == file]
+  return sorted(zip(found["Row"], found["Issue"]))
+
+def test_blank_cells_are_rejected_as_empty():
+  entities = csv_file("""
+EntityID,Name,Type,Layer
+alice,Alice,Person,1
+,,Person,1
+bob,,Person,1
+,Carol,Person,1
+""")
+  relationships = csv_file("""
+OwnerID,OwnedID,RelationshipType,OwnershipPct
+alice,acme,Equity,0.3
+,acme,Equity,0.2
+alice,,Equity,0.2
+carol,acme,Directorship,
+""")
+  new_entities, new_relationships, issues = import_registry(entities, relationships, EXISTING_ENTITIES, NO_RELATIONSHIPS)
+  # Row numbers are 1-based after the header; a missing ID is made from the name
+  assert new_entities["EntityID"].tolist() == ["alice", "carol"]
+  assert issues_of(issues, "entities") == [(3, "Empty name or ID"), (4, "Empty name or ID")]
+  assert new_relationships[["OwnerID", "OwnedID"]].values.tolist() == [["alice", "acme"], ["carol", "acme"]]
+  assert issues_of(issues, "relationships") == [(3, "Empty name or ID"), (4, "Empty name or ID")]
+  assert not new_entities["EntityID"].isna().any()
+  assert not new_relationships[["OwnerID", "OwnedID"]].isna().any().any()
+
+def test_blank_names_in_a_registry_extract():
+  relationships = csv_file("""
+OwnerName,OwnedName,OwnershipPct
+Acme,,0.2
+,Acme,0.2
+""")
+  _, new_relationships, issues = import_registry(None, relationships, EXISTING_ENTITIES, NO_RELATIONSHIPS)
+  assert len(new_relationships) == 0
+  assert issues_of(issues, "relationships") == [(2, "Empty name or ID"), (3, "Empty name or ID")]
@@ -0,0 +1,63 @@
+from collections import defaultdict
+import pandas as pd
+import pytest
+from graph_store import GraphStore
+from ubo_engine import propagate_control
+from graphs import random_graph
+
+def brute_force_control(relationships: pd.DataFrame, majority: float = 0.5) -> dict:
+  """Controllers of every entity, by re-evaluating all of them from scratch until nothing changes"""
+  votes_in = defaultdict(list)
+  board = defaultdict(set)
+  for owner, owned, rel_type, pct in zip(relationships["OwnerID"], relationships["OwnedID"], relationships["RelationshipType"], relationships["OwnershipPct"]):
+    if rel_type == "Equity":
+      votes_in[owned].append((owner, float(pct)))
+    else:
+      board[owned].add(owner)
+  nodes = set(relationships["OwnerID"]) | set(relationships["OwnedID"])
+  ctrl = {n: {} for n in nodes}
+  while True:
+    new = {}
+    for node in nodes:
+      votes = defaultdict(float)
+      for holder, pct in votes_in[node]:
+        for c in {holder} | set(ctrl[holder]):
+          votes[c] += pct
+      seats = defaultdict(int)
+      for director in board[node]:
+        for c in {director} | set(ctrl[director]):
+          seats[c] += 1
+      found = {c: "votes" for c, v in votes.items() if v > majority and c != node}
+      for c, n in seats.items():
+        if n > majority * len(board[node]) and c != node:
+          found[c] = "votes and board" if c in found else "board"
+      new[node] = found
+    if new == ctrl:
+      return ctrl
+    ctrl = new
+
+def test_board_majority_through_a_controlled_director():
+  relationships = pd.DataFrame([
+    ("a", "c", "Equity", 0.6),
+    ("c", "t", "Directorship", None),
+    ("a", "t", "Directorship", None),
+    ("x", "t", "Directorship", None),
+    ("w", "t", "Equity", 0.2),
+  ], columns=["OwnerID", "OwnedID", "RelationshipType", "OwnershipPct"])
+  assert propagate_control(relationships, "t") == {"a": "board"}
+
+@pytest.mark.parametrize("cyclic", [False, True])
+@pytest.mark.parametrize("seed", range(6))
+def test_matches_brute_force(seed, cyclic):
+  entities, relationships = random_graph(14, 40, seed, cyclic=cyclic)
+  expected = brute_force_control(relationships)
+  store = GraphStore(entities, relationships)
+  for target in entities["EntityID"]:
+    assert propagate_control(relationships, target) == expected.get(target, {})
+    assert propagate_control(None, target, store=store) == expected.get(target, {})
+
+def test_higher_majority_needs_more_votes():
+  entities, relationships = random_graph(14, 40, 0)
+  expected = brute_force_control(relationships, majority=2 / 3)
+  for target in entities["EntityID"]:
+    assert propagate_control(relationships, target, majority=2 / 3) == expected.get(target, {})
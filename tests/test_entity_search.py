@@ -0,0 +1,44 @@
+import pandas as pd
+import pytest
+from entity_search import EntitySearchIndex, match_rank, normalise
+from graph_db import GraphDatabase
+
+ENTITIES = pd.DataFrame({
+  "EntityID": ["holdco", "matt", "subco", "mh", "ann", "bob", "ltd1"],
+  "Name": ["Matt Holdings", "Matt Ltd", "Sub Matt Co", "Holding Co", "Ann Smith", "Bob Matthews", "Trust"],
+  "Type": ["Company", "Company", "Company", "Company", "Person", "Person", "Company"],
+  "Layer": 0,
+})
+
+def names(hits: list) -> list:
+  return [name for _, name in hits]
+
+def test_prefix_matches_come_before_substrings():
+  index = EntitySearchIndex(ENTITIES["EntityID"], ENTITIES["Name"], ENTITIES["Type"])
+  total, hits = index.search_entities("matt")
+  # Prefixes on name or ID in entity order, then substrings in entity order
+  assert total == 4
+  assert names(hits) == ["Matt Holdings", "Matt Ltd", "Sub Matt Co", "Bob Matthews"]
+  # "ltd" starts the ID ltd1 and only sits inside the name Matt Ltd
+  assert names(index.search_entities("LTD")[1]) == ["Trust", "Matt Ltd"]
+  assert names(index.search_entities("co")[1]) == ["Matt Holdings", "Sub Matt Co", "Holding Co"]
+  assert names(index.search_entities("Holding")[1]) == ["Holding Co", "Matt Holdings"]
+
+def test_type_filter_paging_and_empty_queries():
+  index = EntitySearchIndex(ENTITIES["EntityID"], ENTITIES["Name"], ENTITIES["Type"])
+  assert index.search_entities("matt", entity_type="Person") == (1, [("bob", "Bob Matthews")])
+  assert index.search_entities("matt", offset=1, limit=2) == (4, [("matt", "Matt Ltd"), ("subco", "Sub Matt Co")])
+  assert index.search_entities("  ")[0] == len(ENTITIES)
+  assert index.search_entities("zzz") == (0, [])
+  # A query spanning the name and ID columns matches neither
+  assert index.search_entities("ltd\tmatt") == (0, [])
+
+@pytest.mark.parametrize("query", ["m", "matt", "co", "o", "ltd", "h", "smith", "1"])
+def test_matches_rank_and_database_order(query, tmp_path):
+  index = EntitySearchIndex(ENTITIES["EntityID"], ENTITIES["Name"], ENTITIES["Type"])
+  ranks = [match_rank(normalise(query), e, n) for e, n in zip(ENTITIES["EntityID"], ENTITIES["Name"])]
+  expected = [r for rank in (0, 1) for r, got in enumerate(ranks) if got == rank]
+  assert index.search(query) == expected
+  db = GraphDatabase(str(tmp_path / "search.sqlite"))
+  db.add_entities(ENTITIES)
+  assert db.search_entities(query) == index.search_entities(query)
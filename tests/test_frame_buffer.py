@@ -0,0 +1,81 @@
+import random
+import pandas as pd
+import pytest
+from frame_buffer import ColumnarTable
+
+COLUMNS = ["EntityID", "Name", "Type", "Layer"]
+
+def new_row(n: int, rnd: random.Random) -> dict:
+  return {"EntityID": f"e{n}", "Name": f"Entity {n}", "Type": rnd.choice(["Company", "Person"]), "Layer": rnd.randrange(3)}
+
+def assert_same(table: ColumnarTable, expected: pd.DataFrame):
+  got = table.frame()
+  assert len(table) == len(expected)
+  pd.testing.assert_frame_equal(got.reset_index(drop=True), expected.reset_index(drop=True), check_dtype=False)
+  # The index is row numbers, so each row reads back through get()
+  for row, eid in zip(got.index, got["EntityID"]):
+    assert table.get(row)["EntityID"] == eid
+    assert table.row_of(eid) == row
+  for kind in ["Company", "Person"]:
+    assert [table.get(r)["EntityID"] for r in table.rows_where("Type", kind)] == expected.loc[expected["Type"] == kind, "EntityID"].tolist()
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_edits_match_a_plain_frame(seed):
+  rnd = random.Random(seed)
+  table = ColumnarTable(COLUMNS, key="EntityID", index_on=("Type",))
+  expected = pd.DataFrame(columns=COLUMNS)
+  made = 0
+  fingerprints = {}
+  for step in range(300):
+    op = rnd.choice(["append", "extend", "delete", "delete", "update", "delete_where", "duplicate"])
+    if op == "append":
+      row = new_row(made, rnd)
+      made += 1
+      table.append(row)
+      expected = pd.concat([expected, pd.DataFrame([row])], ignore_index=True)
+    elif op == "extend":
+      rows = [new_row(made + i, rnd) for i in range(rnd.randrange(1, 6))]
+      made += len(rows)
+      table.extend(pd.DataFrame(rows))
+      expected = pd.concat([expected, pd.DataFrame(rows)], ignore_index=True)
+    elif op == "delete" and len(expected):
+      eid = rnd.choice(expected["EntityID"].tolist())
+      table.delete(table.row_of(eid))
+      expected = expected[expected["EntityID"] != eid]
+    elif op == "update" and len(expected):
+      eid = rnd.choice(expected["EntityID"].tolist())
+      values = {"Name": f"Renamed {step}", "Type": rnd.choice(["Company", "Person"])}
+      table.update(table.row_of(eid), **values)
+      expected.loc[expected["EntityID"] == eid, list(values)] = list(values.values())
+    elif op == "delete_where" and rnd.random() < 0.1:
+      kind = rnd.choice(["Company", "Person"])
+      assert table.delete_where("Type", kind) == (expected["Type"] == kind).sum()
+      expected = expected[expected["Type"] != kind]
+    elif op == "duplicate" and len(expected):
+      before = table.version
+      with pytest.raises(ValueError):
+        table.extend([new_row(made, rnd), {**new_row(made + 1, rnd), "EntityID": rnd.choice(expected["EntityID"].tolist())}])
+      assert table.version == before
+    if step % 7 == 0:
+      assert_same(table, expected)
+      # Equal contents hash equally, whatever tombstones or compaction happened in between
+      fp = table.fingerprint()
+      key = tuple(map(tuple, expected.astype(str).values.tolist()))
+      assert fingerprints.setdefault(key, fp) == fp
+  assert_same(table, expected)
+  # Tombstones are compacted away once they outnumber the live rows
+  assert len(table.alive) <= 2 * len(table) + 64
+
+def test_frame_and_fingerprint_are_rebuilt_only_after_a_change():
+  table = ColumnarTable(COLUMNS, key="EntityID", index_on=("Type",))
+  table.extend([new_row(i, random.Random(i)) for i in range(4)])
+  first = table.frame()
+  fp = table.fingerprint()
+  assert table.frame() is first and table.fingerprint() == fp
+  table.delete(table.row_of("e1"))
+  assert table.frame() is not first
+  assert table.fingerprint() != fp
+  assert "e1" not in table and table.frame().index.tolist() == [0, 2, 3]
+  # Deleting a tombstoned row again changes nothing
+  table.delete(1)
+  assert len(table) == 3 and table.frame().index.tolist() == [0, 2, 3]
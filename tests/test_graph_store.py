@@ -0,0 +1,50 @@
+import pytest
+from graph_store import GraphStore, EQUITY, DIRECTORSHIP
+from ubo_engine import build_adj, build_reverse_adj, build_board
+from graphs import random_graph
+
+def assert_same_adjacency(view, expected: dict, ids: list):
+  for eid in ids:
+    assert list(view.get(eid)) == expected.get(eid, [])
+    assert (eid in view) == bool(expected.get(eid))
+  assert {eid: list(pairs) for eid, pairs in view.items()} == {eid: pairs for eid, pairs in expected.items() if pairs}
+
+@pytest.mark.parametrize("cyclic", [False, True])
+@pytest.mark.parametrize("seed", range(5))
+def test_views_match_frame_adjacency(seed, cyclic):
+  entities, relationships = random_graph(20, 60, seed, cyclic=cyclic, duplicates=True)
+  store = GraphStore(entities, relationships)
+  ids = list(entities["EntityID"]) + ["missing"]
+  assert_same_adjacency(store.equity_out, build_adj(relationships, rel_type="Equity"), ids)
+  assert_same_adjacency(store.equity_in, build_reverse_adj(relationships, rel_type="Equity"), ids)
+  # The board view has one entry per pair and carries the pair's equity, which callers ignore
+  board = {eid: list(dict.fromkeys(d for d, _ in pairs)) for eid, pairs in build_board(relationships).items()}
+  for eid in ids:
+    assert sorted(d for d, _ in store.directorship_in.get(eid)) == sorted(board.get(eid, []))
+
+@pytest.mark.parametrize("seed", range(5))
+def test_edges_and_status_match_the_rows(seed):
+  entities, relationships = random_graph(20, 60, seed, cyclic=True, duplicates=True)
+  store = GraphStore(entities, relationships)
+  expected = {}
+  for owner, owned, kind, pct in zip(relationships["OwnerID"], relationships["OwnedID"], relationships["RelationshipType"], relationships["OwnershipPct"]):
+    eq, mask = expected.get((owner, owned), (0.0, 0))
+    if kind == "Equity":
+      expected[(owner, owned)] = (eq + float(pct), mask | EQUITY)
+    else:
+      expected[(owner, owned)] = (eq, mask | DIRECTORSHIP)
+  edges = list(store.edges())
+  assert [store.index[o] for o, _, _, _ in edges] == sorted(store.index[o] for o, _, _, _ in edges)
+  assert {(o, d): m for o, d, _, m in edges} == {pair: mask for pair, (_, mask) in expected.items()}
+  for owner, owned, equity, mask in edges:
+    if mask & EQUITY:
+      assert equity == pytest.approx(expected[(owner, owned)][0])
+    else:
+      assert equity is None
+    incoming = [(o, p, m) for o, p, m in store.in_edges(owned) if o == owner]
+    assert len(incoming) == 1 and incoming[0][2] == mask
+  statuses = {EQUITY: "shareholder", DIRECTORSHIP: "director", EQUITY | DIRECTORSHIP: "both"}
+  for owner in entities["EntityID"]:
+    for owned in entities["EntityID"]:
+      mask = expected.get((owner, owned), (0.0, 0))[1]
+      assert store.status(owner, owned) == statuses.get(mask)
@@ -0,0 +1,104 @@
+import random
+import pandas as pd
+import pytest
+from incremental import IncrementalOwnership
+from ubo_engine import propagate_ultimate_ownership
+from graphs import random_graph
+
+COLUMNS = ["OwnerID", "OwnedID", "RelationshipType", "OwnershipPct"]
+TARGET = "e0"
+
+def stakes(ownership: dict) -> dict:
+  return {eid: u["UltimateOwnership"] for eid, u in ownership.items()}
+
+def assert_matches_recompute(state, entities, rows, version):
+  relationships = pd.DataFrame(rows, columns=COLUMNS)
+  got = stakes(state.ultimate_ownership(entities, relationships, TARGET, version))
+  expected = stakes(propagate_ultimate_ownership(entities, relationships, TARGET))
+  assert got.keys() == expected.keys()
+  for eid, pct in expected.items():
+    assert got[eid] == pytest.approx(pct, abs=1e-9)
+
+def outgoing(rows, owner) -> float:
+  return sum(r[3] for r in rows if r[0] == owner and r[2] == "Equity")
+
+@pytest.mark.parametrize("cyclic", [False, True])
+@pytest.mark.parametrize("seed", range(5))
+def test_random_edits_match_a_full_recompute(seed, cyclic):
+  rnd = random.Random(seed)
+  entities, relationships = random_graph(12, 20, seed, cyclic=cyclic, duplicates=True)
+  ids = list(entities["EntityID"])
+  rows = [tuple(r) for r in relationships[COLUMNS].itertuples(index=False)]
+  state = IncrementalOwnership()
+  assert_matches_recompute(state, entities, rows, 0)
+  for version in range(1, 80):
+    op = rnd.choice(["add", "add", "remove", "update"])
+    if op == "add" or not rows:
+      a, b = rnd.sample(range(len(ids)), 2)
+      if not cyclic and a < b:
+        a, b = b, a
+      pct = round(rnd.uniform(0.02, 0.3), 3)
+      if outgoing(rows, ids[a]) + pct > 0.9:
+        # Keep every loop leaking stake, so a full recompute always has an answer
+        state.mark_current(version - 1, version)
+      else:
+        rows.append((ids[a], ids[b], "Equity", pct))
+        state.add_edge(ids[a], ids[b], pct, version - 1, version)
+    elif op == "remove":
+      old = rows.pop(rnd.randrange(len(rows)))
+      if old[2] == "Equity":
+        state.remove_edge(old[0], old[1], old[3], version - 1, version)
+      else:
+        state.mark_current(version - 1, version)
+    else:
+      i = rnd.randrange(len(rows))
+      old = rows[i]
+      new = (old[0], old[1], "Equity", round(rnd.uniform(0.02, 0.9 - outgoing(rows, old[0]) + (old[3] if old[2] == "Equity" else 0.0)), 3))
+      if new[3] <= 0:
+        new = (old[0], old[1], "Directorship", None)
+      rows[i] = new
+      state.update_edge(old, new, version - 1, version)
+    assert_matches_recompute(state, entities, rows, version)
+  if not cyclic:
+    # Only the first read needs a full pass on an acyclic structure
+    assert state.full_recomputes == 1
+    assert state.delta_updates > 0
+
+def test_a_new_cross_holding_falls_back_to_a_full_recompute():
+  entities, relationships = random_graph(12, 30, 0)
+  rows = [tuple(r) for r in relationships[COLUMNS].itertuples(index=False)]
+  state = IncrementalOwnership()
+  assert_matches_recompute(state, entities, rows, 0)
+  # The first edge is an ordinary delta, the second closes a loop
+  rows += [("e1", "e2", "Equity", 0.1), ("e2", "e1", "Equity", 0.1)]
+  state.add_edge("e1", "e2", 0.1, 0, 1)
+  assert state.version == 1
+  state.add_edge("e2", "e1", 0.1, 1, 2)
+  assert state.version is None
+  assert_matches_recompute(state, entities, rows, 2)
+  assert state.full_recomputes == 2
+  assert not state.acyclic
+
+def test_an_unseen_edit_resyncs_on_the_next_read():
+  entities, relationships = random_graph(12, 30, 1)
+  rows = [tuple(r) for r in relationships[COLUMNS].itertuples(index=False)]
+  state = IncrementalOwnership()
+  assert_matches_recompute(state, entities, rows, "v1")
+  # v1 -> v2 happens without the state being told; the edit after it names v2 as its base
+  rows.append(("e5", "e0", "Equity", 0.2))
+  rows.append(("e6", "e0", "Equity", 0.15))
+  state.add_edge("e6", "e0", 0.15, "v2", "v3")
+  assert state.version is None
+  assert_matches_recompute(state, entities, rows, "v3")
+  assert state.full_recomputes == 2
+
+def test_removing_one_of_two_identical_rows_keeps_the_other():
+  entities, _ = random_graph(4, 0, 0)
+  rows = [("e1", "e0", "Equity", 0.2), ("e1", "e0", "Equity", 0.2), ("e2", "e1", "Equity", 0.5)]
+  state = IncrementalOwnership()
+  assert_matches_recompute(state, entities, rows, 0)
+  rows.pop(0)
+  state.remove_edge("e1", "e0", 0.2, 0, 1)
+  assert state.version == 1
+  assert_matches_recompute(state, entities, rows, 1)
+  assert state.full_recomputes == 1
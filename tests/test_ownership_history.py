@@ -0,0 +1,42 @@
+import pytest
+from ownership_history import OwnershipHistory, ubo_changes, in_force, day_text
+from ubo_engine import compute_ubo
+from graphs import random_graph, FIRST_DAY
+
+TARGET = "e0"
+THRESHOLD = 0.25
+START, END = FIRST_DAY - 5, FIRST_DAY + 65
+
+def ubo_owners(entities, relationships, day: int):
+  """UBOs of the target on day and every owner's stake, recomputed from the rows in force"""
+  agg = compute_ubo(entities, relationships[in_force(relationships, day)], TARGET, THRESHOLD)
+  agg = agg[agg["OwnerID"] != TARGET]
+  return set(agg["OwnerID"][agg["UBO_Flag"]]), dict(zip(agg["OwnerID"], agg["AggregatedOwnershipPct"]))
+
+@pytest.mark.parametrize("cyclic", [False, True])
+@pytest.mark.parametrize("seed", range(4))
+def test_as_of_matches_a_scan(seed, cyclic):
+  _, relationships = random_graph(16, 45, seed, cyclic=cyclic, dated=True)
+  history = OwnershipHistory(relationships)
+  for day in range(START, END + 1, 3):
+    assert history.as_of(day).index.tolist() == relationships.index[in_force(relationships, day)].tolist()
+
+@pytest.mark.parametrize("cyclic", [False, True])
+@pytest.mark.parametrize("seed", range(4))
+def test_changes_match_daily_recompute(seed, cyclic):
+  entities, relationships = random_graph(16, 45, seed, cyclic=cyclic, dated=True)
+  expected = []
+  stakes = {}
+  before, stakes[START] = ubo_owners(entities, relationships, START)
+  for day in range(START + 1, END + 1):
+    after, stakes[day] = ubo_owners(entities, relationships, day)
+    expected += [(day_text(day), owner, "became UBO") for owner in after - before]
+    expected += [(day_text(day), owner, "ceased to be UBO") for owner in before - after]
+    before = after
+  changes = ubo_changes(entities, OwnershipHistory(relationships), TARGET, THRESHOLD, START, END)
+  assert sorted(zip(changes["Date"], changes["OwnerID"], changes["Event"])) == sorted(expected)
+  days = {day_text(day): day for day in stakes}
+  for change in changes.itertuples():
+    day = days[change.Date]
+    assert change.PctBefore == pytest.approx(stakes[day - 1].get(change.OwnerID, 0.0), abs=1e-9)
+    assert change.PctAfter == pytest.approx(stakes[day].get(change.OwnerID, 0.0), abs=1e-9)
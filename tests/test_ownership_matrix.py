@@ -0,0 +1,44 @@
+import pandas as pd
+import pytest
+from ownership_matrix import OwnershipMatrix
+from ubo_engine import propagate_ultimate_ownership, meets_threshold
+from graphs import random_graph
+
+def assert_same_stakes(got: dict, expected: dict):
+  assert got.keys() == expected.keys()
+  for eid, pct in expected.items():
+    assert got[eid] == pytest.approx(pct, abs=1e-8)
+
+@pytest.mark.parametrize("cyclic", [False, True])
+@pytest.mark.parametrize("seed", range(5))
+def test_exact_series_and_propagation_agree(seed, cyclic):
+  entities, relationships = random_graph(16, 50, seed, cyclic=cyclic, duplicates=True)
+  exact = OwnershipMatrix(entities, relationships, method="exact")
+  series = OwnershipMatrix(entities, relationships, method="neumann")
+  assert exact.method == "exact" and exact.converged
+  assert series.converged
+  for target in entities["EntityID"]:
+    expected = {eid: u["UltimateOwnership"] for eid, u in propagate_ultimate_ownership(entities, relationships, target).items()}
+    assert_same_stakes(exact.stakes_in(target), expected)
+    assert_same_stakes(series.stakes_in(target), expected)
+
+def test_ubo_flags_leave_out_self_stakes():
+  entities, relationships = random_graph(16, 50, 2, cyclic=True)
+  matrix = OwnershipMatrix(entities, relationships, method="exact")
+  flags = matrix.ubo_flags(0.25)
+  assert not (flags["OwnerID"] == flags["TargetID"]).any()
+  for row in flags.itertuples():
+    assert row.UltimateOwnership == pytest.approx(matrix.stake(row.OwnerID, row.TargetID))
+    assert row.UBO_Flag == meets_threshold(row.UltimateOwnership, 0.25)
+
+@pytest.mark.parametrize("method", ["exact", "neumann"])
+def test_a_loop_passing_on_everything_does_not_converge(method):
+  entities = pd.DataFrame({"EntityID": ["t", "a", "b"], "Name": ["T", "A", "B"], "Type": "Company", "Layer": 0})
+  relationships = pd.DataFrame([
+    ("a", "b", "Equity", 1.0),
+    ("b", "a", "Equity", 1.0),
+    ("a", "t", "Equity", 0.5),
+  ], columns=["OwnerID", "OwnedID", "RelationshipType", "OwnershipPct"])
+  matrix = OwnershipMatrix(entities, relationships, method=method, max_iter=50)
+  assert matrix.method == "neumann"
+  assert not matrix.converged
@@ -0,0 +1,47 @@
+import io
+import pandas as pd
+import pytest
+from path_trie import ubo_path_trie
+from ubo_engine import PATH_COLUMNS, build_adj, find_paths
+from graphs import random_graph
+
+def flat_paths(entities, relationships, target) -> pd.DataFrame:
+  """Every path as compute_ubo listed them before the trie: one record per path, sorted by owner name then share"""
+  adj = build_adj(relationships, rel_type="Equity")
+  names = entities.set_index("EntityID")["Name"].to_dict()
+  records = []
+  for src in sorted(set(relationships[relationships["RelationshipType"] == "Equity"]["OwnerID"])):
+    for pth, prod in find_paths(src, target, adj):
+      records.append({
+        "OwnerID": src,
+        "OwnerName": names.get(src, src),
+        "PathIDs": " -> ".join(pth),
+        "PathNames": " -> ".join(names.get(i, i) for i in pth),
+        "PathOwnershipPct": prod,
+        "FinalTarget": names.get(target, target),
+      })
+  paths = pd.DataFrame(records, columns=PATH_COLUMNS)
+  return paths.sort_values(["OwnerName", "PathOwnershipPct"], ascending=[True, False], kind="stable").reset_index(drop=True)
+
+def assert_same_paths(got: pd.DataFrame, expected: pd.DataFrame):
+  # Paths with equal shares may come in either order; everything else must line up row for row
+  assert list(got.columns) == PATH_COLUMNS
+  assert got["OwnerName"].tolist() == expected["OwnerName"].tolist()
+  assert got["PathOwnershipPct"].tolist() == pytest.approx(expected["PathOwnershipPct"].tolist(), abs=1e-12)
+  assert sorted(map(tuple, got.astype(str).values)) == sorted(map(tuple, expected.astype(str).values))
+
+@pytest.mark.parametrize("cyclic", [False, True])
+@pytest.mark.parametrize("seed", range(4))
+def test_pages_and_csv_match_the_flat_listing(seed, cyclic):
+  entities, relationships = random_graph(12, 30, seed, cyclic=cyclic, duplicates=True)
+  for target in entities["EntityID"][:6]:
+    expected = flat_paths(entities, relationships, target)
+    trie = ubo_path_trie(entities, relationships, target)
+    assert len(trie) == len(expected)
+    pages = [trie.page(start, start + 7) for start in range(0, len(trie), 7)]
+    assert_same_paths(pd.concat(pages, ignore_index=True) if pages else pd.DataFrame(columns=PATH_COLUMNS), expected)
+    text = trie.csv_file(chunk_rows=5).read().decode()
+    assert_same_paths(pd.read_csv(io.StringIO(text), dtype={"OwnerID": str}, float_precision="round_trip"), expected)
+    written = io.StringIO()
+    trie.write_csv(written)
+    assert written.getvalue() == text
@@ -0,0 +1,54 @@
+import pytest
+from sensitivity import ubo_flips
+from ubo_engine import propagate_ultimate_ownership
+from graphs import random_graph
+
+TARGET = "e0"
+THRESHOLD = 0.25
+
+def stakes(entities, relationships) -> dict:
+  return {eid: u["UltimateOwnership"] for eid, u in propagate_ultimate_ownership(entities, relationships, TARGET).items()}
+
+def stakes_with(entities, relationships, row, pct) -> dict:
+  """Every owner's stake in the target after setting one equity row to pct"""
+  edited = relationships.copy()
+  edited.loc[row, "OwnershipPct"] = pct
+  return stakes(entities, edited)
+
+def equity_row(relationships, owner, owned):
+  rows = relationships.index[(relationships["OwnerID"] == owner) & (relationships["OwnedID"] == owned) & (relationships["RelationshipType"] == "Equity")]
+  assert len(rows) == 1
+  return rows[0]
+
+@pytest.mark.parametrize("cyclic", [False, True])
+@pytest.mark.parametrize("seed", range(5))
+def test_required_stake_reaches_threshold(seed, cyclic):
+  entities, relationships = random_graph(16, 45, seed, cyclic=cyclic)
+  flips = ubo_flips(entities, relationships, TARGET, THRESHOLD)
+  for flip in flips.itertuples():
+    row = equity_row(relationships, flip.EdgeOwnerID, flip.EdgeOwnedID)
+    assert flip.CurrentPct == pytest.approx(relationships.at[row, "OwnershipPct"])
+    assert 0.0 <= flip.RequiredPct <= 1.0
+    after = stakes_with(entities, relationships, row, flip.RequiredPct)
+    assert after.get(flip.OwnerID, 0.0) == pytest.approx(THRESHOLD, abs=1e-9)
+
+@pytest.mark.parametrize("seed", range(5))
+def test_every_flip_is_listed(seed):
+  # Acyclic, so an owner's stake is linear in any one edge: it crosses the
+  # threshold within 0-100% exactly when the two ends lie either side of it
+  entities, relationships = random_graph(16, 45, seed)
+  flips = ubo_flips(entities, relationships, TARGET, THRESHOLD)
+  listed = set(zip(flips["OwnerID"], flips["EdgeOwnerID"], flips["EdgeOwnedID"]))
+  current = stakes(entities, relationships)
+  expected = set()
+  for row in relationships.index[relationships["RelationshipType"] == "Equity"]:
+    low = stakes_with(entities, relationships, row, 0.0)
+    high = stakes_with(entities, relationships, row, 1.0)
+    for owner in current:
+      if owner == TARGET:
+        continue
+      ends = [low.get(owner, 0.0) - THRESHOLD, high.get(owner, 0.0) - THRESHOLD]
+      if min(ends) < -1e-9 and max(ends) > 1e-9:
+        expected.add((owner, relationships.at[row, "OwnerID"], relationships.at[row, "OwnedID"]))
+  assert listed == expected
+  assert len(expected) > 0
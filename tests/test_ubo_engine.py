@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+from graph_store import GraphStore
+from ownership_history import OwnershipHistory, ubo_changes, day_text
+from ownership_matrix import OwnershipMatrix
+from ubo_engine import compute_all_ultimate_ownership, propagate_ultimate_ownership, compute_ubo, compute_ubo_records, CircularOwnershipError
+from graphs import random_graph, FIRST_DAY
+
+def stakes(ownership: dict) -> dict:
+  return {eid: u["UltimateOwnership"] for eid, u in ownership.items()}
+
+def matrix_stakes(entities, relationships, target: str) -> dict:
+  """Stakes from (I - A)^-1 over the whole graph, the target's own holdings cut as in find_paths"""
+  ids = list(entities["EntityID"])
+  pos = {eid: i for i, eid in enumerate(ids)}
+  a = np.zeros((len(ids), len(ids)))
+  equity = relationships[relationships["RelationshipType"] == "Equity"]
+  for owner, owned, pct in zip(equity["OwnerID"], equity["OwnedID"], equity["OwnershipPct"]):
+    if owner != target:
+      a[pos[owner], pos[owned]] += pct
+  held = np.linalg.solve(np.eye(len(ids)) - a, np.eye(len(ids))[:, pos[target]])
+  return {eid: held[pos[eid]] for eid in ids if eid != target and held[pos[eid]] > 0}
+
+@pytest.mark.parametrize("duplicates", [False, True])
+@pytest.mark.parametrize("seed", range(6))
+def test_matches_path_enumeration_on_acyclic_graphs(seed, duplicates):
+  entities, relationships = random_graph(14, 40, seed, duplicates=duplicates)
+  store = GraphStore(entities, relationships)
+  for target in entities["EntityID"]:
+    expected = stakes(compute_all_ultimate_ownership(entities, relationships, target))
+    for got in (propagate_ultimate_ownership(entities, relationships, target), propagate_ultimate_ownership(entities, None, target, store=store)):
+      got = stakes(got)
+      assert got.keys() == expected.keys()
+      for eid, pct in expected.items():
+        assert got[eid] == pytest.approx(pct, abs=1e-12)
+
+@pytest.mark.parametrize("duplicates", [False, True])
+@pytest.mark.parametrize("seed", range(6))
+def test_cross_holdings_match_a_dense_solve(seed, duplicates):
+  entities, relationships = random_graph(14, 40, seed, cyclic=True, duplicates=duplicates)
+  for target in entities["EntityID"]:
+    got = stakes(propagate_ultimate_ownership(entities, relationships, target))
+    got.pop(target, None)
+    expected = matrix_stakes(entities, relationships, target)
+    assert got.keys() == expected.keys()
+    for eid, pct in expected.items():
+      assert got[eid] == pytest.approx(pct, abs=1e-12)
+
+def test_a_loop_that_keeps_everything_is_refused():
+  entities = pd.DataFrame({"EntityID": ["t", "a", "b"], "Name": ["T", "A", "B"], "Type": "Company", "Layer": 0})
+  relationships = pd.DataFrame([
+    ("a", "b", "Equity", 1.0),
+    ("b", "a", "Equity", 1.0),
+    ("a", "t", "Equity", 0.5),
+  ], columns=["OwnerID", "OwnedID", "RelationshipType", "OwnershipPct"])
+  with pytest.raises(CircularOwnershipError) as err:
+    propagate_ultimate_ownership(entities, relationships, "t")
+  assert err.value.members == ["a", "b"]
+
+def test_every_engine_flags_a_stake_a_rounding_error_short():
+  entities = pd.DataFrame({"EntityID": ["t", "a", "b"], "Name": ["T", "A", "B"], "Type": ["Company", "Person", "Person"], "Layer": 0})
+  relationships = pd.DataFrame([
+    ("a", "t", "Equity", 0.25 - 1e-15, day_text(FIRST_DAY), None),
+    ("b", "t", "Equity", 0.2499, None, None),
+  ], columns=["OwnerID", "OwnedID", "RelationshipType", "OwnershipPct", "ValidFrom", "ValidTo"])
+  agg = compute_ubo(entities, relationships, "t", 0.25)
+  assert dict(zip(agg["OwnerID"], agg["UBO_Flag"])) == {"a": True, "b": False}
+  records = compute_ubo_records(GraphStore(entities, relationships), "t", 0.25)
+  assert {r["OwnerID"]: r["UBO_Flag"] for r in records} == {"a": True, "b": False}
+  flags = OwnershipMatrix(entities, relationships).ubo_flags(0.25)
+  assert dict(zip(flags["OwnerID"], flags["UBO_Flag"])) == {"a": True, "b": False}
+  changes = ubo_changes(entities, OwnershipHistory(relationships), "t", 0.25, FIRST_DAY - 1, FIRST_DAY + 1)
+  assert changes[["OwnerID", "Event"]].values.tolist() == [["a", "became UBO"]]
@@ -0,0 +1,212 @@
+"""Headless batch UBO runner.
+
+  python ubo_batch.py entities.csv relationships.csv --all-companies -o ubo.jsonl
+  python ubo_batch.py entities.parquet relationships.parquet --targets acme acmeholdings -o ubo.csv
+  python ubo_batch.py entities.csv relationships.csv --all-companies --as-of 2025-03-31 -o ubo.csv
+  python ubo_batch.py entities.csv relationships.csv --all-companies --changes 2024-01-01 2025-12-31 -o changes.csv
+  python ubo_batch.py entities.csv relationships.csv --all-companies --matrix -o ubo.csv
+
+Reads the same files the app exports, computes the aggregated stake and UBO flag
+of every owner for each target, and writes one row per (target, owner). Targets
+are spread over a process pool; timings go to stderr. --metrics writes the
+per-target timings and counters (see instrumentation.py) for diagnosing slow structures.
+Relationships with ValidFrom / ValidTo dates are taken as of --as-of (default
+today); --changes instead lists every owner who became or ceased to be a UBO
+between two dates (see ownership_history.py). --matrix works out every target's
+stakes in one sparse solve up front (see ownership_matrix.py) instead of one
+propagation per target; control is still found per target.
+"""
+import time
+
+_T0 = time.perf_counter()
+
+import argparse
+import csv
+import json
+import multiprocessing as mp
+import os
+import sys
+from contextlib import nullcontext
+import pandas as pd
+from graph_store import GraphStore
+from ubo_engine import compute_ubo_records, CircularOwnershipError
+from ownership_matrix import OwnershipMatrix
+from ownership_history import OwnershipHistory, ubo_changes, day_number, CHANGE_COLUMNS
+from instrumentation import collect
+
+_T_IMPORTED = time.perf_counter()
+
+OUTPUT_COLUMNS = ["TargetID", "TargetName", "OwnerID", "OwnerName", "AggregatedOwnershipPct", "Control", "UBO_Flag"]
+CHANGES_OUTPUT_COLUMNS = ["TargetID", "TargetName"] + CHANGE_COLUMNS
+
+# Set in the parent before the pool starts so forked workers share them copy-on-write;
+# _HISTORY is (entities, OwnershipHistory, first day, last day) in --changes runs and
+# _MATRIX the OwnershipMatrix of --matrix runs
+_STORE = None
+_HISTORY = None
+_MATRIX = None
+
+def _init_worker(store, history=None, matrix=None):
+  global _STORE, _HISTORY, _MATRIX
+  if store is not None:
+    _STORE = store
+  if history is not None:
+    _HISTORY = history
+  if matrix is not None:
+    _MATRIX = matrix
+
+def _target_rows(target: str, threshold: float) -> list:
+  if _HISTORY is None:
+    return compute_ubo_records(_STORE, target, threshold, stakes=_MATRIX.stakes_in(target) if _MATRIX is not None else None)
+  entities, history, start, end = _HISTORY
+  return ubo_changes(entities, history, target, threshold, start, end).to_dict("records")
+
+def _run_targets(args):
+  targets, threshold, ubo_only, with_metrics = args
+  out = []
+  snapshots = []
+  for target in targets:
+    target_name = _STORE.name(target)
+    with collect(target) if with_metrics else nullcontext() as metrics:
+      try:
+        rows = _target_rows(target, threshold)
+      except CircularOwnershipError as err:
+        # One bad loop should not stop the run; the target is left out and named on stderr
+        print(f"skipped {target}: {err}", file=sys.stderr)
+        rows = []
+    if metrics is not None:
+      snapshots.append({"TargetID": target, "Owners": len(rows), **metrics.to_dict()})
+    for row in rows:
+      if ubo_only and not row.get("UBO_Flag", True):
+        continue
+      out.append({"TargetID": target, "TargetName": target_name, **row})
+  return out, snapshots
+
+def read_table(path: str) -> pd.DataFrame:
+  if path.lower().endswith((".parquet", ".pq")):
+    return pd.read_parquet(path)
+  return pd.read_csv(path)
+
+def run(store: GraphStore, targets: list, threshold: float, workers: int, batch_size: int, ubo_only: bool, metrics: list = None, history: tuple = None, matrix: OwnershipMatrix = None):
+  """Yield output rows, target batch by target batch; per-target metrics are appended to metrics if given.
+  With history (entities, OwnershipHistory, first day, last day) the rows are UBO changes instead.
+  With a matrix, stakes are read from it rather than propagated per target."""
+  global _STORE, _HISTORY, _MATRIX
+  _STORE = store
+  _HISTORY = history
+  _MATRIX = matrix
+  batches = [(targets[i:i + batch_size], threshold, ubo_only, metrics is not None) for i in range(0, len(targets), batch_size)]
+  if workers <= 1:
+    for batch in batches:
+      rows, snapshots = _run_targets(batch)
+      if metrics is not None:
+        metrics.extend(snapshots)
+      yield from rows
+    return
+  ctx = mp.get_context()
+  # Spawned workers cannot inherit the parent's memory, so they get a pickled copy once each
+  initargs = (None, None, None) if ctx.get_start_method() == "fork" else (store, history, matrix)
+  with ctx.Pool(workers, initializer=_init_worker, initargs=initargs) as pool:
+    for rows, snapshots in pool.imap(_run_targets, batches):
+      if metrics is not None:
+        metrics.extend(snapshots)
+      yield from rows
+
+def write_rows(rows, out, fmt: str, columns: list = OUTPUT_COLUMNS) -> int:
+  count = 0
+  if fmt == "csv":
+    writer = csv.DictWriter(out, fieldnames=columns)
+    writer.writeheader()
+    for row in rows:
+      writer.writerow(row)
+      count += 1
+  else:
+    for row in rows:
+      out.write(json.dumps(row) + "\n")
+      count += 1
+  return count
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Compute UBO flags for many targets without the Streamlit app")
+  parser.add_argument("entities", help="entities file (CSV or Parquet), as exported by the app")
+  parser.add_argument("relationships", help="relationships file (CSV or Parquet), as exported by the app")
+  group = parser.add_mutually_exclusive_group(required=True)
+  group.add_argument("--targets", nargs="+", metavar="ENTITY_ID", help="target EntityIDs")
+  group.add_argument("--targets-file", help="file with one target EntityID per line")
+  group.add_argument("--all-companies", action="store_true", help="every entity of type Company")
+  parser.add_argument("--threshold", type=float, default=25.0, help="UBO threshold in percent (default 25)")
+  parser.add_argument("-o", "--output", default="-", help="output file; .csv writes CSV, anything else JSONL (default stdout)")
+  parser.add_argument("--format", choices=["jsonl", "csv"], help="override the format implied by --output")
+  parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes (1 = run in this process)")
+  parser.add_argument("--batch-size", type=int, default=64, help="targets sent to a worker at a time")
+  parser.add_argument("--ubo-only", action="store_true", help="only write owners at or above the threshold")
+  dates = parser.add_mutually_exclusive_group()
+  dates.add_argument("--as-of", metavar="DATE", help="use the relationships in force on this date (default today)")
+  dates.add_argument("--changes", nargs=2, metavar=("FROM", "TO"), help="write the owners who became or ceased to be UBOs after FROM, up to TO")
+  parser.add_argument("--matrix", action="store_true", help="solve every target's stakes at once with the sparse ownership matrix")
+  parser.add_argument("--metrics", metavar="FILE", help="write per-target timings and counters here (JSONL)")
+  args = parser.parse_args(argv)
+
+  t_load = time.perf_counter()
+  entities = read_table(args.entities)
+  relationships = read_table(args.relationships)
+  history = OwnershipHistory(relationships)
+  changes = None
+  matrix = None
+  if args.changes and args.matrix:
+    parser.error("--matrix cannot be combined with --changes")
+  if args.changes:
+    start, end = (day_number(d) for d in args.changes)
+    if start >= end:
+      parser.error("--changes: TO must be after FROM")
+    changes = (entities, history, start, end)
+    # Every relationship ever, so that targets and names from any date are known
+    store = GraphStore(entities, relationships)
+  else:
+    in_force = history.as_of(day_number(args.as_of or pd.Timestamp.today()))
+    store = GraphStore(entities, in_force)
+    if args.matrix:
+      t_matrix = time.perf_counter()
+      matrix = OwnershipMatrix(entities, in_force, method="exact")
+      print(f"ownership matrix: {(time.perf_counter() - t_matrix) * 1000:.0f} ms ({matrix.method}, {matrix.ultimate.nnz:,} stakes)", file=sys.stderr)
+      if not matrix.converged:
+        # Some loop passes on 100% or more; per target, the propagation names it
+        print("ownership matrix did not converge; falling back to one propagation per target", file=sys.stderr)
+        matrix = None
+  if args.all_companies:
+    targets = list(entities.loc[entities["Type"] == "Company", "EntityID"])
+  elif args.targets_file:
+    with open(args.targets_file) as f:
+      targets = [line.strip() for line in f if line.strip()]
+  else:
+    targets = args.targets
+  unknown = [t for t in targets if t not in store.index]
+  if unknown:
+    parser.error(f"unknown target IDs: {', '.join(unknown[:10])}")
+  t_ready = time.perf_counter()
+
+  fmt = args.format or ("csv" if args.output.lower().endswith(".csv") else "jsonl")
+  out = sys.stdout if args.output == "-" else open(args.output, "w", newline="")
+  try:
+    metrics = [] if args.metrics else None
+    rows = run(store, targets, args.threshold / 100.0, args.workers, args.batch_size, args.ubo_only, metrics, history=changes, matrix=matrix)
+    written = write_rows(rows, out, fmt, CHANGES_OUTPUT_COLUMNS if changes else OUTPUT_COLUMNS)
+  finally:
+    if out is not sys.stdout:
+      out.close()
+  if metrics:
+    with open(args.metrics, "w") as f:
+      for snapshot in sorted(metrics, key=lambda m: m["elapsed_s"], reverse=True):
+        f.write(json.dumps(snapshot) + "\n")
+  t_done = time.perf_counter()
+
+  compute_s = t_done - t_ready
+  rate = len(targets) / compute_s if compute_s > 0 else float("inf")
+  print(f"cold start: {(_T_IMPORTED - _T0) * 1000:.0f} ms imports, {(t_ready - t_load) * 1000:.0f} ms loading "
+        f"{len(entities):,} entities / {len(relationships):,} relationships", file=sys.stderr)
+  print(f"computed {len(targets):,} targets in {compute_s:.2f} s ({rate:,.1f} targets/s, {args.workers} workers), "
+        f"{written:,} rows written", file=sys.stderr)
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main())
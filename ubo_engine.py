@@ -0,0 +1,388 @@
+import pandas as pd
+import numpy as np
+from collections import defaultdict, deque
+from instrumentation import instrument, count, record_max
+
+# Ownership engines that do not depend on the Streamlit runtime or graphviz, so
+# batch jobs (see ubo_batch.py) can import them without starting the app
+
+PATH_COLUMNS = ["OwnerID", "OwnerName", "PathIDs", "PathNames", "PathOwnershipPct", "FinalTarget"]
+# Stakes summed in another order (delta updates, matrix solves) can sit a rounding
+# error below a threshold they meet exactly
+UBO_TOLERANCE = 1e-12
+
+def meets_threshold(pct, threshold: float):
+  """Whether a stake (or a Series of them) reaches the UBO threshold"""
+  return pct >= threshold - UBO_TOLERANCE
+
+def sanitize_id(name: str) -> str: 
+  return "".join(ch.lower() for ch in name if ch.isalnum())[:15]
+
+@instrument()
+def build_adj(df: pd.DataFrame, rel_type: str = "Equity"): 
+  adj = defaultdict(list) 
+  rels = df[df["RelationshipType"] == rel_type]
+  for owner, owned, pct in zip(rels["OwnerID"], rels["OwnedID"], rels["OwnershipPct"]):
+    adj[owner].append((owned, float(pct)))
+  return adj
+
+@instrument()
+def build_reverse_adj(df: pd.DataFrame, rel_type: str = "Equity"):
+  """Map each owned entity to its (owner, pct) pairs"""
+  radj = defaultdict(list)
+  rels = df[df["RelationshipType"] == rel_type]
+  for owner, owned, pct in zip(rels["OwnerID"], rels["OwnedID"], rels["OwnershipPct"]):
+    radj[owned].append((owner, float(pct)))
+  return radj
+
+def strongly_connected_components(nodes, succ: dict):
+  """Iterative Tarjan; components come out sinks first (reverse topological order)"""
+  index = {}
+  low = {}
+  on_stack = set()
+  stack = []
+  components = []
+  counter = 0
+  for root in nodes:
+    if root in index:
+      continue
+    work = [(root, iter(succ.get(root, ())))]
+    index[root] = low[root] = counter
+    counter += 1
+    stack.append(root)
+    on_stack.add(root)
+    while work:
+      node, children = work[-1]
+      advanced = False
+      for child in children:
+        if child not in index:
+          index[child] = low[child] = counter
+          counter += 1
+          stack.append(child)
+          on_stack.add(child)
+          work.append((child, iter(succ.get(child, ()))))
+          advanced = True
+          break
+        if child in on_stack:
+          low[node] = min(low[node], index[child])
+      if advanced:
+        continue
+      work.pop()
+      if work:
+        parent = work[-1][0]
+        low[parent] = min(low[parent], low[node])
+      if low[node] == index[node]:
+        comp = []
+        while True:
+          member = stack.pop()
+          on_stack.discard(member)
+          comp.append(member)
+          if member == node:
+            break
+        components.append(comp)
+  return components
+
+class CircularOwnershipError(ValueError):
+  """Cross-holdings that pass on 100% or more of themselves round a loop, so no stake in the target is defined"""
+
+  def __init__(self, members: list):
+    self.members = sorted(members)
+    shown = ", ".join(self.members[:5]) + (", ..." if len(self.members) > 5 else "")
+    super().__init__(f"cross-holdings among {shown} pass on 100% or more round the loop; check their equity percentages")
+
+def check_cross_holdings(comp: list, a: np.ndarray):
+  """Raise unless A + A^2 + ... converges for one component, i.e. every loop leaks some stake"""
+  # The series converges exactly when the spectral radius is below one; at or above it
+  # the linear solve either fails or gives negative or unbounded "stakes"
+  if np.max(np.abs(np.linalg.eigvals(a))) >= 1.0 - 1e-9:
+    raise CircularOwnershipError(comp)
+
+def _solve_component(comp: list, edges: dict, values: dict):
+  """Solve v = A v + b for one cross-holding component, b coming from already solved nodes"""
+  pos = {n: i for i, n in enumerate(comp)}
+  size = len(comp)
+  a = np.zeros((size, size))
+  b = np.zeros(size)
+  for n in comp:
+    i = pos[n]
+    for child, pct in edges.get(n, ()):
+      if child in pos:
+        a[i, pos[child]] += pct
+      else:
+        b[i] += pct * values.get(child, 0.0)
+  check_cross_holdings(comp, a)
+  v = np.linalg.solve(np.eye(size) - a, b)
+  return {n: float(v[pos[n]]) for n in comp}
+
+@instrument()
+def stakes_in_target(radj: dict, target: str):
+  """Stake of every entity with an equity route to the target, plus the target's stake in itself"""
+  # Only entities with an equity route to the target can hold a stake in it
+  reachable = {target}
+  frontier = [target]
+  while frontier:
+    node = frontier.pop()
+    for owner, _ in radj.get(node, ()):
+      if owner not in reachable:
+        reachable.add(owner)
+        frontier.append(owner)
+
+  # Forward edges inside the reachable subgraph; the target is a sink like in find_paths.
+  # Sorted so sums are added in the same order in every process (set order depends on hash seed)
+  ordered = sorted(reachable)
+  edges = defaultdict(list)
+  for owned in ordered:
+    for owner, pct in radj.get(owned, ()):
+      edges[owner].append((owned, pct))
+  succ = {n: [c for c, _ in edges.get(n, ()) if n != target] for n in reachable}
+
+  values = {target: 1.0}
+  for comp in strongly_connected_components(ordered, succ):
+    if comp == [target]:
+      continue
+    if len(comp) == 1 and comp[0] not in succ[comp[0]]:
+      node = comp[0]
+      values[node] = sum(pct * values.get(child, 0.0) for child, pct in edges.get(node, ()))
+    else:
+      values.update(_solve_component(comp, edges, values))
+      count("cross-holding components solved")
+  count("entities reached", len(reachable))
+
+  # The target's own stake comes only from holdings that loop back to it
+  self_stake = sum(pct * values.get(child, 0.0) for child, pct in edges.get(target, ()))
+  return values, self_stake
+
+def ownership_records(entities: pd.DataFrame, values: dict, self_stake: float, target: str):
+  """compute_all_ultimate_ownership-shaped dict from per-entity stakes"""
+  entity_names = entities.set_index("EntityID")["Name"].to_dict()
+  entity_types = entities.set_index("EntityID")["Type"].to_dict()
+  ultimate_ownership = {}
+  for entity_id in entities['EntityID']:
+    total_ownership = self_stake if entity_id == target else values.get(entity_id, 0.0)
+    if total_ownership > 0:
+      ultimate_ownership[entity_id] = {
+        'EntityID': entity_id,
+        'Name': entity_names.get(entity_id, entity_id),
+        'Type': entity_types.get(entity_id, 'Unknown'),
+        'UltimateOwnership': total_ownership
+      }
+  return ultimate_ownership
+
+@instrument()
+def propagate_ultimate_ownership(entities: pd.DataFrame, relationships: pd.DataFrame, target: str, store=None):
+  """Single backward pass from the target; same result shape as compute_all_ultimate_ownership"""
+  radj = store.equity_in if store is not None else build_reverse_adj(relationships, rel_type="Equity")
+  values, self_stake = stakes_in_target(radj, target)
+  return ownership_records(entities, values, self_stake, target)
+
+def build_board(df: pd.DataFrame):
+  """Map each entity to its (director, pct) pairs, pct being unused, as GraphStore.directorship_in does"""
+  board = defaultdict(list)
+  rels = df[df["RelationshipType"] == "Directorship"]
+  for director, owned in zip(rels["OwnerID"], rels["OwnedID"]):
+    board[owned].append((director, 0.0))
+  return board
+
+def _control_of(node: str, votes_in: dict, board_in: dict, ctrl: dict, majority: float) -> dict:
+  """Controllers of node given its holders' controllers: {controller: "votes" / "board" / "votes and board"}"""
+  # A holder's votes (and a director's seat) count for the holder and for everyone controlling it
+  votes = defaultdict(float)
+  for holder, pct in votes_in.get(node, ()):
+    votes[holder] += pct
+    for c in ctrl.get(holder, ()):
+      votes[c] += pct
+  directors = {d for d, _ in board_in.get(node, ())}
+  seats = defaultdict(int)
+  for d in directors:
+    seats[d] += 1
+    for c in ctrl.get(d, ()):
+      seats[c] += 1
+  out = {c: "votes" for c, v in votes.items() if v > majority and c != node}
+  for c, n in seats.items():
+    if n > majority * len(directors) and c != node:
+      out[c] = "votes and board" if c in out else "board"
+  return out
+
+@instrument()
+def propagate_control(relationships: pd.DataFrame, target: str, store=None, majority: float = 0.5):
+  """Entities controlling target through a majority of votes (equity) or of its board, directly or via entities they control"""
+  votes_in = store.equity_in if store is not None else build_reverse_adj(relationships, rel_type="Equity")
+  board_in = store.directorship_in if store is not None else build_board(relationships)
+
+  # Only entities with a route of shares or seats into the target can control it
+  reachable = {target}
+  frontier = [target]
+  dependants = defaultdict(list)
+  while frontier:
+    node = frontier.pop()
+    for holder, _ in list(votes_in.get(node, ())) + list(board_in.get(node, ())):
+      dependants[holder].append(node)
+      if holder not in reachable:
+        reachable.add(holder)
+        frontier.append(holder)
+
+  # Worklist fixpoint. Holders are queued before what they hold (SCCs come out sinks
+  # first), so on an acyclic structure every entity is evaluated once, at a cost of
+  # its in-edges times its holders' controller counts; inside a cross-holding an
+  # entity is requeued whenever a holder's controllers grow. Sets only grow, so
+  # this terminates.
+  succ = {n: sorted(set(dependants.get(n, ()))) for n in reachable}
+  order = [n for comp in reversed(strongly_connected_components(sorted(reachable), succ)) for n in comp]
+  ctrl = {}
+  queue = deque(order)
+  queued = set(order)
+  evaluations = 0
+  while queue:
+    node = queue.popleft()
+    queued.discard(node)
+    evaluations += 1
+    found = _control_of(node, votes_in, board_in, ctrl, majority)
+    if found != ctrl.get(node, {}):
+      ctrl[node] = found
+      for d in succ[node]:
+        if d not in queued:
+          queued.add(d)
+          queue.append(d)
+  count("control evaluations", evaluations)
+  return ctrl.get(target, {})
+
+def iter_paths(source: str, target: str, adj: dict, min_product: float = 0.0, max_depth: int = None):
+  """Lazy find_paths; a branch is abandoned once its running product falls below min_product"""
+  path = [source]
+  on_path = {source}
+  products = [1.0]
+  stack = [iter(adj.get(source, ()))]
+  # Kept in locals and reported once, when the generator finishes or is closed
+  expanded = found = deepest = 0
+  try:
+    while stack:
+      for child, pct in stack[-1]:
+        product = products[-1] * pct
+        if child in on_path or product < min_product:
+          continue
+        if child == target:
+          found += 1
+          yield path + [child], product
+          continue
+        # len(path) edges would already be used once we step onto child
+        if max_depth is not None and len(path) >= max_depth:
+          continue
+        path.append(child)
+        on_path.add(child)
+        products.append(product)
+        stack.append(iter(adj.get(child, ())))
+        expanded += 1
+        if len(stack) > deepest:
+          deepest = len(stack)
+        break
+      else:
+        stack.pop()
+        on_path.discard(path.pop())
+        products.pop()
+  finally:
+    count("path nodes expanded", expanded)
+    count("paths found", found)
+    record_max("max DFS depth", deepest)
+
+@instrument()
+def find_paths(source: str, target: str, adj: dict): 
+  out = [] 
+  stack = [(source, [source], 1.0)] 
+  while stack: 
+    node, path, product = stack.pop() 
+    if node == target and len(path) > 1: 
+      out.append((path, product)) 
+      continue 
+    for child, pct in adj.get(node, []):
+      if child in path: 
+        continue  
+      stack.append((child, path + [child], product * pct)) 
+  # Counted from the result so the search loop itself carries no bookkeeping; that gives
+  # the longest path found, not how deep the stack went (iter_paths reports that)
+  count("paths found", len(out))
+  if out:
+    record_max("longest path found (links)", max(len(p) for p, _ in out) - 1)
+  return out
+
+@instrument()
+def compute_all_ultimate_ownership(entities: pd.DataFrame, relationships: pd.DataFrame, target: str):
+  """Calculate ultimate ownership of target for ALL entities (not just above threshold)"""
+  adj = build_adj(relationships, rel_type="Equity") 
+  # In frame order, so the result does not depend on string hashing
+  all_entity_ids = dict.fromkeys(entities['EntityID'])
+  entity_names = entities.set_index("EntityID")["Name"].to_dict()
+  entity_types = entities.set_index("EntityID")["Type"].to_dict()
+  
+  # Calculate for every entity
+  ultimate_ownership = {}
+  
+  for entity_id in all_entity_ids:
+    paths = find_paths(entity_id, target, adj)
+    total_ownership = sum(prod for _, prod in paths)
+    if total_ownership > 0:
+      ultimate_ownership[entity_id] = {
+        'EntityID': entity_id,
+        'Name': entity_names.get(entity_id, entity_id),
+        'Type': entity_types.get(entity_id, 'Unknown'),
+        'UltimateOwnership': total_ownership
+      }
+  
+  return ultimate_ownership
+
+@instrument()
+def compute_ubo(entities: pd.DataFrame, relationships: pd.DataFrame, target: str, threshold: float, ultimate_ownership: dict = None, control: dict = None): 
+  """Aggregated stake, control and UBO flag per owner; paths are listed separately by ubo_path_trie"""
+  if ultimate_ownership is None:
+    ultimate_ownership = propagate_ultimate_ownership(entities, relationships, target)
+  if control is None:
+    control = propagate_control(relationships, target)
+  rows = [{"OwnerID": u['EntityID'], "OwnerName": u['Name'], "AggregatedOwnershipPct": u['UltimateOwnership']} for u in ultimate_ownership.values()]
+  # Controllers without any equity route still belong in the list
+  entity_names = None
+  for controller in control:
+    if controller not in ultimate_ownership:
+      if entity_names is None:
+        entity_names = entities.set_index("EntityID")["Name"].to_dict()
+      rows.append({"OwnerID": controller, "OwnerName": entity_names.get(controller, controller), "AggregatedOwnershipPct": 0.0})
+  if not rows:
+    return pd.DataFrame(columns=["OwnerID","OwnerName","AggregatedOwnershipPct","Control","UBO_Flag"])
+
+  agg = pd.DataFrame(rows)
+  agg['Control'] = agg['OwnerID'].map(control).fillna("")
+  agg['UBO_Flag'] = meets_threshold(agg['AggregatedOwnershipPct'], threshold) | (agg['Control'] != "")
+  agg.sort_values('AggregatedOwnershipPct', ascending=False, inplace=True) 
+  return agg
+
+@instrument()
+def ownership_sums_per_entity(relationships: pd.DataFrame): 
+  df = relationships[relationships['RelationshipType']=="Equity"].copy()
+  if df.empty:
+    return pd.DataFrame(columns=['OwnedID', 'OwnershipPct'])
+  df['OwnershipPct'] = df['OwnershipPct'].astype(float) 
+  sums = df.groupby('OwnedID')['OwnershipPct'].sum().reset_index() 
+  return sums
+
+def get_relationship_status(owner_id: str, owned_id: str, store):
+  """Check if an entity is a shareholder, director, or both"""
+  return store.status(owner_id, owned_id)
+
+@instrument()
+def compute_ubo_records(store, target: str, threshold: float, stakes: dict = None):
+  """compute_ubo rows for one target read straight from a GraphStore, for batch runs.
+  stakes, if given, is {EntityID: stake in target} (the target's own included), e.g. from OwnershipMatrix.stakes_in."""
+  if stakes is None:
+    values, self_stake = stakes_in_target(store.equity_in, target)
+    stakes = dict(values)
+    stakes[target] = self_stake
+  control = propagate_control(None, target, store=store)
+  rows = []
+  for entity_id in list(stakes) + [c for c in control if c not in stakes]:
+    stake = stakes.get(entity_id, 0.0)
+    how = control.get(entity_id, "")
+    rec = store.record(entity_id)
+    # Only entities from the entities file are reported, as in ownership_records
+    if (stake <= 0 and not how) or rec is None or rec.idx >= store.entity_count:
+      continue
+    rows.append({"OwnerID": entity_id, "OwnerName": rec.name, "AggregatedOwnershipPct": stake, "Control": how, "UBO_Flag": meets_threshold(stake, threshold) or bool(how)})
+  rows.sort(key=lambda r: r["AggregatedOwnershipPct"], reverse=True)
+  return rows